@@ -0,0 +1,27 @@
+"""Compare counting and summing by looping over the entities of exec() with the count() and sum() aggregates."""
+from benchmarks.common import arg_parser, write_all_value_types, temp_database_dir, best_time, report
+from ormy.csv_database import CsvDatabase
+from tests.models_for_testing import AllValueTypes
+
+
+def main():
+    args = arg_parser(__doc__).parse_args()
+    with temp_database_dir() as path:
+        write_all_value_types(path, args.rows)
+        db = CsvDatabase(path)
+
+        before, expected = best_time(lambda: len(db.query(AllValueTypes).exec()), args.repeat)
+        after, actual = best_time(db.query(AllValueTypes).count, args.repeat)
+        assert expected == actual
+        report('len(exec())', args.rows, before)
+        report('count()', args.rows, after, before)
+
+        before, expected = best_time(lambda: sum(e.float_col for e in db.query(AllValueTypes).exec()), args.repeat)
+        after, actual = best_time(lambda: db.query(AllValueTypes).sum('float_col'), args.repeat)
+        assert abs(expected - actual) < 1e-6 * abs(expected)
+        report('sum over exec()', args.rows, before)
+        report("sum('float_col')", args.rows, after, before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Run several queries from an asyncio event loop: called directly on the loop one after the other, concurrently with
+aexec() and concurrently with astream(). Reports the time to answer them all and the longest time the loop was blocked,
+measured by a task waking up every millisecond. rows/sec is rows scanned per second over all the queries."""
+import asyncio
+import time
+
+from benchmarks.common import arg_parser, report, temp_database_dir, write_all_value_types
+from ormy.async_database import AsyncDatabase
+from ormy.csv_database import CsvDatabase
+from tests.models_for_testing import AllValueTypes
+
+
+def main():
+    parser = arg_parser(__doc__)
+    parser.add_argument('--queries', type=int, default=8, help='number of queries run at the same time')
+    parser.add_argument('--workers', type=int, default=4, help='threads of the AsyncDatabase')
+    args = parser.parse_args()
+    with temp_database_dir() as path:
+        write_all_value_types(path, args.rows)
+        adb = AsyncDatabase(CsvDatabase(path), max_workers=args.workers)
+
+        def query(i):
+            return adb.query(AllValueTypes).field('string_col').eq().value('name%d' % i)
+
+        async def blocking():
+            return [query(i).exec() for i in range(args.queries)]
+
+        async def aexec():
+            return await asyncio.gather(*(query(i).aexec() for i in range(args.queries)))
+
+        async def astream():
+            async def collect(q):
+                return [e async for e in q.astream()]
+            return await asyncio.gather(*(collect(query(i)) for i in range(args.queries)))
+
+        async def measure(case):
+            stalls = []
+
+            async def ticker():
+                last = time.perf_counter()
+                while True:
+                    await asyncio.sleep(0.001)
+                    now = time.perf_counter()
+                    stalls.append(now - last)
+                    last = now
+
+            task = asyncio.create_task(ticker())
+            await asyncio.sleep(0.01)
+            start = time.perf_counter()
+            results = await case()
+            elapsed = time.perf_counter() - start
+            # let the ticker see a stall that lasted until the end
+            await asyncio.sleep(0.01)
+            task.cancel()
+            return elapsed, max(stalls), results
+
+        scanned = args.rows * args.queries
+        baseline = None
+        expected = None
+        for name, case in (('exec on the loop', blocking), ('aexec', aexec), ('astream', astream)):
+            elapsed, stall, results = asyncio.run(measure(case))
+            lengths = [len(r) for r in results]
+            assert expected is None or lengths == expected
+            expected = lengths
+            report(name, scanned, elapsed, baseline)
+            print('%-40s %10.3fs' % ('  longest loop stall', stall))
+            baseline = baseline or elapsed
+        adb.close()
+
+
+if __name__ == '__main__':
+    main()
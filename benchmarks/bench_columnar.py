@@ -0,0 +1,29 @@
+"""Compare the row at a time CsvQueryEngine with the NumPy ColumnarCsvQueryEngine on warm, i.e. already loaded, data."""
+from benchmarks.common import arg_parser, write_all_value_types, temp_database_dir, best_time, report
+from ormy.csv_database import CsvDatabase
+from tests.models_for_testing import AllValueTypes
+
+
+def main():
+    args = arg_parser(__doc__).parse_args()
+    with temp_database_dir() as path:
+        write_all_value_types(path, args.rows)
+        row_db = CsvDatabase(path, cache_size=1024 * 1024 * 1024)
+        columnar_db = CsvDatabase(path, columnar=True)
+
+        def query(db):
+            return db.query(AllValueTypes).field('string_col').eq().value('name7').AND().field('float_col').eq() \
+                .value(0.0).OR().field('int_col').eq().value(args.rows // 2)
+
+        load, _ = best_time(lambda: columnar_db.query(AllValueTypes).limit(0).exec(), 1)
+        report('columnar load (cold)', args.rows, load)
+        row_db.query(AllValueTypes).limit(0).exec()
+        before, expected = best_time(query(row_db).exec, args.repeat)
+        after, actual = best_time(query(columnar_db).exec, args.repeat)
+        assert len(expected) == len(actual)
+        report('row engine, cached table', args.rows, before)
+        report('columnar engine', args.rows, after, before)
+
+
+if __name__ == '__main__':
+    main()
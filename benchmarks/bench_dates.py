@@ -0,0 +1,39 @@
+"""Compare casting the dates of AllValueTypes, format '%Y-%m-%d %H:%M:%S.%f', with strptime and with DateColumnType,
+for distinct and for repeated timestamps, and a columnar load of the column."""
+from datetime import datetime
+
+from benchmarks.common import arg_parser, START_DATE, best_time, report
+from ormy.column import DateColumnType
+from tests.models_for_testing import AllValueTypes
+
+try:
+    import numpy as np
+    from ormy.columnar_query_engine import ColumnTable
+except ImportError:
+    np = None
+
+
+def main():
+    args = arg_parser(__doc__, rows=200000).parse_args()
+    date_format = AllValueTypes.ALL_VALUE_TYPES_FORMAT_STR
+    distinct = [START_DATE.replace(microsecond=i % 1000000, second=i // 1000000 % 60).strftime(date_format)
+                for i in range(args.rows)]
+    # e.g. events logged at the same few thousand instants
+    repeated = [distinct[i % 1000] for i in range(args.rows)]
+
+    for name, strings in [('distinct', distinct), ('repeated', repeated)]:
+        before, expected = best_time(lambda: [datetime.strptime(s, date_format) for s in strings], args.repeat)
+        column_type = DateColumnType(date_format)
+        after, actual = best_time(lambda: [column_type.cast(s) for s in strings], args.repeat)
+        assert expected == actual
+        report('strptime, %s' % name, args.rows, before)
+        report('DateColumnType.cast, %s' % name, args.rows, after, before)
+
+    if np is not None:
+        column_type = DateColumnType(date_format, memo_size=0)
+        after, _ = best_time(lambda: ColumnTable.to_array(column_type, distinct), args.repeat)
+        report('columnar to_array, distinct', args.rows, after, before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Cost of merging a delta log of updates and deletes into scans of Employee rows: a filter over the whole file with no
+log, with logs of 100 and of 10k entries, half updates and half deletes, and after compacting the 10k log into the
+file. The streamed engine merges the log into the rows as they are read, the cached engine merges it once into a copy
+of the cached rows and reuses it until the log changes. Also times recording the 10k entries and compacting them."""
+import os
+import random
+import time
+
+from benchmarks.common import arg_parser, best_time, report, temp_database_dir
+from ormy.csv_database import CsvDatabase
+from ormy.delta_log import DeltaLog
+from tests.models_for_testing import Employee
+
+
+def write_employees(path, rows):
+    with open(os.path.join(path, Employee.__csv_file__), 'w') as f:
+        f.write('id,last_name,salary\n')
+        for i in range(rows):
+            f.write('%d,name%d,%d\n' % (i, i % 1000, i % 10000))
+
+
+def record_changes(db, rows, entries, seed=0):
+    rnd = random.Random(seed)
+    keys = rnd.sample(range(rows), entries)
+    db.update_many(Employee, ({'id': k, 'salary': 20000} for k in keys[:entries // 2]))
+    db.delete_many(Employee, keys[entries // 2:])
+
+
+def main():
+    args = arg_parser(__doc__, rows=1000000).parse_args()
+    with temp_database_dir() as path:
+        log = os.path.join(path, Employee.__csv_file__) + DeltaLog.SUFFIX
+        for name, kwargs in (('streamed', {}), ('cached', {'cache_size': 2 * 1024 * 1024 * 1024})):
+            write_employees(path, args.rows)
+            db = CsvDatabase(path, **kwargs)
+
+            def scan():
+                return len(db.query(Employee).field('salary').ge().value(5000).exec())
+
+            baseline, _ = best_time(scan, args.repeat)
+            report('%s, no delta log' % name, args.rows, baseline)
+            for entries in (min(100, args.rows), min(10000, args.rows)):
+                if os.path.exists(log):
+                    os.remove(log)
+                start = time.perf_counter()
+                record_changes(db, args.rows, entries)
+                recorded = time.perf_counter() - start
+                seconds, _ = best_time(scan, args.repeat)
+                report('%s, %d entries' % (name, entries), args.rows, seconds, baseline)
+            print('  recording %d entries: %.3fs' % (entries, recorded))
+            start = time.perf_counter()
+            db.compact(Employee)
+            print('  compacting %d entries: %.3fs' % (entries, time.perf_counter() - start))
+            seconds, _ = best_time(scan, args.repeat)
+            report('%s, compacted' % name, args.rows - entries // 2, seconds, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""Measure the memory per row of query results built as plain model instances and as compact (__slots__) ones."""
+import tracemalloc
+
+from benchmarks.common import arg_parser, write_all_value_types, temp_database_dir, best_time, report
+from ormy.csv_database import CsvDatabase
+from tests.models_for_testing import AllValueTypes
+
+
+def result_bytes(query, touch_dict=False):
+    """bytes allocated by, and still held by, the result of query"""
+    tracemalloc.start()
+    try:
+        data = query()
+        if touch_dict:
+            # what the assert on len(instance.__dict__) used to do for every row, it makes the instance allocate a
+            # dict for its attributes
+            for e in data:
+                len(e.__dict__)
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return size, len(data)
+
+
+def main():
+    args = arg_parser(__doc__).parse_args()
+    with temp_database_dir() as path:
+        write_all_value_types(path, args.rows)
+        plain_db = CsvDatabase(path)
+        compact_db = CsvDatabase(path, compact_entities=True)
+
+        cases = [('plain, __dict__ materialized', plain_db, True), ('plain', plain_db, False),
+                 ('compact', compact_db, False)]
+        for name, db, touch_dict in cases:
+            size, rows = result_bytes(db.query(AllValueTypes).exec, touch_dict)
+            print('%-40s %10.1f bytes/row' % (name, size / rows))
+
+        before, _ = best_time(plain_db.query(AllValueTypes).exec, args.repeat)
+        after, _ = best_time(compact_db.query(AllValueTypes).exec, args.repeat)
+        report('plain', args.rows, before)
+        report('compact', args.rows, after, before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Compare the per row interpretation of the filter tree, as the engine filtered before filters were compiled, with the
+compiled filter."""
+import csv
+import os
+
+from benchmarks.common import arg_parser, write_all_value_types, temp_database_dir, best_time, report
+from ormy.csv_database import CsvDatabase
+from ormy.query_engine import AndExpr, CompExpr, FieldExpr, FieldLambdaExpr, OrExpr, RecordLambdaExpr, ValueExpr, \
+    WholeRecordExpr
+from tests.models_for_testing import AllValueTypes
+
+
+def entity_from_dict(row_data):
+    entity = AllValueTypes()
+    for column in AllValueTypes.columns:
+        setattr(entity, column.field, column.column_type.cast(row_data[column.file_column_name]))
+    return entity
+
+
+def interpret(expr, entity):
+    """the value of expr for entity, walking the tree"""
+    if isinstance(expr, CompExpr):
+        return expr.op(interpret(expr.left, entity), interpret(expr.right, entity))
+    elif isinstance(expr, FieldExpr):
+        return getattr(entity, expr.field)
+    elif isinstance(expr, WholeRecordExpr):
+        return entity
+    elif isinstance(expr, (FieldLambdaExpr, RecordLambdaExpr)):
+        return expr.func(interpret(expr.left, entity))
+    elif isinstance(expr, ValueExpr):
+        return expr.value
+    elif isinstance(expr, AndExpr):
+        return interpret(expr.left, entity) and interpret(expr.right, entity)
+    elif isinstance(expr, OrExpr):
+        return interpret(expr.left, entity) or interpret(expr.right, entity)
+    raise TypeError("can't interpret %s" % type(expr).__name__)
+
+
+def interpreted_scan(path, filter_expr):
+    """the scan loop as it was before filters were compiled: walk the tree for every row"""
+    matches = []
+    with open(os.path.join(path, AllValueTypes.__csv_file__), newline='') as f:
+        for row_data in csv.DictReader(f):
+            entity = entity_from_dict(row_data)
+            if interpret(filter_expr, entity):
+                matches.append(entity)
+    return matches
+
+
+def main():
+    args = arg_parser(__doc__).parse_args()
+    with temp_database_dir() as path:
+        write_all_value_types(path, args.rows)
+        db = CsvDatabase(path)
+        query = db.query(AllValueTypes).field('int_col').flambda(lambda v: v % 100 == 0) \
+            .AND().field('string_col').eq().value('name1').OR().field('float_col').eq().value(-1.0)
+        filter_expr = query.compile().left
+
+        before, expected = best_time(lambda: interpreted_scan(path, filter_expr), args.repeat)
+        after, actual = best_time(query.exec, args.repeat)
+        assert len(expected) == len(actual)
+        report('interpreted filter', args.rows, before)
+        report('compiled filter', args.rows, after, before)
+
+
+if __name__ == '__main__':
+    main()
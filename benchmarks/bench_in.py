@@ -0,0 +1,26 @@
+"""Compare filtering on membership in a list of ids through an flambda with the in_() operator."""
+from benchmarks.common import arg_parser, write_all_value_types, temp_database_dir, best_time, report
+from ormy.csv_database import CsvDatabase
+from tests.models_for_testing import AllValueTypes
+
+
+def main():
+    parser = arg_parser(__doc__)
+    parser.add_argument('--ids', type=int, default=1000, help='number of ids to look for')
+    args = parser.parse_args()
+    with temp_database_dir() as path:
+        write_all_value_types(path, args.rows)
+        db = CsvDatabase(path, cache_size=1024 * 1024 * 1024)
+        ids = list(range(0, args.rows, max(1, args.rows // args.ids)))
+        db.query(AllValueTypes).limit(0).exec()
+
+        before, expected = best_time(db.query(AllValueTypes).field('int_col').flambda(lambda v: v in ids).exec,
+                                     args.repeat)
+        after, actual = best_time(db.query(AllValueTypes).field('int_col').in_(ids).exec, args.repeat)
+        assert len(expected) == len(actual)
+        report('flambda over a list', args.rows, before)
+        report('in_()', args.rows, after, before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Rows/sec of loading AllValueTypes rows: written by hand with csv.writer and strftime, the way ingestion jobs did it,
+versus insert_many() of model instances, built with Model.create(), and of dicts. insert_many() validates each value
+and writes it with its column type. Each case appends to an empty file. For the 10M row load run it with --rows 10000000 --repeat 1."""
+import csv
+import os
+from datetime import timedelta
+
+from benchmarks.common import START_DATE, arg_parser, best_time, report, temp_database_dir
+from ormy.csv_database import CsvDatabase
+from tests.models_for_testing import AllValueTypes
+
+
+def values(rows):
+    for i in range(rows):
+        yield {'int_col': i, 'float_col': i / 7.0, 'string_col': 'name%d' % (i % 1000),
+               'date_col': START_DATE + timedelta(seconds=i)}
+
+
+def main():
+    args = arg_parser(__doc__, rows=1000000).parse_args()
+    with temp_database_dir() as path:
+        file = os.path.join(path, AllValueTypes.__csv_file__)
+        db = CsvDatabase(path)
+
+        def by_hand():
+            with open(file, 'w', newline='') as f:
+                writer = csv.writer(f, lineterminator='\n')
+                writer.writerow(['int_col', 'float_col', 'string_col', 'date_col'])
+                for v in values(args.rows):
+                    writer.writerow([v['int_col'], v['float_col'], v['string_col'],
+                                     v['date_col'].strftime(AllValueTypes.ALL_VALUE_TYPES_FORMAT_STR)])
+
+        def insert(make):
+            os.remove(file)
+            return db.insert_many(AllValueTypes, map(make, values(args.rows)))
+
+        before, _ = best_time(by_hand, args.repeat)
+        entities, count = best_time(lambda: insert(AllValueTypes.create), args.repeat)
+        assert count == args.rows
+        dicts, _ = best_time(lambda: insert(dict), args.repeat)
+        assert db.query(AllValueTypes).count() == args.rows
+        report('csv.writer by hand', args.rows, before)
+        report('insert_many entities', args.rows, entities, before)
+        report('insert_many dicts', args.rows, dicts, before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""Compare a single process scan with scans split over several worker processes."""
+from benchmarks.common import arg_parser, write_all_value_types, temp_database_dir, best_time, report
+from ormy.csv_database import CsvDatabase
+from tests.models_for_testing import AllValueTypes
+
+
+def main():
+    parser = arg_parser(__doc__, rows=500000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, 8])
+    args = parser.parse_args()
+    with temp_database_dir() as path:
+        write_all_value_types(path, args.rows)
+
+        def query(db):
+            # the date column is cast for every row, which is what the workers share
+            return db.query(AllValueTypes).field('date_col').flambda(lambda d: d.month == 2 and d.day == 29)
+
+        baseline, expected = best_time(query(CsvDatabase(path)).exec, args.repeat)
+        report('1 process', args.rows, baseline)
+        for workers in args.workers:
+            db = CsvDatabase(path, workers=workers, parallel_min_bytes=0)
+            seconds, actual = best_time(query(db).exec, args.repeat)
+            assert [e.int_col for e in actual] == [e.int_col for e in expected]
+            report('%d workers' % workers, args.rows, seconds, baseline)
+
+
+if __name__ == '__main__':
+    main()
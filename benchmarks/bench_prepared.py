@@ -0,0 +1,31 @@
+"""Compare the cost of turning a query into its expression tree: parsed every time, linked up from the plan cache and
+bound to a prepared query. The query isn't run, only its preparation is timed."""
+from benchmarks.common import arg_parser, best_time, report
+from ormy.datatabase import Database, Param
+from ormy.query_engine import QueryEngine
+from tests.models_for_testing import AllValueTypes
+
+
+def main():
+    args = arg_parser(__doc__, rows=20000).parse_args()
+
+    def build(db, value):
+        return db.query(AllValueTypes).field('int_col').ge().value(value).AND().field('string_col').eq() \
+            .value('name7').OR().field('float_col').between(0.0, 1.0).order_by('int_col').limit(10)
+
+    def compile_all(db):
+        return [build(db, i).compile() for i in range(args.rows)]
+
+    uncached_db = Database(QueryEngine(plan_cache_size=0))
+    cached_db = Database()
+    before, _ = best_time(lambda: compile_all(uncached_db), args.repeat)
+    after, _ = best_time(lambda: compile_all(cached_db), args.repeat)
+    prepared = cached_db.prepare(build(cached_db, Param('value')))
+    bound, _ = best_time(lambda: [prepared.bind({'value': i}) for i in range(args.rows)], args.repeat)
+    report('build and parse', args.rows, before)
+    report('build and plan cache', args.rows, after, before)
+    report('prepared bind', args.rows, bound, before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+"""Compare materializing every row before filtering with pushing the filter down onto the raw csv row."""
+import csv
+import os
+
+from benchmarks.bench_filter import entity_from_dict
+from benchmarks.common import arg_parser, write_all_value_types, temp_database_dir, best_time, report
+from ormy.csv_database import CsvDatabase
+from tests.models_for_testing import AllValueTypes
+
+
+def materialize_then_filter(engine, filter_expr):
+    """cast every column and build the model instance for every row, then filter"""
+    predicate = engine.compile_filter(filter_expr)
+    with open(os.path.join(engine.path, AllValueTypes.__csv_file__), newline='') as f:
+        return [e for e in map(entity_from_dict, csv.DictReader(f)) if predicate(e)]
+
+
+def main():
+    args = arg_parser(__doc__).parse_args()
+    with temp_database_dir() as path:
+        write_all_value_types(path, args.rows)
+        db = CsvDatabase(path)
+        # roughly 0.1% of the rows match
+        query = db.query(AllValueTypes).field('string_col').eq().value('name7')
+        filter_expr = query.compile().left
+
+        before, expected = best_time(lambda: materialize_then_filter(db.query_engine, filter_expr), args.repeat)
+        after, actual = best_time(query.exec, args.repeat)
+        assert len(expected) == len(actual)
+        report('materialize then filter', args.rows, before)
+        report('filter pushed down onto raw rows', args.rows, after, before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""Compare running the same dashboard query repeatedly with and without a ResultCache, on a table cache so the
+uncached runs don't include reading the file. rows/sec is queries answered per second."""
+from benchmarks.common import arg_parser, best_time, report, temp_database_dir, write_all_value_types
+from ormy.csv_database import CsvDatabase
+from tests.models_for_testing import AllValueTypes
+
+
+def main():
+    parser = arg_parser(__doc__, rows=20000)
+    parser.add_argument('--queries', type=int, default=200, help='number of times the query is run')
+    args = parser.parse_args()
+    with temp_database_dir() as path:
+        write_all_value_types(path, args.rows)
+
+        def run(db):
+            return [db.query(AllValueTypes).field('string_col').eq().value('name7').OR().field('int_col').lt()
+                    .value(100).order_by('float_col').exec() for _ in range(args.queries)]
+
+        uncached_db = CsvDatabase(path, cache_size=1024 ** 3)
+        cached_db = CsvDatabase(path, cache_size=1024 ** 3, result_cache_size=16)
+        before, expected = best_time(lambda: run(uncached_db), args.repeat)
+        after, results = best_time(lambda: run(cached_db), args.repeat)
+        assert [len(r) for r in results] == [len(r) for r in expected]
+        report('no result cache', args.queries, before)
+        report('result cache', args.queries, after, before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""Compare running several filtered queries on one model one after the other, each scanning the file, with
+exec_many(), which filters them all in one pass over the file. rows/sec is rows filtered per second over all queries."""
+from benchmarks.common import arg_parser, best_time, report, temp_database_dir, write_all_value_types
+from ormy.csv_database import CsvDatabase
+from tests.models_for_testing import AllValueTypes
+
+
+def main():
+    parser = arg_parser(__doc__)
+    parser.add_argument('--queries', type=int, default=10, help='number of queries on the model')
+    args = parser.parse_args()
+    with temp_database_dir() as path:
+        write_all_value_types(path, args.rows)
+        db = CsvDatabase(path)
+        queries = [db.query(AllValueTypes).field('string_col').eq().value('name%d' % i).OR().field('float_col')
+                   .lt().value(i / 10.0) for i in range(args.queries)]
+        before, expected = best_time(lambda: [q.exec() for q in queries], args.repeat)
+        after, results = best_time(lambda: db.exec_many(queries), args.repeat)
+        assert [len(r) for r in results] == [len(r) for r in expected]
+        filtered = args.rows * args.queries
+        report('one scan per query', filtered, before)
+        report('exec_many shared scan', filtered, after, before)
+
+
+if __name__ == '__main__':
+    main()
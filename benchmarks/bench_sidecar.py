@@ -0,0 +1,27 @@
+"""Compare loading a file into the columnar engine from the csv file with loading it from its binary sidecar, as a
+freshly started process would."""
+from benchmarks.common import arg_parser, write_all_value_types, temp_database_dir, best_time, report
+from ormy.csv_database import CsvDatabase
+from tests.models_for_testing import AllValueTypes
+
+
+def main():
+    args = arg_parser(__doc__).parse_args()
+    with temp_database_dir() as path:
+        write_all_value_types(path, args.rows)
+
+        def cold_load(column_sidecars):
+            # a new database has no column tables loaded yet
+            db = CsvDatabase(path, columnar=True, column_sidecars=column_sidecars)
+            return db.query(AllValueTypes).field('int_col').eq().value(args.rows // 2).exec()
+
+        before, expected = best_time(lambda: cold_load(False), args.repeat)
+        cold_load(True)
+        after, actual = best_time(lambda: cold_load(True), args.repeat)
+        assert len(expected) == len(actual) == 1
+        report('parse csv', args.rows, before)
+        report('map sidecar', args.rows, after, before)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Cost of tracing a filtered scan of AllValueTypes rows: no tracer, a tracer dropping the spans and a JsonLinesTracer
+writing them out. With a tracer every row read, field cast and entity built is timed. Prints the spans of the last
+traced run, i.e. where the time of the query goes."""
+import io
+import json
+
+from benchmarks.common import arg_parser, best_time, report, temp_database_dir, write_all_value_types
+from ormy.csv_database import CsvDatabase
+from ormy.tracing import JsonLinesTracer
+from tests.models_for_testing import AllValueTypes
+
+
+def main():
+    args = arg_parser(__doc__).parse_args()
+    with temp_database_dir() as path:
+        write_all_value_types(path, args.rows)
+        db = CsvDatabase(path)
+
+        def scan():
+            return len(db.query(AllValueTypes).field('float_col').lt().value(100.0).exec())
+
+        before, expected = best_time(scan, args.repeat)
+        db.set_tracer(lambda span: None)
+        dropped, count = best_time(scan, args.repeat)
+        assert count == expected
+        out = io.StringIO()
+        db.set_tracer(JsonLinesTracer(out))
+        written, _ = best_time(scan, args.repeat)
+        db.set_tracer(None)
+        report('no tracer', args.rows, before)
+        report('tracer dropping spans', args.rows, dropped, before)
+        report('JsonLinesTracer', args.rows, written, before)
+        for line in out.getvalue().splitlines()[-5:]:
+            span = json.loads(line)
+            print('  %-8s %8.3fs  %s' % (span['name'], span['duration'], ', '.join(
+                '%s=%s' % (k, span[k]) for k in ('rows_read', 'bytes_read', 'values_cast', 'rows_cast', 'rows_matched')
+                if k in span)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Helpers shared by the benchmark scripts. Run a benchmark from the repository root, e.g.
+
+    python -m benchmarks.bench_filter --rows 200000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from tests.models_for_testing import AllValueTypes
+
+START_DATE = datetime(2020, 8, 19, 17, 44, 49, 732176)
+
+
+def arg_parser(description, rows=100000):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--rows', type=int, default=rows, help='number of rows in the generated csv file')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the best one is reported')
+    return parser
+
+
+def write_all_value_types(path, rows, seed=0):
+    """write an AllValueTypes csv file with int_col running from 0 to rows - 1"""
+    rnd = random.Random(seed)
+    with open(os.path.join(path, AllValueTypes.__csv_file__), 'w', newline='') as f:
+        f.write('int_col,float_col,string_col,date_col\n')
+        for i in range(rows):
+            date = START_DATE + timedelta(seconds=rnd.randrange(86400 * 365))
+            f.write('%d,%f,name%d,%s\n' % (i, rnd.random() * 1000, rnd.randrange(1000),
+                                           date.strftime(AllValueTypes.ALL_VALUE_TYPES_FORMAT_STR)))
+
+
+def temp_database_dir():
+    return tempfile.TemporaryDirectory(prefix='ormy-bench-')
+
+
+def best_time(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def report(name, rows, seconds, baseline=None):
+    line = '%-40s %10.3fs %12.0f rows/sec' % (name, seconds, rows / seconds)
+    if baseline is not None:
+        line += '  (x%.2f)' % (baseline / seconds)
+    print(line)
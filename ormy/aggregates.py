@@ -0,0 +1,133 @@
+class Count(object):
+    def __init__(self):
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+
+    def result(self):
+        return self.count
+
+
+class Sum(object):
+    def __init__(self):
+        self.total = 0
+
+    def add(self, value):
+        self.total += value
+
+    def result(self):
+        return self.total
+
+
+class Min(object):
+    def __init__(self):
+        self.value = None
+
+    def add(self, value):
+        if value != value:
+            # NaN, which would compare false with everything after it
+            return
+        if self.value is None or value < self.value:
+            self.value = value
+
+    def result(self):
+        return self.value
+
+
+class Max(object):
+    def __init__(self):
+        self.value = None
+
+    def add(self, value):
+        if value != value:
+            # NaN, which would compare false with everything after it
+            return
+        if self.value is None or value > self.value:
+            self.value = value
+
+    def result(self):
+        return self.value
+
+
+class Avg(object):
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+    def add(self, value):
+        self.total += value
+        self.count += 1
+
+    def result(self):
+        return None if self.count == 0 else self.total / self.count
+
+
+# name used in queries -> class folding the values of a field
+AGGREGATES = {
+    'count': Count,
+    'sum': Sum,
+    'min': Min,
+    'max': Max,
+    'avg': Avg,
+}
+
+
+class Aggregation(object):
+    """Aggregates computed over the records matching a query, optionally per group of records with the same values of
+       the group_by fields. Each aggregate is a (name, function, field) triple, function being a key of AGGREGATES and
+       field None for count."""
+
+    def __init__(self, aggregates, group_by=None):
+        self.aggregates = list(aggregates)
+        self.group_by = list(group_by or [])
+
+    def is_count_only(self):
+        return not self.group_by and all(function == 'count' for _, function, _ in self.aggregates)
+
+    def count_results(self, count):
+        """the results for a count_only aggregation of count records"""
+        return {name: count for name, _, _ in self.aggregates}
+
+    def fold(self, records, accessor):
+        """returns {name: result} of the aggregates over records or, with group_by, {group: {name: result}} where group
+           is the value of the group_by field, or the tuple of their values if there are several. Groups are in the
+           order they're first seen. Only the fields aggregated and grouped on are read from the records."""
+        functions = [AGGREGATES[function] for _, function, _ in self.aggregates]
+        getters = [None if field is None else accessor.field_getter(field) for _, _, field in self.aggregates]
+        steps = list(zip(range(len(functions)), getters))
+
+        def add(states, record):
+            for i, get in steps:
+                states[i].add(None if get is None else get(record))
+
+        if not self.group_by:
+            states = [f() for f in functions]
+            for record in records:
+                add(states, record)
+            return self._results(states)
+
+        group_getters = [accessor.field_getter(field) for field in self.group_by]
+        if len(group_getters) == 1:
+            key = group_getters[0]
+        else:
+            def key(record):
+                return tuple(get(record) for get in group_getters)
+        groups = {}
+        for record in records:
+            group = key(record)
+            states = groups.get(group)
+            if states is None:
+                states = groups[group] = [f() for f in functions]
+            add(states, record)
+        return {group: self._results(states) for group, states in groups.items()}
+
+    def _results(self, states):
+        return {name: state.result() for (name, _, _), state in zip(self.aggregates, states)}
+
+    def __eq__(self, other):
+        return isinstance(other, Aggregation) and self.aggregates == other.aggregates \
+               and self.group_by == other.group_by
+
+    def __str__(self):
+        return "Aggregation(aggregates=%s, group_by=%s)" % (self.aggregates, self.group_by)
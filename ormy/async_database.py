@@ -0,0 +1,94 @@
+import asyncio
+import functools
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ormy.datatabase import Database
+from ormy.parallel_scan import sequential_scans
+
+
+class AsyncDatabase(Database):
+    """Runs the queries of a database in a pool of threads so they don't block an asyncio event loop, e.g.
+
+           adb = AsyncDatabase(CsvDatabase(path))
+           people = await adb.query(Person).field('age').ge().value(18).aexec()
+           async for person in adb.query(Person).astream():
+               ...
+
+       At most max_workers queries run at once, the others wait for a thread. Reading the files releases the GIL so
+       the queries overlap their I/O. astream() reads chunk_size entities in a thread at a time and hands them out on
+       the loop, so the loop runs between chunks and cancelling the consumer stops the scan at the end of the current
+       chunk. aexec() runs the whole query in one go: a cancelled aexec() returns at once but its thread finishes the
+       query. The queries share the engine, table cache and result cache of the database. They never scan files in
+       worker processes, whatever the workers setting of the database."""
+
+    DEFAULT_MAX_WORKERS = 4
+    DEFAULT_CHUNK_SIZE = 1000
+
+    def __init__(self, database, **kwargs):
+        """kwargs:
+            max_workers - number of queries run at once (default 4)
+            chunk_size - number of entities astream() reads per step (default 1000)
+            executor - a concurrent.futures executor to use instead of a pool of max_workers threads
+        """
+        super().__init__(database.query_engine, database.result_cache)
+        self.database = database
+        self.chunk_size = kwargs.get('chunk_size', AsyncDatabase.DEFAULT_CHUNK_SIZE)
+        self.executor = kwargs.get('executor')
+        self._owns_executor = self.executor is None
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(kwargs.get('max_workers', AsyncDatabase.DEFAULT_MAX_WORKERS),
+                                               thread_name_prefix='ormy')
+
+    async def run(self, func, *args, **kwargs):
+        """the result of func(*args, **kwargs) run in a thread of the database, e.g. run(query.count) or
+           run(prepared.exec, age=18)"""
+        call = functools.partial(AsyncDatabase._call, func, args, kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    @staticmethod
+    def _call(func, args, kwargs):
+        # the queries already run side by side, their scans don't start worker processes as well
+        with sequential_scans():
+            return func(*args, **kwargs)
+
+    async def aeval(self, query):
+        return await self.run(self.eval, query)
+
+    async def aeval_iter(self, query):
+        entities = await self.run(self.eval_iter, query)
+        # the thread reading a chunk may still be running when the consumer is cancelled, closing waits for it
+        lock = threading.Lock()
+
+        def next_chunk():
+            with lock:
+                return list(itertools.islice(entities, self.chunk_size))
+
+        def close():
+            with lock:
+                if hasattr(entities, 'close'):
+                    entities.close()
+
+        try:
+            while True:
+                chunk = await self.run(next_chunk)
+                for entity in chunk:
+                    yield entity
+                if len(chunk) < self.chunk_size:
+                    break
+        finally:
+            # not awaited, the generator may be closing because its task was cancelled
+            try:
+                self.executor.submit(close)
+            except RuntimeError:
+                # the executor was shut down, no chunk is being read any more
+                close()
+
+    def close(self):
+        """shuts down the threads of the database, unless the executor was given"""
+        if self._owns_executor:
+            self.executor.shutdown(wait=True)
+
+    def __str__(self):
+        return "AsyncDatabase(%s)" % self.database
@@ -0,0 +1,24 @@
+import contextlib
+import os
+import threading
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='wb', sync=False, **kwargs):
+    """opens a temporary file next to path for writing, with the mode and the other arguments of open(), that replaces
+       the file at path in one step once the with block is done. Readers see either the old file or the whole new one,
+       nothing changes at path if the block raises. With sync the data is flushed to disk before the file is
+       replaced."""
+    # unique per process and thread, concurrent queries or several databases may write the same file
+    temp = '%s.%d-%d.tmp' % (path, os.getpid(), threading.get_ident())
+    try:
+        with open(temp, mode, **kwargs) as f:
+            yield f
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp)
+        raise
@@ -1,5 +1,7 @@
 from abc import abstractmethod, ABC
 from datetime import datetime
+from functools import lru_cache
+from operator import itemgetter
 from typing import Type
 
 from ormy.model import Model
@@ -45,6 +47,11 @@ class ColumnType(ABC):
     def cast(self, value):
         pass
 
+    @abstractmethod
+    def to_string(self, value):
+        """the inverse of cast, the string written to the file for value"""
+        pass
+
     @abstractmethod
     def __str__(self):
         pass
@@ -61,6 +68,9 @@ class IntegerColumnType(ColumnType):
     def cast(self, value):
         return int(value)
 
+    def to_string(self, value):
+        return str(value)
+
     def __str__(self):
         return "IntegerColumnType()"
 
@@ -75,20 +85,95 @@ class FloatColumnType(ColumnType):
     def cast(self, value):
         return float(value)
 
+    def to_string(self, value):
+        # the shortest string that casts back to the same float
+        return repr(value)
+
     def __str__(self):
         return "FloatColumnType()"
 
 
 class DateColumnType(ColumnType):
-    def __init__(self, date_format):
+    # number of distinct strings whose datetime is remembered, repeated timestamps are only parsed once
+    DEFAULT_MEMO_SIZE = 4096
+    # width of the directives of ISO formats, %f as written by isoformat() and strftime()
+    _ISO_DIRECTIVE_WIDTHS = {'%Y': 4, '%m': 2, '%d': 2, '%H': 2, '%M': 2, '%S': 2, '%f': 6}
+    ISO_FORMATS = ['%Y-%m-%d'] + ['%Y-%m-%d' + sep + time for sep in ' T'
+                                  for time in ['%H:%M', '%H:%M:%S', '%H:%M:%S.%f']]
+
+    # time part of the ISO formats -> timespec of isoformat() writing it
+    _ISO_TIMESPECS = {'%H:%M': 'minutes', '%H:%M:%S': 'seconds', '%H:%M:%S.%f': 'microseconds'}
+
+    def __init__(self, date_format, **kwargs):
         super().__init__()
         self.format = date_format
+        self.memo_size = kwargs.get('memo_size', DateColumnType.DEFAULT_MEMO_SIZE)
+        self.iso_shape = DateColumnType._iso_shape(date_format)
+        self._isoformat = DateColumnType._iso_writer(date_format)
+        parse = self._parse_iso if self.iso_shape is not None else self._parse_format
+        self._parse = lru_cache(maxsize=self.memo_size)(parse) if self.memo_size else parse
+
+    @staticmethod
+    def _iso_shape(date_format):
+        """for a format datetime.fromisoformat() can read, the length of the strings it matches and the positions and
+           characters of its separators, None for other formats"""
+        if date_format not in DateColumnType.ISO_FORMATS:
+            return None
+        length = 0
+        positions = []
+        separators = []
+        i = 0
+        while i < len(date_format):
+            directive = date_format[i:i + 2]
+            if directive in DateColumnType._ISO_DIRECTIVE_WIDTHS:
+                length += DateColumnType._ISO_DIRECTIVE_WIDTHS[directive]
+                i += 2
+            else:
+                positions.append(length)
+                separators.append(date_format[i])
+                length += 1
+                i += 1
+        return length, itemgetter(*positions), tuple(separators)
+
+    @staticmethod
+    def _iso_writer(date_format):
+        """a function writing a datetime in date_format with isoformat(), None if it isn't an ISO format"""
+        if date_format not in DateColumnType.ISO_FORMATS:
+            return None
+        if date_format == '%Y-%m-%d':
+            return lambda d: d.date().isoformat()
+        separator, spec = date_format[8], DateColumnType._ISO_TIMESPECS[date_format[9:]]
+        return lambda d: d.isoformat(separator, spec)
+
+    def _parse_iso(self, value):
+        # fromisoformat() takes more shapes than the format, e.g. either separator between date and time, so it's
+        # only used on strings laid out exactly as the format would write them
+        if self.matches_iso_shape(value):
+            try:
+                return datetime.fromisoformat(value)
+            except ValueError:
+                pass
+        # anything else, e.g. single digit months, gets strptime's leniency and its error messages
+        return datetime.strptime(value, self.format)
+
+    def _parse_format(self, value):
+        return datetime.strptime(value, self.format)
+
+    def matches_iso_shape(self, value):
+        return self.iso_shape is not None and len(value) == self.iso_shape[0] \
+               and self.iso_shape[1](value) == self.iso_shape[2]
 
     def compatible_type(self, value):
         return isinstance(value, datetime)
 
     def cast(self, value):
-        return datetime.strptime(value, self.format)
+        return self._parse(value)
+
+    def to_string(self, value):
+        if self._isoformat is not None and value.tzinfo is None:
+            # unlike strftime, isoformat() zero pads years before 1000 as fromisoformat() expects
+            return self._isoformat(value)
+        return value.strftime(self.format)
 
     def __str__(self):
         return "DateColumnType(format=%s)" % self.format
@@ -104,6 +189,9 @@ class StringColumnType(ColumnType):
     def cast(self, value):
         return str(value)
 
+    def to_string(self, value):
+        return value
+
     def __str__(self):
         return "StringColumnType()"
 
@@ -118,6 +206,12 @@ class Column(object):
         self.file_column_name = kwargs.get('file_column_name', field)
         self.key = kwargs.get('key')
         self.tags = kwargs.get('tags', [])
+        # index=True asks the query engine to keep a hash index on this column for eq() lookups, index='sorted' for a
+        # sorted index which also answers range comparisons
+        self.index = kwargs.get('index', False)
+        if self.index not in (False, True, 'hash', 'sorted'):
+            raise ColumnException('index of field "%s" must be True, "hash" or "sorted", not "%s"'
+                                  % (self.field, self.index))
         # TODO: check that value of object_field does not intersect with existing field
         self.object_field = kwargs.get('object_field', None)
         if self.has_fk() and 'object_field' not in kwargs:
@@ -130,9 +224,21 @@ class Column(object):
     def has_fk(self):
         return isinstance(self.key, ForeignKey)
 
-    def set_field(self, entity, value):
+    def is_primary_key(self):
+        return isinstance(self.key, PrimaryKey)
+
+    def is_indexed(self):
+        return bool(self.index)
+
+    def has_sorted_index(self):
+        return self.index == 'sorted'
+
+    def validate(self, value):
         if not self.compatible_type(value):
             raise ColumnException('Cannot cast value of "%s" to type "%s"' % (value, self.column_type))
+
+    def set_field(self, entity, value):
+        self.validate(value)
         setattr(entity, self.field, value)
 
     def get_field(self, entity, strict=True):
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+
+from ormy.atomic_file import atomic_write
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger(__name__)
+
+SUFFIX = '.columns'
+_MAGIC = b'ORMYCOL1'
+# magic and the length of the json header that follows it
+_PREAMBLE = struct.Struct('<8sQ')
+# column buffers start on multiples of this so the arrays mapped onto them are aligned
+_ALIGNMENT = 64
+# bytes read at a time while hashing a csv file
+_HASH_BLOCK_SIZE = 1024 * 1024
+# dtype of a column of strings, saved as the int64 offsets of the values followed by their UTF-8 bytes
+_STRINGS = 'utf-8'
+# kinds of dtypes saved as raw buffers: booleans, integers, floats and datetime64
+_RAW_KINDS = 'biufM'
+
+
+def sidecar_path(path):
+    return path + SUFFIX
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def model_schema(model):
+    """what the typed arrays of a model file depend on besides the file, a sidecar written for another schema is
+       stale"""
+    return [[c.field, c.file_column_name, str(c.column_type)] for c in model.columns]
+
+
+def _column_data(array):
+    """(dtype, bytes) an array is saved as, or None if the format can't hold its values"""
+    if array.dtype.kind in _RAW_KINDS:
+        return array.dtype.str, array.tobytes()
+    if not array.dtype.hasobject or not all(isinstance(v, str) for v in array):
+        # e.g. integers too large for int64 or datetimes with a time zone
+        return None
+    try:
+        encoded = [v.encode('utf-8') for v in array]
+    except UnicodeEncodeError:
+        return None
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    np.cumsum([len(v) for v in encoded], out=offsets[1:])
+    return _STRINGS, offsets.tobytes() + b''.join(encoded)
+
+
+def write_sidecar(path, signature, schema, arrays, length):
+    """saves the typed column arrays of the csv file at path next to it. Numeric and datetime64 arrays are written as
+       raw buffers that load_sidecar maps back without copying, strings as their UTF-8 bytes and offsets. No sidecar
+       is written when a column holds other objects. signature is the file_signature of the csv file the arrays were
+       read from."""
+    mtime_ns, size, _ = signature
+    columns = []
+    payloads = []
+    offset = 0
+    for field, array in arrays.items():
+        saved = _column_data(array)
+        if saved is None:
+            log.info("not saving the columns of '%s', column '%s' holds values a sidecar can't" % (path, field))
+            return
+        dtype, data = saved
+        columns.append({'field': field, 'dtype': dtype, 'offset': offset, 'nbytes': len(data)})
+        payloads.append(data)
+        offset += -(-len(data) // _ALIGNMENT) * _ALIGNMENT
+    header = json.dumps({'size': size, 'mtime_ns': mtime_ns, 'digest': file_digest(path), 'schema': schema,
+                         'length': length, 'columns': columns}).encode('utf-8')
+    # pad the header too, the buffers are aligned relative to the start of the file
+    data_start = -(-(_PREAMBLE.size + len(header)) // _ALIGNMENT) * _ALIGNMENT
+
+    try:
+        with atomic_write(sidecar_path(path)) as f:
+            f.write(_PREAMBLE.pack(_MAGIC, len(header)))
+            f.write(header)
+            for column, data in zip(columns, payloads):
+                f.seek(data_start + column['offset'])
+                f.write(data)
+            f.truncate(data_start + offset)
+    except OSError as e:
+        log.warning("could not save the columns of '%s': %s" % (path, e))
+
+
+def load_sidecar(path, schema):
+    """returns (arrays, length) saved for the csv file at path by write_sidecar, or None if there is no sidecar or it
+       is stale. A sidecar is stale when it was written for another schema or another version of the file. The
+       content hash of the file is only checked when the size matches but the mtime doesn't, e.g. after a copy."""
+    try:
+        with open(sidecar_path(path), 'rb') as f:
+            magic, header_size = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if magic != _MAGIC:
+                return None
+            header = json.loads(f.read(header_size).decode('utf-8'))
+            st = os.stat(path)
+            if header['schema'] != schema or header['size'] != st.st_size:
+                return None
+            if header['mtime_ns'] != st.st_mtime_ns and header['digest'] != file_digest(path):
+                return None
+            data_start = -(-(_PREAMBLE.size + header_size) // _ALIGNMENT) * _ALIGNMENT
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+
+    try:
+        length = header['length']
+        arrays = {}
+        for column in header['columns']:
+            arrays[column['field']] = _load_column(data, data_start + column['offset'], column, length)
+    except (ValueError, KeyError, TypeError):
+        # UnicodeDecodeError is a ValueError
+        return None
+    return arrays, length
+
+
+def _load_column(data, start, column, length):
+    if column['dtype'] == _STRINGS:
+        offsets = np.frombuffer(data, dtype='<i8', count=length + 1, offset=start).tolist()
+        values = data[start + 8 * (length + 1):start + column['nbytes']]
+        array = np.empty(length, dtype=object)
+        text = values.decode('utf-8')
+        if len(text) == len(values):
+            # all ASCII, the byte offsets are those of the characters too
+            array[:] = [text[begin:end] for begin, end in zip(offsets, offsets[1:])]
+        else:
+            array[:] = [values[begin:end].decode('utf-8') for begin, end in zip(offsets, offsets[1:])]
+        return array
+    dtype = np.dtype(column['dtype'])
+    if dtype.kind not in _RAW_KINDS:
+        # only written by something else, nothing but plain buffers is read back
+        raise ValueError("unsupported dtype '%s'" % column['dtype'])
+    if length == 0:
+        return np.empty(0, dtype=dtype)
+    # a read only view of the mapped file, the pages are read as the column is used
+    return np.frombuffer(data, dtype=dtype, count=length, offset=start)
@@ -0,0 +1,326 @@
+import copy
+import logging
+import time
+from datetime import datetime
+
+from ormy.column import IntegerColumnType, FloatColumnType, DateColumnType
+from ormy.column_sidecar import load_sidecar, model_schema, write_sidecar
+from ormy.csv_append import read_header
+from ormy.csv_query_engine import CsvQueryEngine
+from ormy.query_engine import *
+from ormy.table_cache import file_signature, read_csv_rows
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger(__name__)
+
+
+class ColumnTable(object):
+    """A model's csv file loaded into one NumPy array per column, typed after the model's column types."""
+    in_memory = True
+    offsets = None
+
+    def __init__(self, path, signature, model, arrays, length):
+        self.path = path
+        self.signature = signature
+        self.model = model
+        # field -> array
+        self.arrays = arrays
+        self.length = length
+        # a column table is never consulted for hash indexes, the filter is vectorized instead
+        self.indexes = None
+
+    @classmethod
+    def load(cls, path, model):
+        signature = file_signature(path)
+        rows = read_csv_rows(path)
+        try:
+            return cls.from_rows(path, signature, model, next(rows, []), rows)
+        finally:
+            rows.close()
+
+    @classmethod
+    def from_rows(cls, path, signature, model, header, rows):
+        """a table of rows, lists of strings laid out as described by header"""
+        positions = {name: i for i, name in enumerate(header)}
+        present = []
+        for column in model.columns:
+            if column.file_column_name in positions:
+                present.append(column)
+            else:
+                log.warning('column %s not present in row..skipping' % column.file_column_name)
+
+        values = [[] for _ in present]
+        for row in rows:
+            for column_values, column in zip(values, present):
+                column_values.append(row[positions[column.file_column_name]])
+
+        arrays = {}
+        for column_values, column in zip(values, present):
+            arrays[column.field] = ColumnTable.to_array(column.column_type, column_values)
+        return cls(path, signature, model, arrays, len(values[0]) if values else 0)
+
+    @classmethod
+    def load_with_sidecar(cls, path, model):
+        """loads the arrays from the binary sidecar of the file, parsing the file and writing the sidecar if there
+           isn't an up to date one"""
+        schema = model_schema(model)
+        signature = file_signature(path)
+        saved = load_sidecar(path, schema)
+        if saved is not None:
+            arrays, length = saved
+            return cls(path, signature, model, arrays, length)
+        table = cls.load(path, model)
+        write_sidecar(path, table.signature, schema, table.arrays, table.length)
+        return table
+
+    @staticmethod
+    def to_array(column_type, strings):
+        """converts the strings of a column into an array with the dtype implied by the column type"""
+        if isinstance(column_type, DateColumnType) and column_type.iso_shape is not None \
+                and all(map(column_type.matches_iso_shape, strings)):
+            try:
+                # numpy parses ISO 8601 strings itself, without building a datetime for each of them
+                return np.array(strings, dtype='datetime64[us]')
+            except ValueError:
+                # e.g. a month 13, cast them one by one for the error
+                pass
+        values = [column_type.cast(v) for v in strings]
+        if isinstance(column_type, IntegerColumnType):
+            try:
+                return np.array(values, dtype=np.int64)
+            except OverflowError:
+                # too large for int64
+                return np.array(values, dtype=object)
+        elif isinstance(column_type, FloatColumnType):
+            return np.array(values, dtype=np.float64)
+        elif isinstance(column_type, DateColumnType) and not any(d.tzinfo is not None for d in values):
+            # datetime64 has no time zone, aware datetimes stay objects
+            return np.array(values, dtype='datetime64[us]')
+        return np.array(values, dtype=object)
+
+    def extend(self, header, rows):
+        """a copy of the table with rows, lists of strings laid out as described by header, appended to its file"""
+        positions = {name: i for i, name in enumerate(header)}
+        arrays = {}
+        for column in self.model.columns:
+            if column.field in self.arrays:
+                position = positions[column.file_column_name]
+                added = ColumnTable.to_array(column.column_type, [row[position] for row in rows])
+                arrays[column.field] = np.concatenate([self.arrays[column.field], added])
+        return ColumnTable(self.path, file_signature(self.path), self.model, arrays, self.length + len(rows))
+
+    def count_rows(self):
+        return self.length
+
+    def close(self):
+        pass
+
+    def __str__(self):
+        return "ColumnTable(path=%s, rows=%d)" % (self.path, self.length)
+
+
+class ColumnarAccessor(EntityAccessor):
+    """Field access for the records of a ColumnTable, which are row numbers."""
+
+    def __init__(self, table, to_entity, entity_class=None):
+        self.model = table.model
+        self.table = table
+        self.to_entity = to_entity
+        self.entity_class = table.model if entity_class is None else entity_class
+        # the fields set on the entities built, all of them unless the query selects fields
+        self.entity_fields = list(table.arrays)
+
+    def field_getter(self, field):
+        if field not in self.table.arrays:
+            raise QueryEngineException("field '%s' of model '%s' is not a column in the csv file"
+                                       % (field, self.model.__name__))
+        # item() returns plain python values, e.g. int rather than numpy.int64 and datetime rather than datetime64
+        return self.table.arrays[field].item
+
+    def record_getter(self):
+        return lambda i: self.to_entity(self, i)
+
+    def record_size(self, i):
+        return 32
+
+    def project(self, fields):
+        """a copy of the accessor building entities with only fields set"""
+        projection = copy.copy(self)
+        projection.entity_fields = [f for f in self.entity_fields if f in fields]
+        return projection
+
+
+class ColumnarCsvQueryEngine(CsvQueryEngine):
+    """Loads each model file into per column NumPy arrays and evaluates comparisons joined by AND/OR as boolean mask
+       operations over whole columns. Model instances are only built for the selected rows. Parts of the filter that
+       can't be vectorized, e.g. lambdas, are evaluated row by row but only for the rows still in question. The column
+       tables are kept between queries and reloaded when their file changes, with column_sidecars they are also saved
+       to disk for the next process. The column tables take the place of table_cache, row_offsets and parallel scans
+       (workers), setting any of them raises a QueryEngineException."""
+
+    def __init__(self, path, **kwargs):
+        if np is None:
+            raise QueryEngineException('the columnar query engine requires numpy')
+        unsupported = []
+        if kwargs.get('table_cache') is not None:
+            unsupported.append('table_cache')
+        if kwargs.get('row_offsets', False):
+            unsupported.append('row_offsets')
+        if kwargs.get('workers', 1) > 1:
+            unsupported.append('workers')
+        if unsupported:
+            raise QueryEngineException('the columnar query engine does not support %s' % ', '.join(unsupported))
+        super().__init__(path, **kwargs)
+        self.column_tables = {}
+        # save the typed arrays of each file in a binary sidecar next to it, read by later processes instead of the csv
+        self.column_sidecars = kwargs.get('column_sidecars', False)
+
+    def open_table(self, model):
+        file = self.model_file(model)
+        table = self.column_tables.get(file)
+        if table is None or table.signature != file_signature(file):
+            table = ColumnTable.load_with_sidecar(file, model) if self.column_sidecars else ColumnTable.load(file, model)
+            self.column_tables[file] = table
+        delta = self.get_delta_log(model)
+        if delta is None:
+            return table
+        with self._delta_lock:
+            merged = self.merged_tables.get(file)
+        if merged is None or merged[0] is not table or merged[1] is not delta:
+            rows = read_csv_rows(file)
+            try:
+                header = next(rows, [])
+                merged_table = ColumnTable.from_rows(file, table.signature, model, header, delta.merge(header, rows))
+            finally:
+                rows.close()
+            merged = (table, delta, merged_table)
+            with self._delta_lock:
+                self.merged_tables[file] = merged
+        return merged[2]
+
+    def run_many(self, exprs):
+        # the filters already run on whole columns loaded once per file, there's no row by row pass to share
+        return QueryEngine.run_many(self, exprs)
+
+    def wants_appended_rows(self, file, before):
+        table = self.column_tables.get(file)
+        return (table is not None and table.signature == before) or super().wants_appended_rows(file, before)
+
+    def add_appended_rows(self, model, file, before, rows):
+        super().add_appended_rows(model, file, before, rows)
+        table = self.column_tables.get(file)
+        if table is not None and table.signature == before:
+            # a new table, queries running in other threads keep the arrays they started with
+            table = table.extend(read_header(file), rows)
+            self.column_tables[file] = table
+            if self.column_sidecars:
+                write_sidecar(file, table.signature, model_schema(model), table.arrays, table.length)
+
+    def create_accessor(self, model, table):
+        return ColumnarAccessor(table, self.convert_index_to_class_instance, self.entity_class(table.model))
+
+    def convert_index_to_class_instance(self, accessor, i):
+        model_instance = accessor.entity_class()
+        arrays = accessor.table.arrays
+        for field in accessor.entity_fields:
+            setattr(model_instance, field, arrays[field].item(i))
+        return model_instance
+
+    def match_records(self, table, accessor, filter_expr: Expr, modifiers: QueryModifiers = None):
+        if filter_expr == self._TRUE:
+            return range(table.length)
+        mask = self.evaluate_mask(filter_expr, accessor, np.ones(table.length, dtype=bool))
+        return np.flatnonzero(mask).tolist()
+
+    def aggregate(self, model, filter_expr: Expr, context: ExprContext, modifiers: QueryModifiers):
+        aggregation = modifiers.aggregation
+        if aggregation.group_by or modifiers.is_paged():
+            return super().aggregate(model, filter_expr, context, modifiers)
+        # aggregates over all the matches are reductions of the selected elements of the columns
+        table, trace = self.open_traced_table(model)
+        start = time.perf_counter()
+        try:
+            accessor = self.create_accessor(model, table)
+            selected = np.asarray(self.match_records(table, accessor, filter_expr, modifiers), dtype=np.intp)
+            if trace is not None:
+                trace.rows_matched = len(selected)
+            results = {}
+            for name, function, field in aggregation.aggregates:
+                if function == 'count':
+                    results[name] = len(selected)
+                    continue
+                accessor.field_getter(field)
+                values = table.arrays[field][selected]
+                if function in ('min', 'max') and values.dtype.kind == 'f':
+                    # NaN is skipped, as by the row engine, what nanmin() and nanmax() do but for all NaN values
+                    values = values[~np.isnan(values)]
+                if len(values) == 0:
+                    results[name] = 0 if function == 'sum' else None
+                else:
+                    result = {'sum': np.sum, 'min': np.min, 'max': np.max, 'avg': np.mean}[function](values)
+                    # plain python values, as the row engine returns
+                    results[name] = result.item() if isinstance(result, np.generic) else result
+            return results
+        finally:
+            if trace is not None:
+                trace.finish(time.perf_counter() - start, 0)
+
+    def evaluate_mask(self, expr, accessor, within):
+        """returns the boolean mask of the rows matching expr. Rows outside of the mask within may be reported either
+           way, they are only there to limit the row by row evaluation of what can't be vectorized."""
+        table = accessor.table
+        if isinstance(expr, ValueExpr):
+            return np.full(table.length, bool(expr.value))
+        elif isinstance(expr, AndExpr):
+            left = self.evaluate_mask(expr.left, accessor, within)
+            return left & self.evaluate_mask(expr.right, accessor, within & left)
+        elif isinstance(expr, OrExpr):
+            left = self.evaluate_mask(expr.left, accessor, within)
+            return left | self.evaluate_mask(expr.right, accessor, within & ~left)
+        elif isinstance(expr, InExpr):
+            if self._is_column(expr.left, table) and isinstance(expr.right, ValueExpr):
+                return self._in_mask(table.arrays[expr.left.field], expr.right.value)
+        elif isinstance(expr, BetweenExpr):
+            if self._is_column(expr.left, table) and isinstance(expr.right, ValueExpr):
+                array = table.arrays[expr.left.field]
+                low, high = expr.right.value
+                return np.asarray((array >= self._array_value(array, low)) & (array <= self._array_value(array, high)))
+        elif issubclass(type(expr), CompExpr) and self._is_column(expr.left, table):
+            if isinstance(expr.right, ValueExpr):
+                return np.asarray(expr.op(table.arrays[expr.left.field],
+                                          self._array_value(table.arrays[expr.left.field], expr.right.value)))
+            if self._is_column(expr.right, table):
+                return np.asarray(expr.op(table.arrays[expr.left.field], table.arrays[expr.right.field]))
+
+        # not vectorizable, run the compiled filter for the rows still in question
+        predicate = self.compile_filter(expr, accessor)
+        mask = np.zeros(table.length, dtype=bool)
+        candidates = np.flatnonzero(within)
+        mask[candidates] = [bool(predicate(i)) for i in candidates.tolist()]
+        return mask
+
+    @staticmethod
+    def _in_mask(array, values):
+        if not array.dtype.hasobject:
+            try:
+                wanted = np.array([ColumnarCsvQueryEngine._array_value(array, v) for v in values], dtype=array.dtype)
+                return np.isin(array, wanted)
+            except (TypeError, ValueError, OverflowError):
+                # values that don't fit the column's dtype, compare them as python values
+                pass
+        # hashing each value beats isin on objects, which compares them pairwise
+        return np.fromiter((v in values for v in array.tolist()), dtype=bool, count=len(array))
+
+    @staticmethod
+    def _is_column(expr, table):
+        return isinstance(expr, FieldExpr) and expr.field in table.arrays
+
+    @staticmethod
+    def _array_value(array, value):
+        if array.dtype.kind == 'M' and isinstance(value, datetime):
+            return np.datetime64(value, 'us')
+        return value
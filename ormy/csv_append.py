@@ -0,0 +1,63 @@
+import csv
+import itertools
+import os
+
+from ormy.table_cache import read_csv_rows
+
+# rows serialized and handed to the csv writer at a time
+BATCH_ROWS = 10000
+# size of the write buffer of the file, the rows reach the file in writes of about this size
+DEFAULT_BUFFER_BYTES = 1024 * 1024
+
+
+def read_header(path):
+    """the header row of the csv file, None if there's no file or it has no rows"""
+    if not os.path.exists(path):
+        return None
+    rows = read_csv_rows(path)
+    try:
+        return next(rows, None)
+    finally:
+        rows.close()
+
+
+def ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def append_csv_rows(path, header, rows, keep=None, buffer_bytes=DEFAULT_BUFFER_BYTES):
+    """appends rows, lists of strings, to the csv file at path, writing header first if the file is new or empty. The
+       rows go through a buffer of buffer_bytes in batches of BATCH_ROWS and the file is synced to disk once, at the
+       end. If iterating rows raises, e.g. an entity isn't valid, the file is truncated back to what it was. The rows
+       written are added to the list keep, if given. Returns the number of rows appended."""
+    rows = iter(rows)
+    needs_newline = os.path.exists(path) and not ends_with_newline(path)
+    count = 0
+    with open(path, 'a', newline='', buffering=buffer_bytes) as f:
+        start = f.tell()
+        try:
+            writer = csv.writer(f, lineterminator='\n')
+            if start == 0:
+                writer.writerow(header)
+            elif needs_newline:
+                f.write('\n')
+            while True:
+                batch = list(itertools.islice(rows, BATCH_ROWS))
+                if not batch:
+                    break
+                writer.writerows(batch)
+                count += len(batch)
+                if keep is not None:
+                    keep.extend(batch)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            # drops what is still buffered too
+            f.truncate(start)
+            raise
+    return count
@@ -3,13 +3,48 @@ import os
 from ormy.csv_query_engine import CsvQueryEngine
 from ormy.datatabase import Database
 from ormy.datatabase_exception import DatabaseException
+from ormy.result_cache import ResultCache
+from ormy.table_cache import TableCache
 
 
 class CsvDatabase(Database):
-    def __init__(self, path_to_database):
+    def __init__(self, path_to_database, **kwargs):
+        """kwargs:
+            cache_size - keep parsed csv files in a TableCache of at most this many bytes (default no cache)
+            table_cache - a TableCache instance to use, e.g. to share one between databases
+            fk_batch_size - number of entities exec_iter() resolves foreign keys for at a time
+            sort_memory - bytes of rows an order_by() without limit sorts in memory before spilling to disk
+            columnar - use the NumPy based ColumnarCsvQueryEngine (requires numpy), not with the table cache,
+                row_offsets or workers
+            column_sidecars - with columnar, save the parsed columns of each file in a binary file next to it
+            workers - number of processes filtering a file in parallel (default 1, i.e. no parallel scans)
+            parallel_min_bytes - files smaller than this are always scanned in a single process
+            compact_entities - return instances of Model.compact_class(), which have no per instance __dict__
+            row_offsets - index the offsets of the records of files that aren't cached, saved next to each file
+            plan_cache_size - number of query shapes whose expression tree plans are kept (default 256, 0 to disable)
+            result_cache_size - keep the results of this many queries in a ResultCache (default no cache)
+            result_cache - a ResultCache instance to use
+            compact_after - compact the delta log of updates and deletes of a model into its file once it has this many
+                entries (default never, i.e. only on compact() and insert_many())
+            compact_in_background - compact in a thread rather than in the update_many() or delete_many() call reaching
+                compact_after (default True)
+            tracer - called with a tracing.Span for each phase of each query, e.g. a tracing.JsonLinesTracer
+        """
         self.validate_path(path_to_database)
         self.path = path_to_database
-        super().__init__(CsvQueryEngine(self.path))
+        engine_kwargs = dict(kwargs)
+        if kwargs.get('table_cache') is None and kwargs.get('cache_size') is not None:
+            engine_kwargs['table_cache'] = TableCache(kwargs['cache_size'])
+        if kwargs.get('columnar', False):
+            # imported here so numpy is only needed when the columnar engine is used
+            from ormy.columnar_query_engine import ColumnarCsvQueryEngine
+            engine = ColumnarCsvQueryEngine(self.path, **engine_kwargs)
+        else:
+            engine = CsvQueryEngine(self.path, **engine_kwargs)
+        result_cache = kwargs.get('result_cache')
+        if result_cache is None and kwargs.get('result_cache_size') is not None:
+            result_cache = ResultCache(kwargs['result_cache_size'])
+        super().__init__(engine, result_cache)
 
     @classmethod
     def validate_path(cls, path_to_database):
@@ -1,151 +1,870 @@
-import csv
+import copy
+import itertools
 import logging
+import operator
 import os
+import threading
+import time
 
+from ormy.column import StringColumnType
+from ormy.csv_append import append_csv_rows, read_header
+from ormy.delta_log import DeltaLog, log_signature
+from ormy.index import HashIndex, SortedIndex
+from ormy.model import Model
+from ormy.parallel_scan import ParallelScan, parallel_scans_allowed
 from ormy.query_engine import *
+from ormy.row_offsets import RowOffsetIndex
+from ormy.sorting import Descending, top_k, external_sorted
+from ormy.table_cache import CachedTable, StreamedTable, file_signature
+from ormy.tracing import ScanTrace, Span, TracedTable
 
 log = logging.getLogger(__name__)
 
 
-class CsvQueryEngine(QueryEngine):
-    def __init__(self, path):
-        super().__init__()
-        self.path = path
+class CsvRowAccessor(EntityAccessor):
+    """Compiles field access against raw csv rows, i.e. lists of strings laid out as described by the header row.
+       A field is cast from its string only when the filter reads it, the whole record is only converted into a model
+       instance for filters that need it (e.g. rlambda)."""
 
-    def convert_row_to_class_instance(self, model, row_data):
-        field_data = self.convert_columns_to_fields(model, row_data)
-        model_instance = model()
-        for item in field_data.items():
-            k, v = item
-            setattr(model_instance, k, v)
-        assert len(model_instance.__dict__) == len(
-            model.columns),\
-            "the number attributes (%d) of instance does not match the number of columns (%d) in model '%s'" % (
-            len(model_instance.__dict__), len(model.columns), model.__name__)
-        return model_instance
-
-    @staticmethod
-    def convert_columns_to_fields(model, row_data):
-        data = {}
+    def __init__(self, model, header, to_entity, entity_class=None):
+        self.model = model
+        self.to_entity = to_entity
+        # the class of the instances built, the model or its compact_class()
+        self.entity_class = model if entity_class is None else entity_class
+        positions = {name: i for i, name in enumerate(header)}
+        # (field, position in row, cast function) for each column of the model found in the file
+        self.columns = []
         for column in model.columns:
-            if column.file_column_name in row_data:
-                data[column.field] = column.column_type.cast(row_data[column.file_column_name])
+            if column.file_column_name in positions:
+                # strings are read as strings, casting them again would only copy them
+                cast = CsvRowAccessor.identity if type(column.column_type) is StringColumnType \
+                    else column.column_type.cast
+                self.columns.append((column.field, positions[column.file_column_name], cast))
             else:
                 log.warning('column %s not present in row..skipping' % column.file_column_name)
+        # checked once for the file rather than for each entity built
+        assert len(self.columns) == len(model.columns), \
+            "the number attributes (%d) of instance does not match the number of columns (%d) in model '%s'" % (
+            len(self.columns), len(model.columns), model.__name__)
+        self.fields = {c[0]: c for c in self.columns}
+        # the columns set on the entities built, all of them unless the query selects fields
+        self.entity_columns = self.columns
+        # rough size of a row of strings in memory, the list plus a string object per field
+        self.row_overhead = 64 + 56 * len(header)
+
+    @staticmethod
+    def identity(value):
+        return value
+
+    def record_size(self, row):
+        return self.row_overhead + sum(map(len, row))
+
+    def field_getter(self, field):
+        if field not in self.fields:
+            raise QueryEngineException("field '%s' of model '%s' is not a column in the csv file"
+                                       % (field, self.model.__name__))
+        _, position, cast = self.fields[field]
+        if cast is CsvRowAccessor.identity:
+            return operator.itemgetter(position)
+        return lambda row: cast(row[position])
+
+    def record_getter(self):
+        return lambda row: self.to_entity(self, row)
+
+    def project(self, fields):
+        """a copy of the accessor building entities with only fields set"""
+        projection = copy.copy(self)
+        projection.entity_columns = [c for c in self.columns if c[0] in fields]
+        return projection
+
+
+class SharedScanAccessor(EntityAccessor):
+    """Reads the records of a pass over a file shared by the filters of several queries, see CsvQueryEngine.run_many.
+       Each record is a list of the raw row followed by a slot for each field the filters read. A field is cast the
+       first time a filter reads it and kept in its slot for the other filters, so a filter that short circuits
+       doesn't cast the fields it didn't get to, as when the query runs on its own."""
+
+    # a slot whose field wasn't cast yet
+    UNSET = object()
+
+    def __init__(self, accessor, fields):
+        self.accessor = accessor
+        self.fields = list(fields)
+        self.slots = {field: i + 1 for i, field in enumerate(self.fields)}
+        unset = [SharedScanAccessor.UNSET] * len(self.fields)
+
+        def cast(row):
+            # fresh slots for every row
+            return [row, *unset]
+
+        self.cast = cast
+
+    @staticmethod
+    def fields_of(expr):
+        """the fields read by the filter expr"""
+        if expr is None:
+            return set()
+        if isinstance(expr, FieldExpr):
+            return {expr.field}
+        return SharedScanAccessor.fields_of(expr.left) | SharedScanAccessor.fields_of(expr.right)
+
+    def field_getter(self, field):
+        slot = self.slots[field]
+        get = self.accessor.field_getter(field)
+        unset = SharedScanAccessor.UNSET
+
+        def memoized(values):
+            value = values[slot]
+            if value is unset:
+                value = values[slot] = get(values[0])
+            return value
+        return memoized
+
+    def record_getter(self):
+        accessor = self.accessor
+        return lambda values: accessor.to_entity(accessor, values[0])
+
 
-        return data
+class CsvQueryEngine(QueryEngine):
+    # number of entities exec_iter() collects before resolving their foreign keys and handing them out
+    DEFAULT_FK_BATCH_SIZE = 1000
+    # approximate number of bytes of rows held in memory by an order_by() without a limit before spilling to disk
+    DEFAULT_SORT_MEMORY = 64 * 1024 * 1024
+    # files smaller than this are scanned in this process even when workers are configured
+    DEFAULT_PARALLEL_MIN_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        # optional TableCache holding the parsed rows of the model files between queries
+        self.table_cache = kwargs.get('table_cache')
+        self.fk_batch_size = kwargs.get('fk_batch_size', CsvQueryEngine.DEFAULT_FK_BATCH_SIZE)
+        self.sort_memory = kwargs.get('sort_memory', CsvQueryEngine.DEFAULT_SORT_MEMORY)
+        # number of processes filtering a file in parallel, 1 scans in this process only
+        self.workers = kwargs.get('workers', 1)
+        self.parallel_min_bytes = kwargs.get('parallel_min_bytes', CsvQueryEngine.DEFAULT_PARALLEL_MIN_BYTES)
+        # keep a RowOffsetIndex for each file that isn't cached, saved next to the file
+        self.row_offsets = kwargs.get('row_offsets', False)
+        # build instances of Model.compact_class(), which keeps the fields in __slots__ rather than a __dict__
+        self.compact_entities = kwargs.get('compact_entities', False)
+        # compact a delta log into its file once it has this many entries, None leaves it to compact()
+        self.compact_after = kwargs.get('compact_after')
+        # compact in a thread of its own rather than in the update_many() or delete_many() reaching compact_after
+        self.compact_in_background = kwargs.get('compact_in_background', True)
+        self.row_offset_indexes = {}
+        # file -> its last loaded DeltaLog
+        self.delta_logs = {}
+        # file -> (table, delta log, table with the delta log applied), see merged_table()
+        self.merged_tables = {}
+        self.compaction = None
+        # held while a model file or its delta log is written
+        self._write_lock = threading.RLock()
+        # held while delta_logs or merged_tables change, never while waiting for _write_lock
+        self._delta_lock = threading.Lock()
+        # the worker processes of parallel scans, started by the first one
+        self._parallel_pool = None
+        self._parallel_pool_lock = threading.Lock()
+
+    def convert_row_to_class_instance(self, accessor, row):
+        model_instance = accessor.entity_class()
+        for field, position, cast in accessor.entity_columns:
+            setattr(model_instance, field, cast(row[position]))
+        return model_instance
 
     def _run(self, expr, context: ExprContext):
         # TODO: if not moved into the Expr tree, could move to QueryEngine and only have platform dependent
         #   operations here.
-        if isinstance(expr, QueryExpr):
-            # TODO: check for limit and sort
-            return self.load(expr, context)
-        elif issubclass(type(expr), CompExpr):
-            return expr.perform_compare(self._run(expr.left, context), self._run(expr.right, context))
-        elif isinstance(expr, FieldExpr):
-            return getattr(context.model_data, expr.field)
-        elif isinstance(expr, WholeRecordExpr):
-            return context.model_data
-        elif isinstance(expr, FieldLambdaExpr):
-            return expr.func(self._run(expr.left, context))
-        elif isinstance(expr, RecordLambdaExpr):
-            return expr.func(self._run(expr.left, context))
-        elif isinstance(expr, ValueExpr):
-            return expr.value
+        if isinstance(expr, (QueryExpr, ModifierExpr)):
+            query_expr, modifiers = QueryModifiers.unwrap(expr)
+            if modifiers.aggregation is not None:
+                return self.aggregate(query_expr.model, query_expr.left, context, modifiers)
+            return self.load(query_expr, context, modifiers)
+        else:
+            # filters are compiled into predicates over the records of a scan, see compile_filter()
+            raise QueryEngineException("trying to execute unknown expr type '%s'" % type(expr).__name__)
+
+    def _run_iter(self, expr, context: ExprContext):
+        if isinstance(expr, (QueryExpr, ModifierExpr)):
+            query_expr, modifiers = QueryModifiers.unwrap(expr)
+            if modifiers.aggregation is not None:
+                raise QueryEngineException('aggregates are single results, they can not be streamed')
+            return self.load_iter(query_expr, context, self.fk_batch_size, modifiers)
+        raise QueryEngineException("trying to stream results of expr type '%s'" % type(expr).__name__)
+
+    def run_many(self, exprs):
+        """runs several compiled queries. The queries on a model that scan its file share a single pass over it, each
+           row is split and the fields the filters read are cast once for all of them, and every query shares the
+           parent entities loaded to resolve foreign keys. Aggregates, queries answered from an index and queries with
+           a limit but no order_by, which stop reading early, run on their own. The shared pass is never parallel."""
+        results = [None] * len(exprs)
+        done = set()
+        entity_cache = {}
+        by_model = {}
+        for i, expr in enumerate(exprs):
+            if isinstance(expr, (QueryExpr, ModifierExpr)):
+                query_expr, modifiers = QueryModifiers.unwrap(expr)
+                if query_expr.left != self._TRUE and modifiers.aggregation is None \
+                        and (modifiers.limit is None or modifiers.order):
+                    by_model.setdefault(query_expr.model, []).append((i, query_expr, modifiers))
+        for model, queries in by_model.items():
+            if len(queries) > 1:
+                for i, result in self.shared_scan(model, queries, entity_cache).items():
+                    results[i] = result
+                    done.add(i)
+        for i, expr in enumerate(exprs):
+            if i in done:
+                continue
+            if isinstance(expr, (QueryExpr, ModifierExpr)):
+                query_expr, modifiers = QueryModifiers.unwrap(expr)
+                if modifiers.aggregation is None:
+                    results[i] = list(self.load_iter(query_expr, ExprContext(), None, modifiers, entity_cache))
+                    continue
+            results[i] = self.run(expr)
+        return results
+
+    def shared_scan(self, model, queries, entity_cache):
+        """returns {i: entities} for the (i, query_expr, modifiers) queries on model, the ones the indexes can't answer
+           are filtered in one pass over the rows"""
+        table = self.open_table(model)
+        try:
+            accessor = self.create_accessor(model, table)
+            matches = {}
+            scanned = []
+            for i, query_expr, modifiers in queries:
+                positions = None if table.indexes is None else self.probe_indexes(query_expr.left, table, accessor)
+                if positions is None:
+                    scanned.append((i, query_expr))
+                else:
+                    predicate = self.compile_filter(query_expr.left, accessor)
+                    matches[i] = list(filter(predicate, table.fetch_rows(sorted(positions))))
+            if scanned:
+                shared = SharedScanAccessor(accessor, sorted(set().union(
+                    *(SharedScanAccessor.fields_of(query_expr.left) for _, query_expr in scanned))))
+                tests = [(self.compile_filter(query_expr.left, shared), matches.setdefault(i, []).append)
+                         for i, query_expr in scanned]
+                for values in map(shared.cast, table.rows):
+                    for predicate, add in tests:
+                        if predicate(values):
+                            add(values[0])
+
+            results = {}
+            for i, query_expr, modifiers in queries:
+                records = matches[i]
+                if modifiers.order:
+                    records = self._sort(records, accessor, modifiers)
+                entities = self.build_entities(model, accessor, self._page(records, modifiers), modifiers)
+                results[i] = list(self._resolve_fks(query_expr, entities, None, modifiers, entity_cache))
+            return results
+        finally:
+            table.close()
+
+    def insert_many(self, model, entities):
+        """appends entities, model instances or dicts of field values, to the model's csv file and returns how many
+           there were. Each value must be of its column's type, as for Column.set_field(), and is written with the
+           column type's to_string(). Tables, indexes and row offsets held for the file are brought up to date with the
+           new rows rather than reloaded."""
+        with self._write_lock:
+            # a key deleted in the delta log may be inserted again, which the log would drop
+            self.compact(model)
+            return self._insert_many(model, entities)
+
+    def _insert_many(self, model, entities):
+        file = self.model_file(model)
+        header = read_header(file)
+        if header is None:
+            header = [c.file_column_name for c in model.columns]
+        by_name = {c.file_column_name: c for c in model.columns}
+        missing = [name for name in by_name if name not in header]
+        if missing:
+            raise QueryEngineException("columns %s of model '%s' are not in the header of '%s'"
+                                       % (missing, model.__name__, file))
+        columns = model.columns
+        fields = [c.field for c in columns]
+        checks = [(c.column_type.compatible_type, c) for c in columns]
+        to_strings = [c.column_type.to_string for c in columns]
+        get_values = operator.attrgetter(*fields) if len(fields) > 1 else lambda e: (getattr(e, fields[0]),)
+        # for each column of the file, the position of its value in the row of the model's columns, None if the model
+        # doesn't have it and it's left empty
+        order = [fields.index(by_name[name].field) if name in by_name else None for name in header]
+        reorder = order != list(range(len(fields)))
+
+        def to_row(entity):
+            if type(entity) is dict:
+                values = [entity.get(f) for f in fields]
+            else:
+                try:
+                    values = get_values(entity)
+                except AttributeError:
+                    values = [getattr(entity, f, None) for f in fields]
+            for (compatible, column), value in zip(checks, values):
+                if not compatible(value):
+                    column.validate(value)
+            row = [to_string(value) for to_string, value in zip(to_strings, values)]
+            if reorder:
+                return ['' if i is None else row[i] for i in order]
+            return row
+
+        before = file_signature(file) if os.path.exists(file) else None
+        rows = [] if before is not None and self.wants_appended_rows(file, before) else None
+        count = append_csv_rows(file, header, map(to_row, entities), rows)
+        if rows:
+            self.add_appended_rows(model, file, before, rows)
+        return count
+
+    def key_column(self, model):
+        column = model.get_pk_column()
+        if column is None:
+            raise QueryEngineException("model '%s' has no primary key, its rows can not be updated or deleted"
+                                       % model.__name__)
+        return column
+
+    def update_many(self, model, entities):
+        """records updates of the rows with the primary key of each entity, model instances or dicts of field values,
+           in the delta log of the model's file and returns how many there were. The fields of an entity, but for the
+           primary key, are set on the rows, the other columns keep their values. Each value must be of its column's
+           type and is written with the column type's to_string(), nothing is recorded if any of them is invalid."""
+        key_column = self.key_column(model)
+        object_fields = {c.object_field for c in model.get_fk_columns()}
+        entries = []
+        for entity in entities:
+            if type(entity) is dict:
+                values = entity
+            else:
+                values = {c.field: getattr(entity, c.field) for c in model.columns if c.has_field(entity)}
+            if key_column.field not in values:
+                raise QueryEngineException("update of model '%s' without its primary key '%s'"
+                                           % (model.__name__, key_column.field))
+            changes = {}
+            for field, value in values.items():
+                column = model.get_column(field)
+                if column is None:
+                    if field in object_fields:
+                        # the entity of a foreign key, its key field is what's written
+                        continue
+                    raise QueryEngineException("field '%s' does not exist in model '%s'" % (field, model.__name__))
+                column.validate(value)
+                changes[column.file_column_name] = column.column_type.to_string(value)
+            key = changes.pop(key_column.file_column_name)
+            entries.append({'op': 'update', 'key': key, 'values': changes})
+        self.append_delta(model, entries)
+        return len(entries)
+
+    def delete_many(self, model, keys):
+        """records deletes of the rows with the primary keys, or with the keys of the model instances, in the delta log
+           of the model's file and returns how many keys there were"""
+        key_column = self.key_column(model)
+        entries = []
+        for key in keys:
+            if isinstance(key, Model):
+                # an entity, possibly of the model's compact_class()
+                key = getattr(key, key_column.field)
+            key_column.validate(key)
+            entries.append({'op': 'delete', 'key': key_column.column_type.to_string(key)})
+        self.append_delta(model, entries)
+        return len(entries)
+
+    def append_delta(self, model, entries):
+        if not entries:
+            return
+        with self._write_lock:
+            DeltaLog.append(self.model_file(model), entries)
+            delta = self.get_delta_log(model)
+        if self.compact_after is not None and len(delta) >= self.compact_after:
+            if not self.compact_in_background:
+                self.compact(model)
+            elif self.compaction is None or not self.compaction.is_alive():
+                # a log growing while a compaction runs is compacted on its next write
+                self.compaction = threading.Thread(target=self.compact, args=(model,), name='ormy-compaction',
+                                                   daemon=True)
+                self.compaction.start()
+
+    def compact(self, model):
+        """writes the changes in the delta log of the model's file into the file, replacing it in one step, and removes
+           the log. Returns the number of entries compacted."""
+        with self._write_lock:
+            delta = self.get_delta_log(model)
+            if delta is None:
+                return 0
+            file = self.model_file(model)
+            delta.compact()
+            with self._delta_lock:
+                self.delta_logs.pop(file, None)
+                self.merged_tables.pop(file, None)
+            return len(delta)
+
+    def wait_for_compaction(self):
+        """waits for a compaction running in the background to finish"""
+        compaction = self.compaction
+        if compaction is not None:
+            compaction.join()
+
+    def get_delta_log(self, model):
+        """the DeltaLog of the model's file, None if it has none or the model has no primary key"""
+        key_column = model.get_pk_column()
+        if key_column is None:
+            return None
+        file = self.model_file(model)
+        signature = log_signature(file)
+        with self._delta_lock:
+            if signature is None:
+                self.delta_logs.pop(file, None)
+                return None
+            delta = self.delta_logs.get(file)
+        if delta is None or delta.signature != signature:
+            # loaded without the lock, threads loading the same log at once each get a complete one
+            delta = DeltaLog.load(file, key_column)
+            with self._delta_lock:
+                self.delta_logs[file] = delta
+        return delta
+
+    def merged_table(self, table, delta):
+        """a CachedTable of the rows of the cached table with the changes in the delta log applied, kept until either
+           changes. It has indexes of its own."""
+        with self._delta_lock:
+            merged = self.merged_tables.get(table.path)
+        if merged is not None and merged[0] is table and merged[1] is delta:
+            return merged[2]
+        rows = list(delta.merge(table.header, table.rows))
+        merged_table = CachedTable(table.path, table.signature, table.header, rows)
+        with self._delta_lock:
+            self.merged_tables[table.path] = (table, delta, merged_table)
+        return merged_table
+
+    def wants_appended_rows(self, file, before):
+        """whether something is held in memory for the file as it was before the append, i.e. with signature before,
+           that add_appended_rows() would bring up to date"""
+        if self.table_cache is not None and self.table_cache.is_current(file, before):
+            return True
+        offsets = self.row_offset_indexes.get(file)
+        return offsets is not None and offsets.matches(before) and len(offsets.indexes) > 0
+
+    def add_appended_rows(self, model, file, before, rows):
+        """adds the rows appended to the file to the cached table and indexes of the file"""
+        def update_indexes(table, start):
+            if table.indexes:
+                accessor = self.create_accessor(model, table)
+                for field, index in table.indexes.items():
+                    index.extend(accessor.field_getter(field), rows, start)
+
+        if self.table_cache is not None:
+            self.table_cache.extend(file, before, rows, update_indexes)
+        offsets = self.row_offset_indexes.get(file)
+        if offsets is not None and offsets.matches(before):
+            start = len(offsets)
+            extended = RowOffsetIndex.open(file, offsets)
+            # the rows before start didn't change so their indexes still hold
+            extended.indexes = offsets.indexes
+            table = StreamedTable(file, extended)
+            try:
+                update_indexes(table, start)
+            finally:
+                table.close()
+            self.row_offset_indexes[file] = extended
+
+    def model_file(self, model):
+        return os.path.join(self.path, model.__csv_file__)
+
+    def result_key(self):
+        # engines reading the same directory into the same kind of entities return the same results
+        return type(self), os.path.realpath(self.path), self.compact_entities
+
+    def dependencies(self, expr):
+        """the model's file and, unless the query is an aggregate, the files of the models its selected foreign keys are
+           resolved from, and theirs in turn"""
+        if not isinstance(expr, (QueryExpr, ModifierExpr)):
+            return None
+        query_expr, modifiers = QueryModifiers.unwrap(expr)
+        model = query_expr.model
+        files = self.model_files(model)
+        if modifiers.aggregation is not None:
+            return files
+        fk_columns = model.get_fk_columns()
+        if modifiers.fields is not None:
+            fk_columns = [c for c in fk_columns if c.object_field in modifiers.fields]
+        seen = {model}
+        pending = [c.key.model for c in fk_columns]
+        while pending:
+            fk_model = pending.pop()
+            if fk_model in seen:
+                continue
+            seen.add(fk_model)
+            files.extend(self.model_files(fk_model))
+            pending.extend(c.key.model for c in fk_model.get_fk_columns())
+        return files
+
+    def model_files(self, model):
+        """the model's file and its delta log, which may not exist"""
+        file = self.model_file(model)
+        if model.get_pk_column() is None:
+            return [file]
+        return [file, file + DeltaLog.SUFFIX]
+
+    def open_table(self, model):
+        """returns the table of the model's csv file, i.e. its header row and data rows, with the changes in its delta
+           log applied. Cached tables are held in memory and carry their indexes, otherwise the rows are streamed from
+           the file."""
+        file = self.model_file(model)
+        delta = self.get_delta_log(model)
+        if self.table_cache is not None:
+            table = self.table_cache.get(file)
+            return table if delta is None else self.merged_table(table, delta)
+        if delta is not None:
+            return StreamedTable(file, None, delta)
+        # the array reader is faster than the hash reader and lets the filter cast only the fields it looks at,
+        # the header row is mapped onto the model columns once by CsvRowAccessor.
+        return StreamedTable(file, self.get_row_offsets(file) if self.row_offsets else None)
+
+    def get_row_offsets(self, file):
+        offsets = self.row_offset_indexes.get(file)
+        if offsets is None or not offsets.matches(file_signature(file)):
+            offsets = RowOffsetIndex.open(file, offsets)
+            self.row_offset_indexes[file] = offsets
+        return offsets
+
+    def use_parallel_scan(self, table, modifiers: QueryModifiers):
+        if self.workers <= 1 or table.in_memory or not parallel_scans_allowed():
+            # cached tables are already parsed and in memory
+            return False
+        if table.delta is not None:
+            # the workers read the file, without the changes in its delta log
+            return False
+        if modifiers is not None and modifiers.limit is not None and not modifiers.order:
+            # a sequential scan can stop as soon as the page is complete
+            return False
+        return os.path.getsize(table.path) >= self.parallel_min_bytes
+
+    def parallel_pool(self):
+        with self._parallel_pool_lock:
+            if self._parallel_pool is None:
+                self._parallel_pool = ParallelScan.create_pool(self.workers)
+            return self._parallel_pool
+
+    def close(self):
+        """stops the worker processes of parallel scans, if any were started"""
+        with self._parallel_pool_lock:
+            if self._parallel_pool is not None:
+                self._parallel_pool.shutdown()
+                self._parallel_pool = None
+
+    def probe_indexes(self, expr, table, accessor):
+        """returns the set of positions of the rows that can match the filter according to the indexes on the table, or
+           None if the indexes can't narrow it down and every row must be scanned"""
+        if isinstance(expr, (EqExpr, InExpr, BetweenExpr, LtExpr, LeExpr, GtExpr, GeExpr)):
+            if not (isinstance(expr.left, FieldExpr) and isinstance(expr.right, ValueExpr)):
+                return None
+            column = accessor.model.get_column(expr.left.field)
+            if column is None or not column.is_indexed():
+                return None
+            if not isinstance(expr, (EqExpr, InExpr)) and not column.has_sorted_index():
+                # a hash index only answers eq() and in_()
+                return None
+            index_class = SortedIndex if column.has_sorted_index() else HashIndex
+            index = table.get_index(column.field, accessor.field_getter(column.field), index_class)
+            value = expr.right.value
+            try:
+                if isinstance(expr, EqExpr):
+                    return set(index.lookup(value))
+                elif isinstance(expr, InExpr):
+                    return {i for v in value for i in index.lookup(v)}
+                elif isinstance(expr, BetweenExpr):
+                    return set(index.range(value[0], value[1]))
+                low, high, inclusive = CsvQueryEngine._RANGE_BOUNDS[type(expr)]
+                return set(index.range(value if low else None, value if high else None, inclusive, inclusive))
+            except TypeError:
+                # unhashable value or one that can't be compared with the column, leave it to the filter
+                return None
         elif isinstance(expr, AndExpr):
-            return self._run(expr.left, context) and self._run(expr.right, context)
+            left = self.probe_indexes(expr.left, table, accessor)
+            right = self.probe_indexes(expr.right, table, accessor)
+            if left is None or right is None:
+                return right if left is None else left
+            return left & right
         elif isinstance(expr, OrExpr):
-            return self._run(expr.left, context) or self._run(expr.right, context)
-        else:
-            raise QueryEngineException("trying to execute unknown expr type '%s'" % expr.__name_)
+            left = self.probe_indexes(expr.left, table, accessor)
+            right = self.probe_indexes(expr.right, table, accessor) if left is not None else None
+            if left is None or right is None:
+                return None
+            return left | right
+        return None
+
+    # range comparison -> (value is the low bound, value is the high bound, bound included)
+    _RANGE_BOUNDS = {
+        LtExpr: (False, True, False),
+        LeExpr: (False, True, True),
+        GtExpr: (True, False, False),
+        GeExpr: (True, False, True),
+    }
 
     def process_csv_file(self, model, filter_expr: Expr, context: ExprContext):
-        file = os.path.join(self.path, model.__csv_file__)
-        model_instances = []
-        with open(file, newline='') as f:
-            # TODO: array reader or hash reader?
-            #  - array reader might be faster
-            #  - hash reader requires header row and easy to ignore columns
-            reader = csv.DictReader(f)
-            for row_data in reader:
-                context.model_data = self.convert_row_to_class_instance(model, row_data)
-                if filter_expr == self._TRUE or self._run(filter_expr, context):
-                    model_instances.append(context.model_data)
-
-        return model_instances
-
-    def load(self, query_expr, context: ExprContext):
-        entities = self.process_csv_file(query_expr.model, query_expr.left, context)
+        return list(self.scan(model, filter_expr, context))
+
+    def scan(self, model, filter_expr: Expr, context: ExprContext, modifiers: QueryModifiers = None):
+        """yields the instances of model in the csv file matching filter_expr, without resolving foreign keys. Only the
+           page of matches selected by the offset and limit in modifiers is converted to model instances and the file
+           isn't read any further once the limit is reached."""
+        table, trace = self.open_traced_table(model)
+        try:
+            accessor = self.create_accessor(model, table)
+            if trace is not None:
+                accessor = trace.accessor(accessor)
+            if table.offsets is not None and filter_expr == self._TRUE and modifiers is not None \
+                    and modifiers.is_paged() and not modifiers.order:
+                # every row is a match so the page can be read straight from the offsets of its first and last rows
+                stop = None if modifiers.limit is None else modifiers.offset + modifiers.limit
+                records = table.offsets.read_rows(modifiers.offset, stop)
+                if trace is not None:
+                    records = trace.rows(records, False)
+            else:
+                records = self.match_records(table, accessor, filter_expr, modifiers)
+                if modifiers is not None and modifiers.order:
+                    records = self._sort(records, accessor, modifiers)
+                records = self._page(records, modifiers)
+            if trace is None:
+                yield from self.build_entities(model, accessor, records, modifiers)
+            else:
+                yield from trace.entities(self.build_entities(model, accessor, trace.matches(records), modifiers))
+        finally:
+            table.close()
+            if trace is not None:
+                trace.finish()
+
+    def open_traced_table(self, model):
+        """opens the table of the model, returning it and None, or while tracing the table read through a ScanTrace and
+           the trace"""
+        tracer = self.tracer
+        if tracer is None:
+            return self.open_table(model), None
+        trace = ScanTrace(tracer, model, self.model_file(model))
+        start = time.perf_counter()
+        table = self.open_table(model)
+        return trace.table(table, time.perf_counter() - start), trace
+
+    def build_entities(self, model, accessor, records, modifiers: QueryModifiers = None):
+        if modifiers is not None and modifiers.fields is not None:
+            # the filter and sort still see every field, only the entities built are partial
+            accessor = accessor.project(self.projected_fields(model, modifiers.fields))
+        for record in records:
+            yield accessor.to_entity(accessor, record)
+
+    @staticmethod
+    def projected_fields(model, fields):
+        """the fields set on the entities of a query selecting fields. Foreign keys are resolved for the selected
+           object fields, which needs the values of their keys."""
+        wanted = set(fields)
+        for column in model.get_fk_columns():
+            if column.object_field in wanted:
+                wanted.add(column.field)
+        return [c.field for c in model.columns if c.field in wanted]
+
+    def aggregate(self, model, filter_expr: Expr, context: ExprContext, modifiers: QueryModifiers):
+        """folds the rows matching filter_expr, paged by the offset and limit in modifiers, into the aggregates of
+           modifiers.aggregation. Only the fields aggregated, grouped on and filtered on are cast, no model instances
+           are built and foreign keys aren't resolved. Counting all rows doesn't even split them into fields when the
+           row offsets or the rows themselves are at hand."""
+        aggregation = modifiers.aggregation
+        table, trace = self.open_traced_table(model)
+        start = time.perf_counter()
+        try:
+            if filter_expr == self._TRUE and not modifiers.is_paged() and aggregation.is_count_only():
+                count = table.count_rows()
+                if trace is not None:
+                    trace.rows_matched = count
+                return aggregation.count_results(count)
+            accessor = self.create_accessor(model, table)
+            if trace is not None:
+                accessor = trace.accessor(accessor)
+            records = self.match_records(table, accessor, filter_expr, modifiers)
+            if modifiers.order and modifiers.is_paged():
+                # the order only matters for which rows make the page
+                records = self._sort(records, accessor, modifiers)
+            records = self._page(records, modifiers)
+            if trace is not None:
+                records = trace.matches(records)
+            return aggregation.fold(records, accessor)
+        finally:
+            table.close()
+            if trace is not None:
+                trace.finish(time.perf_counter() - start, 0)
+
+    def create_accessor(self, model, table):
+        return CsvRowAccessor(model, table.header, self.convert_row_to_class_instance, self.entity_class(model))
+
+    def entity_class(self, model):
+        return model.compact_class() if self.compact_entities else model
+
+    def match_records(self, table, accessor, filter_expr: Expr, modifiers: QueryModifiers = None):
+        """returns an iterable over the records, here raw csv rows, of the table matching the filter"""
+        if filter_expr == self._TRUE:
+            return table.rows
+        predicate = self.compile_filter(filter_expr, accessor)
+        if table.indexes is not None:
+            positions = self.probe_indexes(filter_expr, table, accessor)
+            if positions is not None:
+                # the filter still runs on the candidate rows, the index only narrows down which rows to look at
+                return filter(predicate, table.fetch_rows(sorted(positions)))
+        if self.use_parallel_scan(table, modifiers) and ParallelScan.can_run(accessor.model, filter_expr):
+            ranges = None if table.offsets is None else table.offsets.ranges(self.workers)
+            trace = table.trace if isinstance(table, TracedTable) else None
+            return ParallelScan(table.path, accessor.model, table.header, filter_expr, self.parallel_pool(),
+                                self.workers, ranges, trace).run()
+        # the filter runs on the raw row, only rows that pass are converted into model instances
+        return filter(predicate, table.rows)
 
+    def load(self, query_expr, context: ExprContext, modifiers: QueryModifiers = None):
+        return list(self.load_iter(query_expr, context, None, modifiers))
+
+    def load_iter(self, query_expr, context: ExprContext, batch_size=None, modifiers: QueryModifiers = None,
+                  entity_cache=None):
+        """yields the entities of the query with their foreign keys resolved. The foreign keys are resolved for batches
+           of batch_size entities at a time, all at once when batch_size is None. The parent entities loaded are kept
+           in entity_cache for the following batches so a parent file is only rescanned for ids not seen before."""
+        scan = self.scan(query_expr.model, query_expr.left, context, modifiers)
+        try:
+            yield from self._resolve_fks(query_expr, scan, batch_size, modifiers, entity_cache)
+        finally:
+            # stop reading the file, e.g. once the limit was reached and the caller stopped iterating
+            scan.close()
+
+    def _sort(self, records, accessor, modifiers: QueryModifiers):
+        """sorts the records casting only the fields sorted on. With a limit only the top offset + limit records are
+           kept in a heap, otherwise records beyond sort_memory bytes are sorted in runs on disk and merged."""
+        getters = [(accessor.field_getter(field), desc) for field, desc in modifiers.order]
+        if len(getters) == 1:
+            get, desc = getters[0]
+            key = (lambda row: Descending(get(row))) if desc else get
+        else:
+            def key(row):
+                return tuple(Descending(get(row)) if desc else get(row) for get, desc in getters)
+
+        if modifiers.limit is not None:
+            return top_k(records, modifiers.offset + modifiers.limit, key)
+        return external_sorted(records, key, self.sort_memory, accessor.record_size)
+
+    @staticmethod
+    def _page(records, modifiers: QueryModifiers):
+        if modifiers is None or not modifiers.is_paged():
+            return records
+        stop = None if modifiers.limit is None else modifiers.offset + modifiers.limit
+        return itertools.islice(records, modifiers.offset, stop)
+
+    def _resolve_fks(self, query_expr, entities, batch_size, modifiers: QueryModifiers = None, entity_cache=None):
         # TODO: this is not specific to the CsvQueryEngine, but abstract across all engines.
         #   Move traversal of the AST into QueryEngine, similarly call a load method in QE which calls platform-specific
         #   load in CQE which returns data to QE which scans for foreign keys in QE since this is a platform-independent
         #   action. The FK scan traverses the schema doing loads using load from QE and CEQ recursively. Refactor this.
         fk_key_columns = query_expr.model.get_fk_columns()
-        if fk_key_columns and len(entities) > 0:
-            self.load_with_foreign_entities(entities, fk_key_columns)
+        if modifiers is not None and modifiers.fields is not None:
+            fk_key_columns = [c for c in fk_key_columns if c.object_field in modifiers.fields]
+        if not fk_key_columns:
+            yield from entities
+            return
 
-        return entities
+        if entity_cache is None:
+            entity_cache = {}
+        batch = []
+        for entity in entities:
+            batch.append(entity)
+            if batch_size is not None and len(batch) >= batch_size:
+                self.load_with_foreign_entities(batch, fk_key_columns, entity_cache)
+                yield from batch
+                batch = []
+        if batch:
+            self.load_with_foreign_entities(batch, fk_key_columns, entity_cache)
+            yield from batch
 
-    def load_with_foreign_entities(self, entities_to_patch, fk_columns):
+    def load_with_foreign_entities(self, entities_to_patch, fk_columns, entity_cache: dict = None):
         # gather FK ids from current models, and loop through the FK models and
         # and load only matching object instances
-
-        # entity_cache = {}
-        for fk_column in fk_columns:
-            self.load_fk_entities_work(fk_column, entities_to_patch)
-
-    def load_fk_entities_work(self, fk_column, entities_to_patch, entity_cache: dict = None):
-        assert fk_column.has_fk(), "column '%s' does not have a foreign key" % fk_column.field
-
-        fk_ids = [getattr(instance, fk_column.field) for instance in entities_to_patch]
-
         if entity_cache is None:
             entity_cache = {}
 
-        # - construct a filter based on the id's in entities_to_patch and in the cache
-        # - load the entities for that model with the filter
-        # - update the cache
-        # - patch the entities_to_patch by referencing the corresponding object in the cache
-        fk_model = fk_column.key.model
-        fk_object_field = fk_column.object_field
-        field_in_fk_model = fk_column.key.field
-        fk_field = fk_column.field
+        # group the FK columns by the model they reference so each parent file is scanned once for all of them
+        columns_by_model = {}
+        for fk_column in fk_columns:
+            columns_by_model.setdefault(fk_column.key.model, []).append(fk_column)
+        for fk_model, columns in columns_by_model.items():
+            self.load_fk_entities_work(fk_model, columns, entities_to_patch, entity_cache)
 
+    @staticmethod
+    def fk_cache_key(fk_model, field_in_fk_model):
         # TODO: assumes a flat hierarchy of model names. Not sure if this is right or wrong...
         # NOTE: the cache_key has to be a combination of the model name and the key in the FK model because
         #   the FK doesn't have to point to the PK, just a unique key in that other model.
-        cache_key = fk_model.__name__ + '.' + field_in_fk_model
-        if cache_key not in entity_cache:
-            entity_cache[cache_key] = {}
-        cache = entity_cache[cache_key]
+        return fk_model.__name__ + '.' + field_in_fk_model
 
-        # filter func that loaded entity is in originating fk list but not in cache
-        def filter_entities(id_in_parent):
-            return id_in_parent in fk_ids and id_in_parent not in cache
+    def load_fk_entities_work(self, fk_model, fk_columns, entities_to_patch, entity_cache: dict):
+        """hash semi join of entities_to_patch with fk_model on the FK columns fk_columns, which all reference fk_model"""
+        for fk_column in fk_columns:
+            assert fk_column.has_fk(), "column '%s' does not have a foreign key" % fk_column.field
+            assert fk_column.key.model is fk_model
 
-        lambda_expr = FieldLambdaExpr(filter_entities)
-        lambda_expr.left = FieldExpr(field_in_fk_model)
-        new_entities = self.process_csv_file(fk_model, lambda_expr, ExprContext())
+        # - collect the ids the entities_to_patch reference, per key field in the FK model, that aren't in the cache
+        # - load the entities for that model whose key is in one of those sets, scanning the file once
+        # - update the cache
+        # - patch the entities_to_patch by referencing the corresponding object in the cache
+        wanted_ids = {}
+        for fk_column in fk_columns:
+            field_in_fk_model = fk_column.key.field
+            cache = entity_cache.setdefault(CsvQueryEngine.fk_cache_key(fk_model, field_in_fk_model), {})
+            ids = wanted_ids.setdefault(field_in_fk_model, set())
+            ids.update(getattr(instance, fk_column.field) for instance in entities_to_patch)
+            ids.difference_update(cache)
 
         # TODO: What if fk_field value (in the child) is None? Should that be allowed? Yes but should be
         #  configurable. Without extra code what's the behavior here?
+        wanted_ids = {field: ids for field, ids in wanted_ids.items() if ids}
+        # read once, set_tracer() may change it from another thread
+        tracer = self.tracer
+        if tracer is not None:
+            span = Span('fk', fk_model, self.model_file(fk_model), fk_tables_loaded=1 if wanted_ids else 0)
+            start = time.perf_counter()
+        new_entities = []
+        try:
+            self._patch_fk_entities(fk_model, fk_columns, entities_to_patch, entity_cache, wanted_ids, new_entities)
+        except Exception as e:
+            if tracer is not None:
+                span.error = type(e).__name__
+            raise
+        finally:
+            if tracer is not None:
+                span.duration = time.perf_counter() - start
+                span.rows_matched = len(new_entities)
+                tracer(span)
+
+    def _patch_fk_entities(self, fk_model, fk_columns, entities_to_patch, entity_cache, wanted_ids, new_entities):
+        """loads the entities of fk_model with the wanted_ids into new_entities and entity_cache and sets them on the
+           entities_to_patch"""
+        if wanted_ids:
+            filter_expr = None
+            for field_in_fk_model, ids in wanted_ids.items():
+                # set membership, the FK model's key field is the only column cast for the rows that don't match and
+                # an index on it is probed rather than scanning the file
+                in_expr = InExpr().children(FieldExpr(field_in_fk_model), ValueExpr(frozenset(ids)))
+                filter_expr = in_expr if filter_expr is None else OrExpr().children(filter_expr, in_expr)
+            new_entities.extend(self.process_csv_file(fk_model, filter_expr, ExprContext()))
 
-        for entity in new_entities:
-            cache[getattr(entity, field_in_fk_model)] = entity
+        for field_in_fk_model, ids in wanted_ids.items():
+            cache = entity_cache[CsvQueryEngine.fk_cache_key(fk_model, field_in_fk_model)]
+            for entity in new_entities:
+                key = getattr(entity, field_in_fk_model)
+                if key in ids:
+                    cache[key] = entity
 
         model_of_child = type(entities_to_patch[0])
-        for patch in entities_to_patch:
-            ck = getattr(patch, fk_field)
-            val = cache.get(ck, None)
-            if fk_column.key.strict and val is None:
-                child_field = "%s.%s" % (model_of_child.__name__, fk_column.field)
-                parent_field = "%s.%s" % (fk_model.__name__, field_in_fk_model)
-                raise QueryEngineException('foreign key value "%s" in field "%s" does not exist in "%s" entities'
-                                           % (ck, child_field, parent_field))
-            setattr(patch, fk_object_field, val)
+        for fk_column in fk_columns:
+            field_in_fk_model = fk_column.key.field
+            fk_field = fk_column.field
+            fk_object_field = fk_column.object_field
+            cache = entity_cache[CsvQueryEngine.fk_cache_key(fk_model, field_in_fk_model)]
+            for patch in entities_to_patch:
+                ck = getattr(patch, fk_field)
+                val = cache.get(ck, None)
+                if fk_column.key.strict and val is None:
+                    child_field = "%s.%s" % (model_of_child.__name__, fk_field)
+                    parent_field = "%s.%s" % (fk_model.__name__, field_in_fk_model)
+                    raise QueryEngineException('foreign key value "%s" in field "%s" does not exist in "%s" entities'
+                                               % (ck, child_field, parent_field))
+                setattr(patch, fk_object_field, val)
 
         if len(new_entities) > 0:
-            for c in fk_model.get_fk_columns():
-                self.load_fk_entities_work(c, new_entities, entity_cache)
+            self.load_with_foreign_entities(new_entities, fk_model.get_fk_columns(), entity_cache)
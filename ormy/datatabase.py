@@ -1,5 +1,12 @@
+import functools
+import time
+
+from ormy.aggregates import AGGREGATES, Aggregation
+from ormy.column import FloatColumnType, IntegerColumnType
 from ormy.query_engine import *
 from ormy.datatabase_exception import *
+from ormy.result_cache import ResultCache
+from ormy.tracing import Span
 
 
 class CodeQueryBase(ABC):
@@ -14,6 +21,16 @@ class CodeQueryBase(ABC):
     def compile(self):
         return self.context.database.compile(self.context.query)
 
+    def _exec_aggregate(self, aggregates, group_by):
+        """runs the query ended by an AggregateNode after this node, the query is left as it was and can still be run"""
+        node = AggregateNode(aggregates, group_by, self.context)
+        previous = self.child
+        self.child = node
+        try:
+            return node.exec()
+        finally:
+            self.child = previous
+
     def full_str(self):
         if self.context.query is None:
             return ""
@@ -27,7 +44,74 @@ class CodeQueryBase(ABC):
         return buf
 
 
-class QueryNode(CodeQueryBase):
+class ExecutableNode(CodeQueryBase):
+    """A node that can end a query, i.e. everything up to and including it is a complete query."""
+
+    def __init__(self, context):
+        super().__init__(context)
+
+    def exec(self):
+        return self.context.eval_query()
+
+    def exec_iter(self):
+        """like exec() but returns an iterator yielding the entities as they are loaded instead of a list"""
+        return self.context.eval_query_iter()
+
+    def aexec(self):
+        """like exec() but awaitable, for queries of an AsyncDatabase"""
+        return self.context.database.aeval(self.context.query)
+
+    def astream(self):
+        """an async iterator over the entities, for queries of an AsyncDatabase"""
+        return self.context.database.aeval_iter(self.context.query)
+
+    def limit(self, count):
+        self.child = LimitNode(count, self.context)
+        return self.child
+
+    def offset(self, count):
+        self.child = OffsetNode(count, self.context)
+        return self.child
+
+    def order_by(self, field, desc=False):
+        self.child = OrderByNode(field, desc, self.context)
+        return self.child
+
+    def count(self):
+        """the number of entities matching the query, counted without building them"""
+        return self._aggregate([('count', 'count', None)])['count']
+
+    def sum(self, field):
+        return self._aggregate([('sum', 'sum', field)])['sum']
+
+    def min(self, field):
+        return self._aggregate([('min', 'min', field)])['min']
+
+    def max(self, field):
+        return self._aggregate([('max', 'max', field)])['max']
+
+    def avg(self, field):
+        return self._aggregate([('avg', 'avg', field)])['avg']
+
+    def group_by(self, *fields):
+        self.child = GroupByNode(fields, self.context)
+        return self.child
+
+    def _aggregate(self, aggregates):
+        return self._exec_aggregate(aggregates, [])
+
+    def select(self, *fields):
+        """only set fields on the entities returned, foreign key objects are only loaded if their object field is
+           selected"""
+        self.child = SelectNode(fields, self.context)
+        return self.child
+
+    @abstractmethod
+    def __str__(self):
+        pass
+
+
+class QueryNode(ExecutableNode):
     def __init__(self, model, context):
         super().__init__(context)
         self.model = model
@@ -44,14 +128,11 @@ class QueryNode(CodeQueryBase):
         self.child = RecordLambdaNode(func, self.context)
         return self.child
 
-    def exec(self):
-        return self.context.eval_query()
-
     def __str__(self):
         return "query(model='%s')" % self.model.__name__
 
 
-class FieldLambdaNode(CodeQueryBase):
+class FieldLambdaNode(ExecutableNode):
     def __init__(self, func, context):
         super().__init__(context)
         self.func = func
@@ -66,21 +147,15 @@ class FieldLambdaNode(CodeQueryBase):
         self.child = OrNode(self.context)
         return self.child
 
-    def exec(self):
-        return self.context.eval_query()
-
     def __str__(self):
         return "flambda(%s)" % self.func
 
 
-class RecordLambdaNode(CodeQueryBase):
+class RecordLambdaNode(ExecutableNode):
     def __init__(self, func, context):
         super().__init__(context)
         self.func = func
 
-    def exec(self):
-        return self.context.eval_query()
-
     # noinspection PyPep8Naming
     def AND(self):
         self.child = AndNode(self.context)
@@ -106,6 +181,36 @@ class FieldNode(CodeQueryBase):
         self.child = EqNode(self.context)
         return self.child
 
+    def ne(self):
+        self.child = NeNode(self.context)
+        return self.child
+
+    def lt(self):
+        self.child = LtNode(self.context)
+        return self.child
+
+    def le(self):
+        self.child = LeNode(self.context)
+        return self.child
+
+    def gt(self):
+        self.child = GtNode(self.context)
+        return self.child
+
+    def ge(self):
+        self.child = GeNode(self.context)
+        return self.child
+
+    def between(self, low, high):
+        """true for values from low to high, both included"""
+        self.child = BetweenNode(low, high, self.context)
+        return self.child
+
+    def in_(self, values):
+        """true for the values in the iterable values"""
+        self.child = InNode(self.field, values, self.context)
+        return self.child
+
     def AND(self):
         self.child = AndNode(self.context)
         return self.child
@@ -191,15 +296,73 @@ class EqNode(CompNode):
         return "eq()"
 
 
+class NeNode(CompNode):
+    def __init__(self, context):
+        super().__init__(context)
+
+    def __str__(self):
+        return "ne()"
+
+
+class LtNode(CompNode):
+    def __init__(self, context):
+        super().__init__(context)
+
+    def __str__(self):
+        return "lt()"
+
+
+class LeNode(CompNode):
+    def __init__(self, context):
+        super().__init__(context)
+
+    def __str__(self):
+        return "le()"
+
+
+class GtNode(CompNode):
+    def __init__(self, context):
+        super().__init__(context)
+
+    def __str__(self):
+        return "gt()"
+
+
+class GeNode(CompNode):
+    def __init__(self, context):
+        super().__init__(context)
+
+    def __str__(self):
+        return "ge()"
+
+
 # noinspection PyPep8Naming
-class ValueNode(CodeQueryBase):
+class BetweenNode(ExecutableNode):
+    """a comparison and its bounds in one, so like a value it can end the query or be followed by AND/OR"""
+
+    def __init__(self, low, high, context):
+        super().__init__(context)
+        self.low = low
+        self.high = high
+
+    def AND(self):
+        self.child = AndNode(self.context)
+        return self.child
+
+    def OR(self):
+        self.child = OrNode(self.context)
+        return self.child
+
+    def __str__(self):
+        return "between(%s, %s)" % (self.low, self.high)
+
+
+# noinspection PyPep8Naming
+class ValueNode(ExecutableNode):
     def __init__(self, value, context):
         super().__init__(context)
         self.value = value
 
-    def exec(self):
-        return self.context.eval_query()
-
     def AND(self):
         self.child = AndNode(self.context)
         return self.child
@@ -212,9 +375,210 @@ class ValueNode(CodeQueryBase):
         return "value(%s)" % self.value
 
 
+# noinspection PyPep8Naming
+class InNode(ExecutableNode):
+    """like BetweenNode a comparison and its values in one. The values are cast to the type of the field once, here,
+       and kept in a frozenset so each row is checked with a single hash lookup."""
+
+    def __init__(self, field, values, context):
+        super().__init__(context)
+        self.column_type = context.query.model.get_column(field).column_type
+        # a Param is frozen when the prepared query is run
+        self.values = values if isinstance(values, Param) else InNode.freeze(self.column_type, values)
+
+    @staticmethod
+    def freeze(column_type, values):
+        try:
+            return frozenset(v if column_type.compatible_type(v) else column_type.cast(v) for v in values)
+        except (TypeError, ValueError) as e:
+            raise DatabaseException("in_() values must be hashable and castable to %s: %s" % (column_type, e))
+
+    def AND(self):
+        self.child = AndNode(self.context)
+        return self.child
+
+    def OR(self):
+        self.child = OrNode(self.context)
+        return self.child
+
+    def __str__(self):
+        if isinstance(self.values, Param):
+            return "in_(%s)" % self.values
+        return "in_(%d values)" % len(self.values)
+
+
+class ModifierNode(ExecutableNode):
+    """Changes what is returned for the entities matching the query rather than which entities match, so it can only be
+       followed by other modifiers."""
+
+    def __init__(self, context):
+        super().__init__(context)
+
+    @abstractmethod
+    def __str__(self):
+        pass
+
+
+class LimitNode(ModifierNode):
+    def __init__(self, count, context):
+        super().__init__(context)
+        if not isinstance(count, int) or count < 0:
+            raise DatabaseException("limit must be a non-negative integer, not '%s'" % count)
+        self.count = count
+
+    def __str__(self):
+        return "limit(%d)" % self.count
+
+
+class OffsetNode(ModifierNode):
+    def __init__(self, count, context):
+        super().__init__(context)
+        if not isinstance(count, int) or count < 0:
+            raise DatabaseException("offset must be a non-negative integer, not '%s'" % count)
+        self.count = count
+
+    def __str__(self):
+        return "offset(%d)" % self.count
+
+
+class OrderByNode(ModifierNode):
+    def __init__(self, field, desc, context):
+        super().__init__(context)
+        FieldNode.validate_field_name_in_model(context, field)
+        self.field = field
+        self.desc = desc
+
+    def __str__(self):
+        return "order_by('%s', desc=%s)" % (self.field, self.desc)
+
+
+class SelectNode(ModifierNode):
+    def __init__(self, fields, context):
+        super().__init__(context)
+        if not fields:
+            raise DatabaseException('select needs at least one field')
+        model = context.query.model
+        object_fields = [c.object_field for c in model.get_fk_columns()]
+        for field in fields:
+            if field not in object_fields:
+                FieldNode.validate_field_name_in_model(context, field)
+        self.fields = list(fields)
+
+    def __str__(self):
+        return "select(%s)" % ", ".join("'%s'" % f for f in self.fields)
+
+
+class GroupByNode(CodeQueryBase):
+    def __init__(self, fields, context):
+        super().__init__(context)
+        if not fields:
+            raise DatabaseException('group_by needs at least one field')
+        for field in fields:
+            FieldNode.validate_field_name_in_model(context, field)
+        self.fields = list(fields)
+
+    def agg(self, **aggregates):
+        """the aggregates of each group as {group: {name: value}}, each keyword argument names an aggregate and is
+           either 'count' or a (function, field) pair, e.g. agg(n='count', total=('sum', 'salary'))"""
+        if not aggregates:
+            raise DatabaseException('agg needs at least one aggregate')
+        triples = []
+        for name, aggregate in aggregates.items():
+            function, field = (aggregate, None) if aggregate == 'count' else aggregate
+            triples.append((name, function, field))
+        return self._exec_aggregate(triples, self.fields)
+
+    def __str__(self):
+        return "group_by(%s)" % ", ".join("'%s'" % f for f in self.fields)
+
+
+class AggregateNode(CodeQueryBase):
+    """Ends the query, the aggregates are returned instead of the entities"""
+
+    def __init__(self, aggregates, group_by, context):
+        super().__init__(context)
+        for name, function, field in aggregates:
+            if function not in AGGREGATES:
+                raise DatabaseException("unknown aggregate '%s', expected one of %s" % (function, list(AGGREGATES)))
+            if field is not None:
+                FieldNode.validate_field_name_in_model(context, field)
+                column_type = context.query.model.get_column(field).column_type
+                if function in ('sum', 'avg') and not isinstance(column_type, (IntegerColumnType, FloatColumnType)):
+                    raise DatabaseException("aggregate '%s' needs an integer or float field, '%s' of model '%s' is %s"
+                                            % (function, field, context.query.model.__name__, column_type))
+            elif function != 'count':
+                raise DatabaseException("aggregate '%s' needs a field" % function)
+        self.aggregation = Aggregation(aggregates, group_by)
+
+    def exec(self):
+        return self.context.eval_query()
+
+    def __str__(self):
+        return "aggregate(%s)" % ", ".join("%s=%s(%s)" % (n, f, c or '') for n, f, c in self.aggregation.aggregates)
+
+
+class PreparedQuery(object):
+    """A query parsed once and run many times with different values for its Params, e.g.
+
+           adults = db.prepare(db.query(Person).field('age').ge().value(Param('age')))
+           adults.exec(age=18)
+
+       Params can stand for the value of a comparison, the bounds of between() and the values of in_()."""
+
+    def __init__(self, database, query):
+        self.database = database
+        self.expr_list = Database._convert_query_to_raw_expressions(query)
+        self.params = set()
+        # whether each expr is a ParamExpr, worked out once rather than on each bind
+        self.is_param = [isinstance(e, ParamExpr) for e in self.expr_list]
+        for expr in self.expr_list:
+            if isinstance(expr, ParamExpr):
+                self.params.update(expr.names())
+        engine = database.query_engine
+        self.plan = QueryPlan.record(self.expr_list, engine.convert_expr_list_to_expr_tree(self.expr_list))
+
+    def bind(self, params):
+        """the expression tree of the query with the values of params"""
+        return self._link(self._bind_list(params))
+
+    def _bind_list(self, params):
+        missing = self.params.difference(params)
+        if missing:
+            raise DatabaseException("missing values for parameters %s" % sorted(missing))
+        unknown = set(params).difference(self.params)
+        if unknown:
+            raise DatabaseException("unknown parameters %s" % sorted(unknown))
+        # copies, the query may be running with other values, e.g. in exec_iter()
+        return [e.bind(params) if is_param else PreparedQuery._copy(e)
+                for e, is_param in zip(self.expr_list, self.is_param)]
+
+    def _link(self, expr_list):
+        if self.plan is None:
+            return self.database.query_engine.compile(expr_list)
+        return self.plan.bind(expr_list)
+
+    @staticmethod
+    def _copy(expr):
+        # copy.copy() goes through __reduce_ex__, this is a few times faster
+        duplicate = object.__new__(type(expr))
+        duplicate.__dict__.update(expr.__dict__)
+        return duplicate
+
+    def exec(self, **params):
+        return self.database._eval(self._bind_list(params), self._link)
+
+    def exec_iter(self, **params):
+        return self.database.query_engine.run_iter(self.bind(params))
+
+    def __str__(self):
+        return "PreparedQuery(params=%s)" % sorted(self.params)
+
+
 class Database(ABC):
-    def __init__(self, engine=None):
+    def __init__(self, engine=None, result_cache=None):
         self.query_engine = QueryEngine() if engine is None else engine
+        # optional ResultCache answering eval() of a query run before when its files haven't changed since
+        self.result_cache = result_cache
 
     def query(self, model):
         context = QueryContext(self, None)
@@ -229,9 +593,30 @@ class Database(ABC):
         # TODO: move the conversion from Node to Expr into the Node classes as a convert function
         while query is not None:
             if isinstance(query, ValueNode):
-                ret.append(ValueExpr(query.value))
+                ret.append(ParamExpr(query.value) if isinstance(query.value, Param) else ValueExpr(query.value))
             elif isinstance(query, EqNode):
                 ret.append(EqExpr())
+            elif isinstance(query, NeNode):
+                ret.append(NeExpr())
+            elif isinstance(query, LtNode):
+                ret.append(LtExpr())
+            elif isinstance(query, LeNode):
+                ret.append(LeExpr())
+            elif isinstance(query, GtNode):
+                ret.append(GtExpr())
+            elif isinstance(query, GeNode):
+                ret.append(GeExpr())
+            elif isinstance(query, InNode):
+                ret.append(InExpr())
+                if isinstance(query.values, Param):
+                    ret.append(ParamExpr(query.values, functools.partial(InNode.freeze, query.column_type)))
+                else:
+                    ret.append(ValueExpr(query.values))
+            elif isinstance(query, BetweenNode):
+                ret.append(BetweenExpr())
+                bounds = (query.low, query.high)
+                has_param = isinstance(query.low, Param) or isinstance(query.high, Param)
+                ret.append(ParamExpr(bounds) if has_param else ValueExpr(bounds))
             elif isinstance(query, FieldNode):
                 ret.append(FieldExpr(query.field))
             elif isinstance(query, QueryNode):
@@ -244,6 +629,19 @@ class Database(ABC):
                 ret.append(FieldLambdaExpr(query.func))
             elif isinstance(query, RecordLambdaNode):
                 ret.append(RecordLambdaExpr(query.func))
+            elif isinstance(query, LimitNode):
+                ret.append(LimitExpr(query.count))
+            elif isinstance(query, OffsetNode):
+                ret.append(OffsetExpr(query.count))
+            elif isinstance(query, OrderByNode):
+                ret.append(OrderByExpr(query.field, query.desc))
+            elif isinstance(query, SelectNode):
+                ret.append(SelectExpr(query.fields))
+            elif isinstance(query, GroupByNode):
+                # carried by the AggregateNode following it
+                pass
+            elif isinstance(query, AggregateNode):
+                ret.append(AggregateExpr(query.aggregation))
             else:
                 raise DatabaseException('unknown query object "%s"' % query.__name__)
 
@@ -253,7 +651,115 @@ class Database(ABC):
 
     def eval(self, query):
         expr_list = Database._convert_query_to_raw_expressions(query)
-        return self.query_engine.eval(expr_list)
+        Database._check_no_params(expr_list)
+        return self._eval(expr_list, self.query_engine.compile)
+
+    def _eval(self, expr_list, compile):
+        """runs the query of expr_list, turned into a tree by compile, through the result cache if there is one"""
+        tracer = self.query_engine.tracer
+        if tracer is None:
+            return self._eval_cached(expr_list, compile)[0]
+        span = Span('query', getattr(expr_list[0], 'model', None))
+        start = time.perf_counter()
+        try:
+            result, span.cached = self._eval_cached(expr_list, compile)
+            if isinstance(result, list):
+                span.rows_matched = len(result)
+            return result
+        except Exception as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            tracer(span)
+
+    def _eval_cached(self, expr_list, compile):
+        """the result of the query and whether it came from the result cache, None if there's no cache"""
+        cache = self.result_cache
+        key = None if cache is None else cache.key(expr_list, self.query_engine.result_key())
+        if key is None:
+            return self.query_engine.run(compile(expr_list)), None if cache is None else False
+        result = cache.get(key)
+        if result is not ResultCache.MISS:
+            return result, True
+        expr = compile(expr_list)
+        files = self.query_engine.dependencies(expr)
+        if files is None:
+            return self.query_engine.run(expr), False
+        # taken before reading so a file changing while the query runs leaves a stale entry rather than a wrong one
+        signatures = cache.signatures(files)
+        return cache.put(key, signatures, self.query_engine.run(expr)), False
+
+    def eval_iter(self, query):
+        expr_list = Database._convert_query_to_raw_expressions(query)
+        Database._check_no_params(expr_list)
+        return self.query_engine.eval_iter(expr_list)
+
+    def insert_many(self, model, entities):
+        """appends entities, instances of model or dicts of its field values, to the model's data and returns how many
+           were added. Nothing is added if any of them is invalid."""
+        return self.query_engine.insert_many(model, entities)
+
+    def update_many(self, model, entities):
+        """updates the entities, instances of model or dicts of its field values including the primary key, setting the
+           fields they have on the data with their primary key. Returns how many there were, nothing is changed if any
+           of them is invalid."""
+        return self.query_engine.update_many(model, entities)
+
+    def delete_many(self, model, keys):
+        """deletes the data of model with the primary keys, or with the keys of the instances of model. Returns how
+           many keys there were."""
+        return self.query_engine.delete_many(model, keys)
+
+    def compact(self, model):
+        """folds the updates and deletes of model into its data, returns the number of changes folded in"""
+        return self.query_engine.compact(model)
+
+    def set_tracer(self, tracer):
+        """calls tracer with a tracing.Span for each phase of each query from now on, None stops tracing"""
+        self.query_engine.tracer = tracer
+
+    def exec_many(self, queries):
+        """the results of several queries, given up to any of their ExecutableNodes, as a list in the same order. The
+           engine runs them together, e.g. the CsvQueryEngine scans the file of a model once for all the queries on it.
+           Queries answered by the result cache aren't run."""
+        expr_lists = []
+        for query in queries:
+            expr_list = Database._convert_query_to_raw_expressions(query.context.query)
+            Database._check_no_params(expr_list)
+            expr_lists.append(expr_list)
+        cache = self.result_cache
+        engine_key = None if cache is None else self.query_engine.result_key()
+        keys = [None if cache is None else cache.key(expr_list, engine_key) for expr_list in expr_lists]
+        results = [ResultCache.MISS if key is None else cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is ResultCache.MISS]
+        exprs = [self.query_engine.compile(expr_lists[i]) for i in missing]
+        signatures = {}
+        for i, expr in zip(missing, exprs):
+            files = None if keys[i] is None else self.query_engine.dependencies(expr)
+            if files is not None:
+                signatures[i] = cache.signatures(files)
+        for i, result in zip(missing, self.query_engine.run_many(exprs)):
+            results[i] = cache.put(keys[i], signatures[i], result) if i in signatures else result
+        return results
+
+    async def aeval(self, query):
+        raise DatabaseException("aexec() needs a query of an AsyncDatabase")
+
+    def aeval_iter(self, query):
+        raise DatabaseException("astream() needs a query of an AsyncDatabase")
+
+    @staticmethod
+    def _check_no_params(expr_list):
+        for expr in expr_list:
+            if isinstance(expr, ParamExpr):
+                raise DatabaseException("the query has parameter %s, run it with prepare(query).exec(...)"
+                                        % ", ".join("'%s'" % n for n in expr.names()))
+
+    def prepare(self, query):
+        """returns a PreparedQuery running query, given up to any of its ExecutableNodes, with the values of the Params
+           in it. The query is converted and parsed once, here."""
+        return PreparedQuery(self, query.context.query)
 
     def compile(self, query):
         """return the expression tree"""
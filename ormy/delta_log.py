@@ -0,0 +1,115 @@
+import csv
+import json
+import logging
+import os
+
+from ormy.atomic_file import atomic_write
+from ormy.table_cache import file_signature, read_csv_rows
+
+log = logging.getLogger(__name__)
+
+
+def log_signature(path):
+    """the file_signature of the delta log of the csv file at path, None if it has none"""
+    try:
+        return file_signature(path + DeltaLog.SUFFIX)
+    except FileNotFoundError:
+        return None
+
+
+class DeltaLog(object):
+    """The updates and deletes of a model's csv file that weren't written into the file yet, kept in a log next to it
+       (see SUFFIX) with one JSON entry per line. The log is only ever appended to, until compact() writes the changes
+       into the csv file and removes it.
+
+       Entries are keyed by the value of the model's primary key: an update sets some columns of the rows with the
+       key, a delete drops them. Later entries for a key add to earlier ones, an update of a deleted key changes
+       nothing. Applying the log twice gives the same rows as applying it once, so a reader that sees the compacted
+       file along with the log it was compacted from still reads the right rows."""
+
+    SUFFIX = '.delta'
+
+    def __init__(self, path, key_column, signature, changes, entries):
+        # the csv file
+        self.path = path
+        self.key_column = key_column
+        self.signature = signature
+        # key value -> None if deleted, otherwise {file column name: string written to the file}
+        self.changes = changes
+        self.entries = entries
+
+    @classmethod
+    def load(cls, path, key_column):
+        signature = log_signature(path)
+        changes = {}
+        entries = 0
+        if signature is not None:
+            cast = key_column.column_type.cast
+            with open(path + cls.SUFFIX, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # only the last line can be incomplete, e.g. the process died while appending it
+                        log.warning("ignoring incomplete entry at the end of the delta log of '%s'" % path)
+                        break
+                    DeltaLog._add(changes, cast(entry['key']), entry)
+                    entries += 1
+        return cls(path, key_column, signature, changes, entries)
+
+    @staticmethod
+    def _add(changes, key, entry):
+        if entry['op'] == 'delete':
+            changes[key] = None
+        elif key not in changes:
+            changes[key] = dict(entry['values'])
+        elif changes[key] is not None:
+            changes[key].update(entry['values'])
+
+    @staticmethod
+    def append(path, entries):
+        """appends entries, dicts with the op, the key and for updates the values of the columns, to the delta log of
+           the csv file at path, syncing it to disk once"""
+        with open(path + DeltaLog.SUFFIX, 'a', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def merge(self, header, rows):
+        """yields the rows of the csv file, laid out as described by header, with the changes applied"""
+        positions = {name: i for i, name in enumerate(header)}
+        key_position = positions[self.key_column.file_column_name]
+        cast = self.key_column.column_type.cast
+        updates = {key: None if values is None else [(positions[n], v) for n, v in values.items() if n in positions]
+                   for key, values in self.changes.items()}
+        get = updates.get
+        for row in rows:
+            # the row itself stands for no change, None is a delete
+            change = get(cast(row[key_position]), row)
+            if change is row:
+                yield row
+            elif change is not None:
+                row = row[:]
+                for position, value in change:
+                    row[position] = value
+                yield row
+
+    def compact(self):
+        """rewrites the csv file with the changes applied, replacing it in one step, then removes the log"""
+        rows = read_csv_rows(self.path)
+        header = next(rows, [])
+        try:
+            with atomic_write(self.path, 'w', sync=True, newline='') as f:
+                writer = csv.writer(f, lineterminator='\n')
+                writer.writerow(header)
+                writer.writerows(self.merge(header, rows))
+        finally:
+            rows.close()
+        os.remove(self.path + DeltaLog.SUFFIX)
+
+    def __len__(self):
+        return self.entries
+
+    def __str__(self):
+        return "DeltaLog(path=%s, entries=%d, keys=%d)" % (self.path, self.entries, len(self.changes))
@@ -0,0 +1,87 @@
+import heapq
+from bisect import bisect_left, bisect_right
+
+
+class HashIndex(object):
+    """Maps each value of a column to the positions of the rows holding it, in file order."""
+
+    def __init__(self, field):
+        self.field = field
+        self.positions = {}
+
+    @classmethod
+    def build(cls, field, get_value, rows):
+        index = cls(field)
+        positions = index.positions
+        for i, row in enumerate(rows):
+            value = get_value(row)
+            if value in positions:
+                positions[value].append(i)
+            else:
+                positions[value] = [i]
+        return index
+
+    def extend(self, get_value, rows, start):
+        """adds rows appended to the table, the first one being at position start"""
+        positions = self.positions
+        for i, row in enumerate(rows, start):
+            value = get_value(row)
+            if value in positions:
+                positions[value].append(i)
+            else:
+                positions[value] = [i]
+
+    def lookup(self, value):
+        return self.positions.get(value, [])
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __str__(self):
+        return "HashIndex(field='%s', keys=%d)" % (self.field, len(self.positions))
+
+
+class SortedIndex(object):
+    """The values of a column in ascending order along with the positions of their rows, so that the rows with a value
+       in a range are found by binary search."""
+
+    def __init__(self, field, keys, positions):
+        self.field = field
+        self.keys = keys
+        self.positions = positions
+
+    @classmethod
+    def build(cls, field, get_value, rows):
+        # ties stay in file order
+        pairs = sorted((get_value(row), i) for i, row in enumerate(rows))
+        return cls(field, [p[0] for p in pairs], [p[1] for p in pairs])
+
+    def extend(self, get_value, rows, start):
+        """adds rows appended to the table, the first one being at position start"""
+        pairs = sorted((get_value(row), i) for i, row in enumerate(rows, start))
+        if not pairs:
+            return
+        if not self.keys or pairs[0][0] >= self.keys[-1]:
+            # e.g. increasing ids, the new rows sort after all the others
+            self.keys.extend(p[0] for p in pairs)
+            self.positions.extend(p[1] for p in pairs)
+            return
+        merged = list(heapq.merge(zip(self.keys, self.positions), pairs))
+        self.keys = [p[0] for p in merged]
+        self.positions = [p[1] for p in merged]
+
+    def lookup(self, value):
+        return self.range(value, value)
+
+    def range(self, low=None, high=None, low_inclusive=True, high_inclusive=True):
+        """the positions of the rows with a value between low and high, a bound of None is unbounded"""
+        keys = self.keys
+        start = 0 if low is None else (bisect_left if low_inclusive else bisect_right)(keys, low)
+        stop = len(keys) if high is None else (bisect_right if high_inclusive else bisect_left)(keys, high)
+        return self.positions[start:stop]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __str__(self):
+        return "SortedIndex(field='%s', rows=%d)" % (self.field, len(self.keys))
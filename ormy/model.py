@@ -9,6 +9,8 @@ class ModelException(Exception):
 
 
 class Model(object):
+    # no __dict__ here so that compact_class() copies of the models can do without one
+    __slots__ = ()
     columns = None
 
     def __init__(self):
@@ -36,6 +38,35 @@ class Model(object):
     def __str__(cls):
         return "Model(name='%s', fields='%s')" % (cls.__name___, cls.get_field_names())
 
+    @classmethod
+    def get_column(cls, field):
+        for column in cls.columns:
+            if column.field == field:
+                return column
+        return None
+
+    @classmethod
+    def compact_class(cls):
+        """a copy of the model class keeping the fields, and the objects of foreign keys, in __slots__. Its instances
+           have no __dict__, which is most of the memory of a plain instance. The copy has the model's name, base
+           classes and methods but isn't a subclass of the model, model_class() maps it back. NOTE: if a base class of
+           the model other than Model has no __slots__ the instances get a __dict__ anyway."""
+        cls = cls.model_class()
+        compact = cls.__dict__.get('_compact_class')
+        if compact is None:
+            fields = tuple([c.field for c in cls.columns] + [c.object_field for c in cls.columns if c.has_fk()])
+            namespace = {k: v for k, v in cls.__dict__.items()
+                         if k not in ('__dict__', '__weakref__', '_compact_class') and k not in fields}
+            namespace.update({'__slots__': fields, '_model_class': cls, '__reduce__': _reduce_compact})
+            compact = type(cls.__name__, cls.__bases__, namespace)
+            cls._compact_class = compact
+        return compact
+
+    @classmethod
+    def model_class(cls):
+        """the model class, also for instances of its compact_class()"""
+        return cls.__dict__.get('_model_class', cls)
+
     @classmethod
     def get_fk_columns(cls):
         return [c for c in cls.columns if c.has_fk()]
@@ -63,14 +94,16 @@ class Model(object):
 
         return getattr(entity, pk_field)
 
-    def get_pk_column(self):
-        for c in self.columns():
+    @classmethod
+    def get_pk_column(cls):
+        for c in cls.columns:
             if c.is_primary_key():
                 return c
         return None
 
-    def get_pk_field(self):
-        col = self.get_pk_column()
+    @classmethod
+    def get_pk_field(cls):
+        col = cls.get_pk_column()
         return None if col is None else col.field
 
     @classmethod
@@ -79,7 +112,7 @@ class Model(object):
             return True
         if not isinstance(ent1, Model):
             return False
-        if type(ent1) != type(ent2):
+        if type(ent1).model_class() != type(ent2).model_class():
             return False
         for c in type(ent1).columns:
             if c.has_field(ent1) != c.has_field(ent2):
@@ -97,3 +130,17 @@ class Model(object):
                 return False
 
         return True
+
+
+def _reduce_compact(entity):
+    # the compact class can't be found by name, it is recreated from its model when unpickled
+    model = type(entity).model_class()
+    fields = type(entity).__slots__
+    return _restore_compact, (model, {f: getattr(entity, f) for f in fields if hasattr(entity, f)})
+
+
+def _restore_compact(model, values):
+    entity = model.compact_class()()
+    for field, value in values.items():
+        setattr(entity, field, value)
+    return entity
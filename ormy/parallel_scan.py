@@ -0,0 +1,201 @@
+import contextlib
+import csv
+import io
+import locale
+import multiprocessing
+import os
+import pickle
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# bytes read at a time while looking for record boundaries
+BLOCK_SIZE = 1024 * 1024
+
+# in a worker process, the engine compiling the filters of the scans of the files in a directory, by directory
+_ENGINES = {}
+# the scans started by a thread within sequential_scans() run in the thread
+_local = threading.local()
+
+
+def record_boundaries(path, targets):
+    """returns, for each of the ascending byte offsets in targets, the offset of the first record of the csv file that
+       starts after it, or the size of the file if there is none. A newline only ends a record outside of a quoted
+       field, which is worked out from the parity of the quote characters before it. That assumes quote characters only
+       appear in quoted fields, as RFC 4180 requires."""
+    boundaries = []
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        offset = 0
+        in_quotes = False
+        for target in targets:
+            if target < offset:
+                # the boundary found for the previous target is after this one too
+                boundaries.append(offset)
+                continue
+            # count the quotes up to the target
+            while offset < target:
+                chunk = f.read(min(BLOCK_SIZE, target - offset))
+                if not chunk:
+                    break
+                in_quotes ^= chunk.count(b'"') & 1 == 1
+                offset += len(chunk)
+            # then look for the first newline outside quotes
+            boundary = None
+            while boundary is None:
+                chunk = f.read(BLOCK_SIZE)
+                if not chunk:
+                    boundary = size
+                    break
+                start = 0
+                while True:
+                    newline = chunk.find(b'\n', start)
+                    if newline == -1:
+                        in_quotes ^= chunk.count(b'"', start) & 1 == 1
+                        offset += len(chunk)
+                        break
+                    in_quotes ^= chunk.count(b'"', start, newline) & 1 == 1
+                    if not in_quotes:
+                        boundary = offset + newline + 1
+                        break
+                    start = newline + 1
+            boundaries.append(boundary)
+            offset = boundary
+            f.seek(boundary)
+    return boundaries
+
+
+def header_start(path):
+    """the offset of the header record of a csv file, which comes after any blank lines, as the csv reader skips them"""
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip(b'\r\n'):
+                break
+            offset += len(line)
+    return offset
+
+
+def partition(path, parts):
+    """splits the data records, i.e. everything after the header record, of a csv file into at most parts byte ranges
+       of about the same size. Returns the (start, end) byte offsets of the ranges."""
+    size = os.path.getsize(path)
+    data_start = record_boundaries(path, [header_start(path)])[0]
+    targets = [data_start + (size - data_start) * i // parts for i in range(1, parts)]
+    starts = [data_start] + record_boundaries(path, targets)
+    ranges = []
+    for start, end in zip(starts, starts[1:] + [size]):
+        if start < end:
+            ranges.append((start, end))
+    return ranges
+
+
+def read_partition_rows(path, start, end, encoding=None):
+    """yields the non blank csv rows in the byte range [start, end) of a file, the range must be aligned to records"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode(encoding or locale.getpreferredencoding(False))
+    for row in csv.reader(io.StringIO(text, newline='')):
+        if row:
+            yield row
+
+
+def _scan_partition(path, model, header, filter_expr, start, end, count_casts):
+    """the matching rows of the byte range, the number of rows read and, if count_casts, the number of fields cast"""
+    # imported here, the engine imports this module
+    from ormy.csv_query_engine import CsvQueryEngine, CsvRowAccessor
+
+    directory = os.path.dirname(path)
+    engine = _ENGINES.get(directory)
+    if engine is None:
+        engine = _ENGINES[directory] = CsvQueryEngine(directory)
+    accessor = CsvRowAccessor(model, header, engine.convert_row_to_class_instance)
+    casts = [0]
+    if count_casts:
+        field_getter = accessor.field_getter
+
+        def counting_field_getter(field):
+            get = field_getter(field)
+
+            def counted(row):
+                casts[0] += 1
+                return get(row)
+            return counted
+        accessor.field_getter = counting_field_getter
+    predicate = engine.compile_filter(filter_expr, accessor)
+    matches = []
+    rows_read = 0
+    for row in read_partition_rows(path, start, end):
+        rows_read += 1
+        if predicate(row):
+            matches.append(row)
+    return matches, rows_read, casts[0]
+
+
+@contextlib.contextmanager
+def sequential_scans():
+    """the scans the current thread starts within never use worker processes, e.g. those of the threads of an
+       AsyncDatabase, whose queries already run side by side"""
+    previous = getattr(_local, 'sequential', False)
+    _local.sequential = True
+    try:
+        yield
+    finally:
+        _local.sequential = previous
+
+
+def parallel_scans_allowed():
+    return not getattr(_local, 'sequential', False)
+
+
+class ParallelScan(object):
+    """Filters the rows of a csv file in worker processes, each parsing, casting and filtering one byte range of the
+       file. The matching rows are returned in file order.
+
+       The workers are started by a forkserver, or spawned where there's none, never forked from the process running
+       the query, which may have other threads holding locks. They live as long as the pool and get the model, the
+       header and the filter expression of each scan pickled, so filters with lambdas, or on models that can't be
+       pickled, e.g. classes defined in a function, can't be scanned in parallel (see can_run())."""
+
+    def __init__(self, path, model, header, filter_expr, pool, workers, ranges=None, trace=None):
+        self.path = path
+        self.model = model
+        self.header = header
+        self.filter_expr = filter_expr
+        self.pool = pool
+        self.workers = workers
+        # the byte ranges, aligned to records, to scan. Worked out from the file when not given.
+        self.ranges = ranges
+        # the ScanTrace the workers' counts are added to, while tracing
+        self.trace = trace
+
+    @staticmethod
+    def create_pool(workers):
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        return ProcessPoolExecutor(workers, mp_context=context)
+
+    @staticmethod
+    def can_run(model, filter_expr):
+        """whether the scan can be handed to worker processes"""
+        try:
+            pickle.dumps((model, filter_expr))
+            return True
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return False
+
+    def run(self):
+        ranges = partition(self.path, self.workers) if self.ranges is None else self.ranges
+        count_casts = self.trace is not None
+        futures = [self.pool.submit(_scan_partition, self.path, self.model, self.header, self.filter_expr, start, end,
+                                    count_casts)
+                   for start, end in ranges]
+        try:
+            for future, (start, end) in zip(futures, ranges):
+                rows, rows_read, values_cast = future.result()
+                if self.trace is not None:
+                    self.trace.add_worker_counts(rows_read, values_cast, end - start)
+                yield from rows
+        finally:
+            # the scan was closed early, e.g. the limit was reached
+            for future in futures:
+                future.cancel()
@@ -1,5 +1,10 @@
+import operator
+import time
 from abc import abstractmethod, ABC
 
+from ormy.query_plan import PlanCache, QueryPlan
+from ormy.tracing import Span
+
 
 class QueryEngineException(Exception):
     def __init__(self, message):
@@ -89,10 +94,48 @@ class ValueExpr(OperandExpr):
         return super().__eq__(other) and (self.value == other.value)
 
 
+class Param(object):
+    """A placeholder for a value given when a prepared query is run, see Database.prepare()"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, Param) and self.name == other.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __str__(self):
+        return "Param('%s')" % self.name
+
+
+class ParamExpr(ValueExpr):
+    """A value of a prepared query. value holds the Params, alone or in a tuple, and convert, if given, is applied to
+       the value once the params are bound, e.g. to turn the values of in_() into a set."""
+
+    def __init__(self, template, convert=None):
+        super().__init__(template)
+        self.convert = convert
+
+    def names(self):
+        template = self.value if isinstance(self.value, tuple) else (self.value,)
+        return [p.name for p in template if isinstance(p, Param)]
+
+    def bind(self, params):
+        def resolve(v):
+            return params[v.name] if isinstance(v, Param) else v
+
+        value = tuple(resolve(v) for v in self.value) if isinstance(self.value, tuple) else resolve(self.value)
+        return ValueExpr(value if self.convert is None else self.convert(value))
+
+
 class CompExpr(OperatorExpr):
-    def __init__(self, op_str):
+    def __init__(self, op_str, op):
         super().__init__()
         self.op_str = op_str
+        # the plain two argument function doing the comparison, used by compiled filters to avoid a method call
+        self.op = op
 
     def operand_count(self):
         return 2
@@ -101,9 +144,8 @@ class CompExpr(OperatorExpr):
         # TODO: fill in with proper precedence
         return 12
 
-    @abstractmethod
     def perform_compare(self, a, b):
-        pass
+        return self.op(a, b)
 
     def __str__(self):
         return "%s( %s ,%s )" % (self.op_str, self.left, self.right)
@@ -148,10 +190,54 @@ class AndExpr(ConjunctionExpr):
 
 class EqExpr(CompExpr):
     def __init__(self):
-        super().__init__('eq')
+        super().__init__('eq', operator.eq)
+
+
+class NeExpr(CompExpr):
+    def __init__(self):
+        super().__init__('ne', operator.ne)
+
+
+class LtExpr(CompExpr):
+    def __init__(self):
+        super().__init__('lt', operator.lt)
+
+
+class LeExpr(CompExpr):
+    def __init__(self):
+        super().__init__('le', operator.le)
+
+
+class GtExpr(CompExpr):
+    def __init__(self):
+        super().__init__('gt', operator.gt)
+
+
+class GeExpr(CompExpr):
+    def __init__(self):
+        super().__init__('ge', operator.ge)
 
-    def perform_compare(self, a, b):
-        return a == b
+
+class BetweenExpr(CompExpr):
+    """true if the left operand is within the (low, high) bounds on the right, both bounds included"""
+
+    def __init__(self):
+        super().__init__('between', BetweenExpr.between)
+
+    @staticmethod
+    def between(value, bounds):
+        return bounds[0] <= value <= bounds[1]
+
+
+class InExpr(CompExpr):
+    """true if the left operand is one of the values in the set on the right"""
+
+    def __init__(self):
+        super().__init__('in', InExpr.contains)
+
+    @staticmethod
+    def contains(value, values):
+        return value in values
 
 
 class FieldExpr(OperandExpr):
@@ -230,6 +316,137 @@ class QueryExpr(OperatorExpr):
         return "query(model=%s,L=%s,R=%s)" % (self.model.__name__, self.left, self.right)
 
 
+class QueryModifiers(object):
+    """The modifiers wrapped around a QueryExpr, collected in one place for the engine executing the query."""
+
+    def __init__(self):
+        self.offset = 0
+        self.limit = None
+        # (field, descending) pairs, the first one is the primary sort key
+        self.order = []
+        # the fields set on the entities returned, None for all of them
+        self.fields = None
+        # the Aggregation returned instead of the entities, if any
+        self.aggregation = None
+
+    @classmethod
+    def unwrap(cls, expr):
+        """returns the QueryExpr under the modifiers in expr and the modifiers"""
+        wrapping = []
+        while isinstance(expr, ModifierExpr):
+            wrapping.append(expr)
+            expr = expr.left
+        # apply them in the order they were called on the query, e.g. a later limit() replaces an earlier one
+        modifiers = cls()
+        for modifier in reversed(wrapping):
+            modifier.apply(modifiers)
+        return expr, modifiers
+
+    def is_paged(self):
+        return self.offset > 0 or self.limit is not None
+
+    def __str__(self):
+        return "QueryModifiers(offset=%d, limit=%s, order=%s, fields=%s)" % (self.offset, self.limit, self.order,
+                                                                              self.fields)
+
+
+class ModifierExpr(OperatorExpr):
+    """Wraps the query (QueryExpr) or other modifiers, changing what the query returns rather than what it matches.
+       Modifiers don't take part in building the filter tree, they're wrapped around the query once it's built."""
+
+    def __init__(self):
+        super().__init__()
+
+    def precedence(self):
+        return 1
+
+    def operand_count(self):
+        return 1
+
+    @abstractmethod
+    def apply(self, modifiers: QueryModifiers):
+        pass
+
+    def __eq__(self, other):
+        return super().__eq__(other) and self.left == other.left
+
+
+class LimitExpr(ModifierExpr):
+    def __init__(self, count):
+        super().__init__()
+        self.count = count
+
+    def apply(self, modifiers: QueryModifiers):
+        modifiers.limit = self.count
+
+    def __str__(self):
+        return "limit(%d,L=%s)" % (self.count, self.left)
+
+    def __eq__(self, other):
+        return super().__eq__(other) and self.count == other.count
+
+
+class OffsetExpr(ModifierExpr):
+    def __init__(self, count):
+        super().__init__()
+        self.count = count
+
+    def apply(self, modifiers: QueryModifiers):
+        modifiers.offset = self.count
+
+    def __str__(self):
+        return "offset(%d,L=%s)" % (self.count, self.left)
+
+    def __eq__(self, other):
+        return super().__eq__(other) and self.count == other.count
+
+
+class OrderByExpr(ModifierExpr):
+    def __init__(self, field, desc=False):
+        super().__init__()
+        self.field = field
+        self.desc = desc
+
+    def apply(self, modifiers: QueryModifiers):
+        modifiers.order.append((self.field, self.desc))
+
+    def __str__(self):
+        return "order_by('%s',desc=%s,L=%s)" % (self.field, self.desc, self.left)
+
+    def __eq__(self, other):
+        return super().__eq__(other) and self.field == other.field and self.desc == other.desc
+
+
+class SelectExpr(ModifierExpr):
+    def __init__(self, fields):
+        super().__init__()
+        self.fields = list(fields)
+
+    def apply(self, modifiers: QueryModifiers):
+        modifiers.fields = list(self.fields)
+
+    def __str__(self):
+        return "select(%s,L=%s)" % (self.fields, self.left)
+
+    def __eq__(self, other):
+        return super().__eq__(other) and self.fields == other.fields
+
+
+class AggregateExpr(ModifierExpr):
+    def __init__(self, aggregation):
+        super().__init__()
+        self.aggregation = aggregation
+
+    def apply(self, modifiers: QueryModifiers):
+        modifiers.aggregation = self.aggregation
+
+    def __str__(self):
+        return "aggregate(%s,L=%s)" % (self.aggregation, self.left)
+
+    def __eq__(self, other):
+        return super().__eq__(other) and self.aggregation == other.aggregation
+
+
 class QueryContext(object):
     def __init__(self, database, query):
         self.database = database
@@ -241,31 +458,147 @@ class QueryContext(object):
     def eval_query(self):
         return self.database.eval(self.query)
 
+    def eval_query_iter(self):
+        return self.database.eval_iter(self.query)
+
 
 class ExprContext(object):
     def __init__(self):
         self.model_data = None
 
 
+class EntityAccessor(object):
+    """Tells compile_filter how to read a field, or the whole record, from the records a filter is applied to. This
+       default reads attributes of loaded model instances; engines supply their own for their native row format."""
+
+    def field_getter(self, field):
+        return operator.attrgetter(field)
+
+    def record_getter(self):
+        return lambda record: record
+
+
 class QueryEngine(ABC):
-    def __init__(self):
-        pass
+    def __init__(self, **kwargs):
+        # the trees of recently compiled query shapes, so a query of a known shape is linked up without parsing
+        self.plan_cache = PlanCache(kwargs.get('plan_cache_size', PlanCache.DEFAULT_MAX_PLANS))
+        # called with a tracing.Span for each phase of each query, None to not trace
+        self.tracer = kwargs.get('tracer')
 
     _TRUE = ValueExpr(True)
     _FALSE = ValueExpr(False)
 
     def compile(self, expr_list):
+        # read once, set_tracer() may change it from another thread
+        tracer = self.tracer
+        if tracer is None:
+            return self._compile(expr_list)
+        span = Span('compile')
+        start = time.perf_counter()
+        try:
+            return self._compile(expr_list)
+        except Exception as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            tracer(span)
+
+    def _compile(self, expr_list):
         # TODO: do I want to wrap the compiled expression tree in a CompiledQuery class?
-        return self.convert_expr_list_to_expr_tree(expr_list)
+        plan = self.plan_cache.get(expr_list)
+        if plan is not None:
+            return plan.bind(expr_list)
+        tree = self.convert_expr_list_to_expr_tree(expr_list)
+        plan = QueryPlan.record(expr_list, tree)
+        if plan is not None:
+            self.plan_cache.put(expr_list, plan)
+        return tree
 
     def _run(self, expr, context: ExprContext):
         # Note: don't make this abstract so we can test the platform independent functionality of the QueryEngine.
         pass
 
+    def compile_filter(self, expr, accessor=None):
+        """Turn a filter expression tree into one callable taking a record and returning the result of the filter.
+           The tree is walked once per query here instead of once per record in _run."""
+        return self._compile_expr(expr, EntityAccessor() if accessor is None else accessor)
+
+    def _compile_expr(self, expr, accessor):
+        if isinstance(expr, ValueExpr):
+            value = expr.value
+            return lambda record: value
+        elif isinstance(expr, FieldExpr):
+            return accessor.field_getter(expr.field)
+        elif isinstance(expr, WholeRecordExpr):
+            return accessor.record_getter()
+        elif issubclass(type(expr), CompExpr):
+            op = expr.op
+            left = self._compile_expr(expr.left, accessor)
+            # comparing against a constant is by far the most common case, don't pay for a call to fetch it
+            if isinstance(expr.right, ValueExpr):
+                value = expr.right.value
+                return lambda record: op(left(record), value)
+            right = self._compile_expr(expr.right, accessor)
+            return lambda record: op(left(record), right(record))
+        elif isinstance(expr, (FieldLambdaExpr, RecordLambdaExpr)):
+            func = expr.func
+            left = self._compile_expr(expr.left, accessor)
+            return lambda record: func(left(record))
+        elif isinstance(expr, AndExpr):
+            left = self._compile_expr(expr.left, accessor)
+            right = self._compile_expr(expr.right, accessor)
+            return lambda record: left(record) and right(record)
+        elif isinstance(expr, OrExpr):
+            left = self._compile_expr(expr.left, accessor)
+            right = self._compile_expr(expr.right, accessor)
+            return lambda record: left(record) or right(record)
+        else:
+            raise QueryEngineException("trying to compile unknown expr type '%s'" % type(expr).__name__)
+
+    def _run_iter(self, expr, context: ExprContext):
+        # engines that can't stream the results hand back an iterator over the complete result
+        return iter(self._run(expr, context) or [])
+
     def eval(self, expr_list):
-        expr = self.compile(expr_list)
+        return self.run(self.compile(expr_list))
+
+    def eval_iter(self, expr_list):
+        return self.run_iter(self.compile(expr_list))
+
+    def run(self, expr):
+        """runs an already compiled expression tree"""
         return self._run(expr, ExprContext())
 
+    def run_iter(self, expr):
+        return self._run_iter(expr, ExprContext())
+
+    def run_many(self, exprs):
+        """runs several compiled queries, returning their results in order. Engines may share work between them."""
+        return [self.run(expr) for expr in exprs]
+
+    def insert_many(self, model, entities):
+        raise QueryEngineException("%s can not insert entities" % type(self).__name__)
+
+    def update_many(self, model, entities):
+        raise QueryEngineException("%s can not update entities" % type(self).__name__)
+
+    def delete_many(self, model, keys):
+        raise QueryEngineException("%s can not delete entities" % type(self).__name__)
+
+    def compact(self, model):
+        return 0
+
+    def dependencies(self, expr):
+        """the files the result of the compiled query expr is read from, None if the engine can't tell, in which case
+           the result isn't cached"""
+        return None
+
+    def result_key(self):
+        """what, besides the query, the results of the engine depend on, part of the keys of a ResultCache shared by
+           several databases. The engine itself unless engines can tell they return the same results."""
+        return self
+
     @classmethod
     def optimize_simple_expr(cls, expr_list):
         # some cases are common and can be optimized quickly
@@ -274,9 +607,18 @@ class QueryEngine(ABC):
             return QueryEngine.generate_query_all_expr(expr_list[0])
         return None
 
-    # noinspection SpellCheckingInspection
     @classmethod
     def convert_expr_list_to_expr_tree(cls, expr_list):
+        # the modifiers trail the filter, they're wrapped around the tree built for the filter in the order given
+        modifiers = [e for e in expr_list if isinstance(e, ModifierExpr)]
+        expr = cls.convert_filter_list_to_expr_tree([e for e in expr_list if not isinstance(e, ModifierExpr)])
+        for modifier in modifiers:
+            expr = Expr.attach_operands(modifier, [expr])
+        return expr
+
+    # noinspection SpellCheckingInspection
+    @classmethod
+    def convert_filter_list_to_expr_tree(cls, expr_list):
         if not expr_list:
             return None
 
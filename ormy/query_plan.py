@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+
+
+class QueryPlan(object):
+    """The shape of the expression tree built from a list of exprs, recorded as which exprs of the list are the left and
+       right operands of which. The tree only depends on the types of the exprs, so the plan rebuilds the tree of any
+       list of the same types by linking its exprs up the same way, without running the shunting-yard again.
+
+       Operands that aren't from the list, e.g. the constant true filter of a query without one, are linked as is."""
+
+    def __init__(self, links, root):
+        # for each expr of the list, (left, right) where each is ('list', index), ('const', expr) or None
+        self.links = links
+        self.root = root
+
+    @classmethod
+    def record(cls, expr_list, tree):
+        """the plan of tree built from expr_list, None if tree has parts that aren't from expr_list and have operands"""
+        positions = {id(e): i for i, e in enumerate(expr_list)}
+
+        def ref(expr):
+            if expr is None:
+                return None
+            i = positions.get(id(expr))
+            return ('list', i) if i is not None else ('const', expr)
+
+        links = []
+        for expr in expr_list:
+            links.append((ref(expr.left), ref(expr.right)))
+        # a constant with operands would have to be copied on every bind, not worth a plan
+        for left, right in links:
+            for r in (left, right):
+                if r is not None and r[0] == 'const' and (r[1].left is not None or r[1].right is not None):
+                    return None
+        return cls(links, ref(tree))
+
+    def bind(self, expr_list):
+        """links the exprs of expr_list, which must have the types of the list the plan was recorded for, into a tree
+           and returns its root"""
+        def resolve(r):
+            if r is None:
+                return None
+            return expr_list[r[1]] if r[0] == 'list' else r[1]
+
+        for expr, (left, right) in zip(expr_list, self.links):
+            expr.left = resolve(left)
+            expr.right = resolve(right)
+        return resolve(self.root)
+
+
+class PlanCache(object):
+    """The QueryPlans of the last max_plans query shapes, a shape being the sequence of the types of the exprs. Safe to
+       use from several threads."""
+
+    DEFAULT_MAX_PLANS = 256
+
+    def __init__(self, max_plans=DEFAULT_MAX_PLANS):
+        self.max_plans = max_plans
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def shape(expr_list):
+        return tuple(type(e) for e in expr_list)
+
+    def get(self, expr_list):
+        shape = PlanCache.shape(expr_list)
+        with self._lock:
+            plan = self._plans.get(shape)
+            if plan is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._plans.move_to_end(shape)
+            return plan
+
+    def put(self, expr_list, plan):
+        if self.max_plans <= 0:
+            return
+        shape = PlanCache.shape(expr_list)
+        with self._lock:
+            self._plans[shape] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+
+    def __len__(self):
+        return len(self._plans)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'plans': len(self._plans), 'max_plans': self.max_plans}
+
+    def __str__(self):
+        return "PlanCache(plans=%d, max_plans=%d)" % (len(self._plans), self.max_plans)
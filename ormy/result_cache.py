@@ -0,0 +1,138 @@
+import copy
+import threading
+from collections import OrderedDict
+
+from ormy.query_engine import FieldLambdaExpr, RecordLambdaExpr
+from ormy.table_cache import file_signature
+
+
+def pure(func):
+    """marks func, used in flambda() or rlambda(), as only depending on its argument so queries using it can be cached
+       by a ResultCache. The function object is part of the key, i.e. a lambda created for each query never hits."""
+    func.ormy_pure = True
+    return func
+
+
+def is_pure(func):
+    return getattr(func, 'ormy_pure', False)
+
+
+def freeze(value):
+    """a hashable copy of value, scalars carry their type so value(1), value(1.0) and value(True) are different keys"""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, type) or callable(value):
+        return value
+    if hasattr(value, '__dict__'):
+        # e.g. an Aggregation, which compares by value but isn't hashable
+        return type(value), freeze(vars(value))
+    return type(value), value
+
+
+class ResultCache(object):
+    """Keeps the results of the last max_entries queries run with Database.eval(), keyed on the engine the query ran on,
+       see QueryEngine.result_key(), and the operations of the query and their values. Each result remembers the mtime,
+       size and inode of the files it was read from, the model's file and the files of the models its foreign keys were resolved from, and is dropped when any of them changed.
+
+       Queries with a flambda or rlambda are only cached when the function is marked with pure(). A hit hands back a
+       copy of the result list, or dict, but the entities in it are shared with other hits and shouldn't be changed."""
+
+    DEFAULT_MAX_ENTRIES = 128
+    # returned by get() when there's no usable result, a result can be None
+    MISS = object()
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self.uncacheable = 0
+        self._entries = OrderedDict()
+        # queries may run in several threads, see AsyncDatabase
+        self._lock = threading.Lock()
+
+    def key(self, expr_list, engine_key=None):
+        """the key of the query made of expr_list run on the engine with result_key() engine_key, None if it can't be
+           cached"""
+        parts = [engine_key]
+        for expr in expr_list:
+            if isinstance(expr, (FieldLambdaExpr, RecordLambdaExpr)) and not is_pure(expr.func):
+                self.uncacheable += 1
+                return None
+            parts.append((type(expr),) + tuple((k, freeze(v)) for k, v in sorted(vars(expr).items())
+                                               if k not in ('left', 'right')))
+        key = tuple(parts)
+        try:
+            hash(key)
+        except TypeError:
+            self.uncacheable += 1
+            return None
+        return key
+
+    @staticmethod
+    def _signature(path):
+        # a query may depend on a file not being there, e.g. a model without a delta log
+        try:
+            return file_signature(path)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def signatures(files):
+        return tuple((f, ResultCache._signature(f)) for f in files)
+
+    @staticmethod
+    def _is_current(signatures):
+        return all(ResultCache._signature(f) == signature for f, signature in signatures)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                signatures, result = entry
+                if ResultCache._is_current(signatures):
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    return copy.copy(result)
+                self.invalidations += 1
+                del self._entries[key]
+            self.misses += 1
+            return ResultCache.MISS
+
+    def put(self, key, signatures, result):
+        """caches result, signatures being those of its files taken before it was read"""
+        if self.max_entries <= 0:
+            return result
+        with self._lock:
+            self._entries[key] = (signatures, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self.evictions += 1
+                self._entries.popitem(last=False)
+        return copy.copy(result)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+            'uncacheable': self.uncacheable,
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+        }
+
+    def __str__(self):
+        return "ResultCache(entries=%d, max_entries=%d)" % (len(self._entries), self.max_entries)
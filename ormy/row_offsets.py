@@ -0,0 +1,181 @@
+import csv
+import hashlib
+import io
+import locale
+import logging
+import mmap
+import os
+import struct
+from array import array
+
+from ormy.atomic_file import atomic_write
+from ormy.index import HashIndex
+from ormy.table_cache import read_csv_rows
+
+log = logging.getLogger(__name__)
+
+
+class RowOffsetIndex(object):
+    """The byte offsets at which the data records of a csv file start, so any record can be read without scanning the
+       file from the top. The file is read through mmap. The offsets are saved next to the csv file (see SUFFIX) and
+       reused by later processes as long as the file hasn't changed. A file that only had records appended gets the
+       offsets of the new records added rather than being indexed again.
+
+       Blank lines aren't records, the same as for the csv reader, so record i here is row i of the table."""
+
+    SUFFIX = '.offsets'
+    # bumped when the offsets of a file change meaning, e.g. fixes of the scan, so saved ones are rebuilt
+    _MAGIC = b'ORMYOFS2'
+    # magic, size and mtime of the csv file indexed, whether it ended with a newline, digest of its tail, record count
+    _HEADER = struct.Struct('<8sQqB20sQ')
+    # bytes before the end of the indexed file checked to tell an append from any other change
+    _TAIL_BYTES = 4096
+
+    def __init__(self, path, size, mtime_ns, offsets):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.offsets = offsets
+        # hash indexes over the record numbers, dropped along with the offsets when the file changes
+        self.indexes = {}
+        with open(path, 'rb') as f:
+            # the mapping keeps a file descriptor of its own, it is released when the index is dropped or closed
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+        # taken now, the mapping shows later changes to the file
+        self.ends_with_newline = size > 0 and self._map[size - 1:size] == b'\n'
+        self.tail_digest = hashlib.sha1(self._map[max(0, size - RowOffsetIndex._TAIL_BYTES):size]).digest()
+
+    @classmethod
+    def open(cls, path, previous=None):
+        """returns the offsets of the csv file, from previous or the saved offsets if still valid, extending them if
+           records were appended or indexing the file otherwise"""
+        st = os.stat(path)
+        saved = previous if previous is not None else cls._load(path)
+        if saved is not None and (saved.size, saved.mtime_ns) == (st.st_size, st.st_mtime_ns):
+            if previous is not None:
+                return previous
+            return cls(path, st.st_size, st.st_mtime_ns, saved.offsets)
+
+        if saved is not None and cls._appended_to(saved, path, st.st_size):
+            index = cls(path, st.st_size, st.st_mtime_ns, array('Q', saved.offsets))
+            index._scan_records(saved.size)
+        else:
+            index = cls(path, st.st_size, st.st_mtime_ns, array('Q'))
+            index._scan_records(None)
+        # previous is left open, scans started before the file changed may still be reading it
+        index._save()
+        return index
+
+    @staticmethod
+    def _appended_to(saved, path, size):
+        """whether the file now at path, size bytes long, is the file indexed in saved with records appended"""
+        if size <= saved.size or not saved.ends_with_newline:
+            return False
+        with open(path, 'rb') as f:
+            f.seek(max(0, saved.size - RowOffsetIndex._TAIL_BYTES))
+            return hashlib.sha1(f.read(min(saved.size, RowOffsetIndex._TAIL_BYTES))).digest() == saved.tail_digest
+
+    def _scan_records(self, start):
+        """adds the offsets of the records from byte start, or those after the header record if start is None"""
+        data = self._map
+        pos = 0 if start is None else start
+        record_start = pos
+        in_quotes = False
+        skip_header = start is None
+        while pos < self.size:
+            newline = data.find(b'\n', pos)
+            end = self.size if newline == -1 else newline
+            in_quotes ^= data[pos:end].count(b'"') & 1 == 1
+            pos = end + 1
+            if in_quotes:
+                continue
+            # blank lines, or only a carriage return, aren't records, not even the header
+            if end - record_start > 1 or (end - record_start == 1 and data[record_start] != 13):
+                if skip_header:
+                    skip_header = False
+                else:
+                    self.offsets.append(record_start)
+            record_start = pos
+
+    @classmethod
+    def _load(cls, path):
+        try:
+            with open(path + cls.SUFFIX, 'rb') as f:
+                header = f.read(cls._HEADER.size)
+                magic, size, mtime_ns, ends_with_newline, tail_digest, count = cls._HEADER.unpack(header)
+                if magic != cls._MAGIC:
+                    return None
+                offsets = array('Q')
+                offsets.frombytes(f.read(count * offsets.itemsize))
+                if len(offsets) != count:
+                    return None
+        except (OSError, struct.error):
+            return None
+        return _SavedOffsets(size, mtime_ns, bool(ends_with_newline), tail_digest, offsets)
+
+    def _save(self):
+        try:
+            with atomic_write(self.path + RowOffsetIndex.SUFFIX) as f:
+                f.write(RowOffsetIndex._HEADER.pack(RowOffsetIndex._MAGIC, self.size, self.mtime_ns,
+                                                    self.ends_with_newline, self.tail_digest, len(self.offsets)))
+                self.offsets.tofile(f)
+        except OSError as e:
+            log.warning("could not save row offsets of '%s': %s" % (self.path, e))
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _end_of(self, i):
+        return self.offsets[i + 1] if i + 1 < len(self.offsets) else self.size
+
+    def _parse(self, start, end):
+        text = self._map[start:end].decode(locale.getpreferredencoding(False))
+        return [row for row in csv.reader(io.StringIO(text, newline='')) if row]
+
+    def read_rows(self, start, stop=None):
+        """the rows of records start up to but excluding stop"""
+        stop = len(self.offsets) if stop is None else min(stop, len(self.offsets))
+        if start >= stop:
+            return []
+        return self._parse(self.offsets[start], self._end_of(stop - 1))
+
+    def fetch_rows(self, positions):
+        """the rows of the records at the ascending record numbers in positions"""
+        return [self._parse(self.offsets[i], self._end_of(i))[0] for i in positions]
+
+    def get_index(self, field, get_value, index_class=HashIndex):
+        index = self.indexes.get(field)
+        if index is None:
+            rows = read_csv_rows(self.path)
+            next(rows, None)
+            index = index_class.build(field, get_value, rows)
+            self.indexes[field] = index
+        return index
+
+    def ranges(self, parts):
+        """splits the records into at most parts byte ranges holding about the same number of records"""
+        count = len(self.offsets)
+        starts = sorted({count * i // parts for i in range(parts)})
+        return [(self.offsets[s], self._end_of(e - 1)) for s, e in zip(starts, starts[1:] + [count]) if s < e]
+
+    def matches(self, signature):
+        mtime_ns, size, _ = signature
+        return (self.size, self.mtime_ns) == (size, mtime_ns)
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+    def __str__(self):
+        return "RowOffsetIndex(path=%s, records=%d)" % (self.path, len(self.offsets))
+
+
+class _SavedOffsets(object):
+    """Row offsets read back from a sidecar file, checked against the csv file before they are used."""
+
+    def __init__(self, size, mtime_ns, ends_with_newline, tail_digest, offsets):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.ends_with_newline = ends_with_newline
+        self.tail_digest = tail_digest
+        self.offsets = offsets
@@ -0,0 +1,81 @@
+import heapq
+import itertools
+import pickle
+import tempfile
+
+
+class Descending(object):
+    """Wraps a sort key value reversing its order, for descending keys mixed with ascending ones."""
+    __slots__ = ['value']
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __reduce__(self):
+        return Descending, (self.value,)
+
+
+def top_k(items, k, key):
+    """the k smallest items in sorted order, holding no more than k items in memory. Stable like sorted()."""
+    return heapq.nsmallest(k, items, key=key)
+
+
+class _SortedRun(object):
+    """Sorted (key, sequence, item) records spilled to a temporary file, read back in order."""
+
+    # records pickled together, larger blocks are faster to write and read but use more memory when merging
+    BLOCK_SIZE = 1000
+
+    def __init__(self, records):
+        self.file = tempfile.TemporaryFile()
+        for i in range(0, len(records), _SortedRun.BLOCK_SIZE):
+            pickle.dump(records[i:i + _SortedRun.BLOCK_SIZE], self.file, pickle.HIGHEST_PROTOCOL)
+        self.file.flush()
+
+    def __iter__(self):
+        self.file.seek(0)
+        while True:
+            try:
+                block = pickle.load(self.file)
+            except EOFError:
+                return
+            yield from block
+
+    def close(self):
+        self.file.close()
+
+
+def external_sorted(items, key, max_bytes, size_of):
+    """yields the items in sorted order. Items are buffered until their size, according to size_of, exceeds max_bytes,
+       then the buffer is sorted and spilled to a temporary file. The spilled runs are k-way merged at the end so memory
+       use stays around max_bytes no matter how many items there are. Items and keys must be picklable."""
+    buffer = []
+    buffered_bytes = 0
+    runs = []
+    sequence = itertools.count()
+    try:
+        for item in items:
+            # the sequence number keeps the sort stable across runs and means items are never compared
+            buffer.append((key(item), next(sequence), item))
+            buffered_bytes += size_of(item)
+            if buffered_bytes > max_bytes:
+                buffer.sort()
+                runs.append(_SortedRun(buffer))
+                buffer = []
+                buffered_bytes = 0
+        buffer.sort()
+        if not runs:
+            for record in buffer:
+                yield record[2]
+            return
+        for record in heapq.merge(buffer, *runs):
+            yield record[2]
+    finally:
+        for run in runs:
+            run.close()
@@ -0,0 +1,207 @@
+import csv
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from ormy.index import HashIndex
+
+log = logging.getLogger(__name__)
+
+
+def file_signature(path):
+    """what identifies a version of a file on disk, the cached copy is stale as soon as any of these change"""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def read_csv_rows(path):
+    """yields the non blank rows of a csv file, header included, as lists of strings"""
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if row:
+                yield row
+
+
+class StreamedTable(object):
+    """A table read straight from its file, the rows can only be iterated over once. Given the RowOffsetIndex of the
+       file, rows can also be read by number, which makes hash indexes usable. Given the DeltaLog of the file, the rows
+       come with its changes applied, and can't be read by number as the offsets are those of the file."""
+    in_memory = False
+
+    def __init__(self, path, offsets=None, delta=None):
+        self.path = path
+        self._reader = read_csv_rows(path)
+        self.header = next(self._reader, [])
+        self.rows = self._reader if delta is None else delta.merge(self.header, self._reader)
+        self.delta = delta
+        self.offsets = offsets
+        self.indexes = None if offsets is None else offsets.indexes
+
+    def get_index(self, field, get_value, index_class=HashIndex):
+        return self.offsets.get_index(field, get_value, index_class)
+
+    def fetch_rows(self, positions):
+        return self.offsets.fetch_rows(positions)
+
+    def count_rows(self):
+        if self.offsets is not None:
+            return len(self.offsets)
+        return sum(1 for _ in self.rows)
+
+    def close(self):
+        self.rows.close()
+        self._reader.close()
+
+
+class CachedTable(object):
+    # number of rows measured to estimate the memory used by a table
+    SIZE_SAMPLE_ROWS = 100
+    in_memory = True
+    offsets = None
+
+    def __init__(self, path, signature, header, rows):
+        self.path = path
+        self.signature = signature
+        self.header = header
+        self.rows = rows
+        self.size = CachedTable.estimate_size(header, rows)
+        # indexes over the rows, built on first use and dropped along with the table when the file changes
+        self.indexes = {}
+
+    def get_index(self, field, get_value, index_class=HashIndex):
+        index = self.indexes.get(field)
+        if index is None:
+            index = index_class.build(field, get_value, self.rows)
+            self.indexes[field] = index
+        return index
+
+    def fetch_rows(self, positions):
+        return [self.rows[i] for i in positions]
+
+    def count_rows(self):
+        return len(self.rows)
+
+    @classmethod
+    def estimate_size(cls, header, rows):
+        def row_size(row):
+            return sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+
+        sample = rows[:cls.SIZE_SAMPLE_ROWS]
+        if not sample:
+            return row_size(header)
+        return row_size(header) + sys.getsizeof(rows) + sum(row_size(r) for r in sample) * len(rows) // len(sample)
+
+    def close(self):
+        # the rows stay in memory for the next query
+        pass
+
+    def __str__(self):
+        return "CachedTable(path=%s, rows=%d, size=%d)" % (self.path, len(self.rows), self.size)
+
+
+class TableCache(object):
+    """Keeps the parsed rows of csv files in memory so repeated queries don't reread and reparse them.
+
+       A cached table is checked against the mtime, size and inode of its file on every use and reloaded when any of
+       them changed. Tables are evicted least recently used first once their estimated size exceeds max_bytes, a table
+       larger than max_bytes on its own is never cached."""
+
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        signature = file_signature(path)
+        with self._lock:
+            table = self._tables.get(path)
+            if table is not None:
+                if table.signature == signature:
+                    self.hits += 1
+                    self._tables.move_to_end(path)
+                    return table
+                self.invalidations += 1
+                self._remove(path)
+            self.misses += 1
+
+        # read outside the lock, queries running in other threads (see AsyncDatabase) use the other tables meanwhile
+        rows = list(read_csv_rows(path))
+        table = CachedTable(path, signature, rows[0] if rows else [], rows[1:])
+        if table.size <= self.max_bytes:
+            with self._lock:
+                if path in self._tables:
+                    self._remove(path)
+                self._tables[path] = table
+                self.size += table.size
+                self._evict()
+        return table
+
+    def is_current(self, path, signature):
+        """whether the cached table of path was read from the file with signature"""
+        table = self._tables.get(path)
+        return table is not None and table.signature == signature
+
+    def extend(self, path, signature, rows, update_indexes):
+        """adds rows appended to the file at path to its cached table, as long as the table was read from the file as
+           it was before the append, i.e. with signature. update_indexes(table, start) adds the rows from position start
+           to the indexes of the table. Returns whether the table was extended, otherwise it's reloaded when next used."""
+        with self._lock:
+            table = self._tables.get(path)
+            if table is None or table.signature != signature:
+                return False
+            start = len(table.rows)
+            table.rows.extend(rows)
+            update_indexes(table, start)
+            table.signature = file_signature(path)
+            self.size -= table.size
+            table.size = CachedTable.estimate_size(table.header, table.rows)
+            self.size += table.size
+            self._tables.move_to_end(path)
+            self._evict()
+            return True
+
+    def _evict(self):
+        """drops the least recently used tables until the cache is within max_bytes, called holding the lock"""
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._tables))
+            log.debug('evicting %s from table cache' % self._tables[oldest])
+            self.evictions += 1
+            self._remove(oldest)
+
+    def _remove(self, path):
+        table = self._tables.pop(path)
+        self.size -= table.size
+
+    def clear(self):
+        with self._lock:
+            self._tables.clear()
+            self.size = 0
+
+    def __contains__(self, path):
+        return path in self._tables
+
+    def __len__(self):
+        return len(self._tables)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+            'tables': len(self._tables),
+            'size': self.size,
+            'max_bytes': self.max_bytes,
+        }
+
+    def __str__(self):
+        return "TableCache(tables=%d, size=%d, max_bytes=%d)" % (len(self._tables), self.size, self.max_bytes)
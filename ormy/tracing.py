@@ -0,0 +1,270 @@
+import json
+import os
+import threading
+import time
+
+
+class Span(object):
+    """The time a phase of a query took on one model file, with what it went through. The phases are:
+
+           compile - turning the operations of the query into an expression tree
+           parse - reading the rows of the file and splitting them into fields
+           cast - converting fields to the types of their columns, for the filter, sort and aggregates, and building
+               the entities
+           filter - evaluating the filter on the rows, and sorting, paging and folding aggregates
+           fk - resolving a foreign key: scanning the file of the parent model, whose own parse, cast and filter spans
+               come first, and setting the parent entities on the children
+           query - the whole of a query run with exec(), from the spans of its phases
+
+       The counts that don't apply to a phase are None. The spans of a phase that failed are emitted too, with error
+       set."""
+
+    def __init__(self, name, model=None, file=None, start=None, duration=0.0, **kwargs):
+        self.name = name
+        self.model = model
+        self.file = file
+        # seconds since the epoch, when the phase started, and seconds it took
+        self.start = time.time() if start is None else start
+        self.duration = duration
+        self.thread = threading.get_ident()
+        self.rows_read = kwargs.get('rows_read')
+        # number of rows turned into entities
+        self.rows_cast = kwargs.get('rows_cast')
+        # number of single fields cast by the filter, sort or aggregates
+        self.values_cast = kwargs.get('values_cast')
+        # rows passing the filter, within the page of offset() and limit()
+        self.rows_matched = kwargs.get('rows_matched')
+        # bytes of the file read, estimated for scans stopping before its end, 0 for tables held in memory
+        self.bytes_read = kwargs.get('bytes_read')
+        self.fk_tables_loaded = kwargs.get('fk_tables_loaded')
+        # for query spans, whether the result came from the result cache
+        self.cached = kwargs.get('cached')
+        # the name of the exception the phase ended with, None if it succeeded
+        self.error = kwargs.get('error')
+
+    def to_dict(self):
+        values = {k: v for k, v in vars(self).items() if v is not None}
+        if self.model is not None:
+            values['model'] = self.model.__name__
+        return values
+
+    def __str__(self):
+        return "Span(%s)" % ", ".join("%s=%s" % item for item in self.to_dict().items())
+
+
+class JsonLinesTracer(object):
+    """A tracer writing each span as a line of JSON to a file, e.g.
+
+           db = CsvDatabase(path, tracer=JsonLinesTracer('spans.jsonl'))
+
+       out is a path, appended to, or a file object. Spans of queries running in several threads are written whole."""
+
+    def __init__(self, out):
+        self._owns_file = isinstance(out, str)
+        self.out = open(out, 'a') if self._owns_file else out
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span.to_dict()) + '\n'
+        with self._lock:
+            self.out.write(line)
+
+    def close(self):
+        if self._owns_file:
+            self.out.close()
+        else:
+            self.out.flush()
+
+
+class ScanTrace(object):
+    """Times the phases of a scan of a model file while tracing is on. The rows, records and entities of the scan are
+       passed through it and the casts of the accessor go through TracedAccessor; the time spent in each is taken with
+       perf_counter() and the filter is what remains. Nothing of this runs when the engine has no tracer."""
+
+    # number of rows whose size is measured, the bytes read by a scan stopping early are estimated from them
+    SIZE_SAMPLE_ROWS = 1000
+
+    def __init__(self, tracer, model, file):
+        self.tracer = tracer
+        self.model = model
+        self.file = file
+        self.in_memory = False
+        self.start = time.time()
+        # opening the table, which loads it if it isn't held in memory yet
+        self.open_time = 0.0
+        self.parse_time = 0.0
+        self.cast_time = 0.0
+        # the time spent in the whole scan, and in producing the matching records, the rest is building entities
+        self.total_time = 0.0
+        self.match_time = None
+        self.rows_read = 0
+        self.bytes_read = 0
+        self.values_cast = 0
+        self.rows_matched = 0
+        self.rows_cast = 0
+        self._casts = []
+
+    def table(self, table, open_time):
+        """table, opened in open_time seconds, with its rows read through the trace"""
+        self.open_time = open_time
+        self.in_memory = table.in_memory
+        return TracedTable(table, self)
+
+    def accessor(self, accessor):
+        return TracedAccessor(accessor, self)
+
+    def rows(self, rows, whole_file=True):
+        """yields the rows, timing each read as parsing. whole_file tells whether the rows are those of the whole file,
+           rather than some read by number."""
+        clock = time.perf_counter
+        # the size of the first rows is measured, that of a file read to the end is its size
+        measured = 0 if self.in_memory else ScanTrace.SIZE_SAMPLE_ROWS
+        parse_time = 0.0
+        count = 0
+        size = 0
+        try:
+            start = clock()
+            for row in rows:
+                parse_time += clock() - start
+                count += 1
+                if count <= measured:
+                    size += sum(map(len, row)) + len(row)
+                yield row
+                start = clock()
+            parse_time += clock() - start
+            if measured and whole_file:
+                size = os.path.getsize(self.file)
+                measured = 0
+        finally:
+            self.parse_time += parse_time
+            self.rows_read += count
+            if measured and count > measured:
+                size = size * count // measured
+            self.bytes_read += size
+            if hasattr(rows, 'close'):
+                rows.close()
+
+    def add_worker_counts(self, rows_read, values_cast, bytes_read):
+        """adds what the worker process of a parallel scan read and cast, the time it took shows as filter"""
+        self.rows_read += rows_read
+        self.values_cast += values_cast
+        self.bytes_read += bytes_read
+
+    def matches(self, records):
+        """yields the records matching the filter, timing how long each took to find"""
+        self.match_time = 0.0
+
+        def done(items, elapsed, count):
+            self.match_time += elapsed
+            self.rows_matched += count
+        return self._timed_with(records, done)
+
+    def entities(self, entities):
+        """yields the entities built from the matching records, timing the whole scan"""
+        def done(items, elapsed, count):
+            self.total_time += elapsed
+            self.rows_cast += count
+        return self._timed_with(entities, done)
+
+    def _timed_with(self, items, done):
+        clock = time.perf_counter
+        elapsed = 0.0
+        count = 0
+        try:
+            start = clock()
+            for item in items:
+                elapsed += clock() - start
+                count += 1
+                yield item
+                start = clock()
+            elapsed += clock() - start
+        finally:
+            done(items, elapsed, count)
+            if hasattr(items, 'close'):
+                items.close()
+
+    def cast(self, get):
+        """get, a function casting a field of a record, timed"""
+        clock = time.perf_counter
+        # [seconds, casts], added to the trace when it finishes
+        totals = [0.0, 0]
+        self._casts.append(totals)
+
+        def traced(record):
+            start = clock()
+            value = get(record)
+            totals[0] += clock() - start
+            totals[1] += 1
+            return value
+        return traced
+
+    def finish(self, total_time=None, rows_cast=None):
+        """emits the parse, cast and filter spans. For aggregates, which build no entities, total_time is the time of
+           the scan and rows_cast 0."""
+        if total_time is not None:
+            self.total_time = total_time
+            self.rows_cast = rows_cast
+            # folding the matches is part of the filter phase
+            self.match_time = None
+        for seconds, casts in self._casts:
+            self.cast_time += seconds
+            self.values_cast += casts
+        build_time = 0.0 if self.match_time is None else self.total_time - self.match_time
+        common = {'model': self.model, 'file': self.file, 'start': self.start}
+        self.tracer(Span('parse', duration=self.open_time + self.parse_time, rows_read=self.rows_read,
+                         bytes_read=self.bytes_read, **common))
+        self.tracer(Span('cast', duration=self.cast_time + build_time, values_cast=self.values_cast,
+                         rows_cast=self.rows_cast, **common))
+        self.tracer(Span('filter', duration=max(0.0, self.total_time - build_time - self.parse_time - self.cast_time),
+                         rows_matched=self.rows_matched, **common))
+
+
+class TracedTable(object):
+    """A table whose rows are read through a ScanTrace, everything else is the table's"""
+
+    def __init__(self, table, trace):
+        self._table = table
+        self._trace = trace
+        self.trace = trace
+        # a column table has no rows, its columns are loaded when it is opened
+        self.rows = trace.rows(table.rows) if hasattr(table, 'rows') else None
+
+    def fetch_rows(self, positions):
+        return list(self._trace.rows(self._table.fetch_rows(positions), False))
+
+    def count_rows(self):
+        if self.rows is not None and self._table.offsets is None:
+            # the rows are read, or gone through in memory, to count them
+            return sum(1 for _ in self.rows)
+        # the table knows its length without reading the rows
+        count = self._table.count_rows()
+        self._trace.rows_read += count
+        return count
+
+    def close(self):
+        if self.rows is not None:
+            self.rows.close()
+        self._table.close()
+
+    def __getattr__(self, name):
+        return getattr(self._table, name)
+
+
+class TracedAccessor(object):
+    """An accessor whose field casts are timed by a ScanTrace, everything else is the accessor's"""
+
+    def __init__(self, accessor, trace):
+        self._accessor = accessor
+        self._trace = trace
+
+    def field_getter(self, field):
+        return self._trace.cast(self._accessor.field_getter(field))
+
+    def record_getter(self):
+        return self._trace.cast(self._accessor.record_getter())
+
+    def project(self, fields):
+        return TracedAccessor(self._accessor.project(fields), self._trace)
+
+    def __getattr__(self, name):
+        return getattr(self._accessor, name)
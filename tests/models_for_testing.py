@@ -84,6 +84,16 @@ Person.columns.append(
     Column('parent_id', IntegerColumnType(), key=ForeignKey('id', Person), object_field='parent'))
 
 
+class Message(Model):
+    __csv_file__ = "messages.csv"
+    columns = [
+        Column('id', IntegerColumnType(), key=PrimaryKey()),
+        Column('sender_id', IntegerColumnType(), key=ForeignKey('id', Person), object_field='sender'),
+        Column('recipient_id', IntegerColumnType(), key=ForeignKey('id', Person), object_field='recipient'),
+        Column('text', StringColumnType()),
+    ]
+
+
 class Manufacturer(Model):
     __csv_file__ = 'manufacturers.csv'
     columns = [
@@ -116,6 +126,26 @@ class Order(Model):
     ]
 
 
+class Employee(Model):
+    __csv_file__ = "employees.csv"
+    columns = [
+        Column('id', IntegerColumnType(), key=PrimaryKey(), index='sorted'),
+        Column('last_name', StringColumnType(), index=True),
+        Column('salary', IntegerColumnType()),
+    ]
+
+
+def generate_employee_data(tmpdir):
+    f1 = tmpdir.join(Employee.__csv_file__)
+    f1.write("""id,last_name,salary
+1,Smith,100
+2,Jones,200
+3,Smith,300
+4,Fader,400
+5,Smith,500
+""")
+
+
 def generate_order_data(tmpdir):
     f1 = tmpdir.join(Person.__csv_file__)
     f1.write("""person_id,last_name,first_name
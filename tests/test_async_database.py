@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from ormy.async_database import AsyncDatabase
+from ormy.csv_database import CsvDatabase
+from ormy.datatabase_exception import DatabaseException
+from ormy.query_engine import Param
+from tests.models_for_testing import Employee, ModelLevel2, ModelLevel3, generate_employee_data
+
+
+def write_employees(tmpdir, rows):
+    tmpdir.join(Employee.__csv_file__).write("id,last_name,salary\n" +
+                                             "".join("%d,name%d,%d\n" % (i, i % 10, i * 10) for i in range(rows)))
+
+
+class TestAsyncDatabase:
+    def test_aexec(self, tmpdir):
+        generate_employee_data(tmpdir)
+        adb = AsyncDatabase(CsvDatabase(str(tmpdir)))
+
+        async def main():
+            smiths = adb.query(Employee).field('last_name').eq().value('Smith')
+            prepared = adb.prepare(adb.query(Employee).field('id').eq().value(Param('id')))
+            return await asyncio.gather(smiths.aexec(), adb.run(smiths.count), adb.run(prepared.exec, id=4))
+
+        smiths, count, fader = asyncio.run(main())
+        adb.close()
+        assert [e.id for e in smiths] == [1, 3, 5]
+        assert count == 3
+        assert [e.last_name for e in fader] == ['Fader']
+
+    def test_astream(self, tmpdir):
+        tmpdir.join(ModelLevel2.__csv_file__).write("id,value,level3_id\n" +
+                                                    "".join("%d,%d,3\n" % (i, i) for i in range(25)))
+        tmpdir.join(ModelLevel3.__csv_file__).write("id,value\n3,300\n")
+        adb = AsyncDatabase(CsvDatabase(str(tmpdir)), chunk_size=10)
+
+        async def main():
+            return [e async for e in adb.query(ModelLevel2).field('value').ge().value(2).astream()]
+
+        data = asyncio.run(main())
+        adb.close()
+        assert [e.id for e in data] == list(range(2, 25))
+        assert all(e.level3.value == 300 for e in data)
+
+    def test_loop_runs_between_chunks(self, tmpdir):
+        write_employees(tmpdir, 1000)
+        adb = AsyncDatabase(CsvDatabase(str(tmpdir)), chunk_size=100)
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(len(ticks))
+                await asyncio.sleep(0)
+
+        async def main():
+            task = asyncio.create_task(ticker())
+            count = 0
+            async for _ in adb.query(Employee).astream():
+                count += 1
+            task.cancel()
+            return count
+
+        assert asyncio.run(main()) == 1000
+        adb.close()
+        assert len(ticks) >= 10
+
+    def test_cancel_stream(self, tmpdir):
+        write_employees(tmpdir, 1000)
+        adb = AsyncDatabase(CsvDatabase(str(tmpdir)), chunk_size=100)
+        scan = adb.query_engine.scan
+        scans = []
+
+        def recording_scan(*args, **kwargs):
+            rows = scan(*args, **kwargs)
+            scans.append(rows)
+            return rows
+
+        adb.query_engine.scan = recording_scan
+        seen = []
+
+        async def consume():
+            async for e in adb.query(Employee).astream():
+                seen.append(e)
+                if len(seen) == 150:
+                    await asyncio.sleep(10)
+
+        async def main():
+            task = asyncio.create_task(consume())
+            while len(seen) < 150:
+                await asyncio.sleep(0.001)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(main())
+        adb.close()
+        # the scan was closed after the second chunk rather than read to the end
+        assert len(seen) == 150
+        assert scans[0].gi_frame is None
+
+    def test_needs_async_database(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir))
+        with pytest.raises(DatabaseException) as error:
+            asyncio.run(db.query(Employee).aexec())
+        assert "aexec() needs a query of an AsyncDatabase" in str(error.value)
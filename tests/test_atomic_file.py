@@ -0,0 +1,24 @@
+import pytest
+
+from ormy.atomic_file import atomic_write
+
+
+class TestAtomicWrite:
+    def test_replaces(self, tmpdir):
+        f1 = tmpdir.join('f1.csv')
+        f1.write('old\n')
+        with atomic_write(str(f1), 'w', sync=True) as f:
+            f.write('new\n')
+            assert f1.read() == 'old\n'
+        assert f1.read() == 'new\n'
+        assert tmpdir.listdir() == [f1]
+
+    def test_failure_leaves_file(self, tmpdir):
+        f1 = tmpdir.join('f1.bin')
+        f1.write_binary(b'old')
+        with pytest.raises(ValueError):
+            with atomic_write(str(f1)) as f:
+                f.write(b'partial')
+                raise ValueError('stopped')
+        assert f1.read_binary() == b'old'
+        assert tmpdir.listdir() == [f1]
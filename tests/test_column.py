@@ -67,6 +67,38 @@ class TestDateColumnType:
         error_str = "time data '%s' does not match format '%s'" % (date_str, TestDateColumnType.DATE_FORMAT)
         assert error_str in str(cast_error.value)
 
+    def test_cast_iso_formats(self):
+        for date_format in DateColumnType.ISO_FORMATS:
+            col = DateColumnType(date_format)
+            assert col.iso_shape is not None
+            d = datetime(2020, 8, 19, 17, 44, 49, 732176) if '%f' in date_format else datetime(2020, 8, 19, 17, 44)
+            value = d.strftime(date_format)
+            assert col.cast(value) == datetime.strptime(value, date_format)
+        col = DateColumnType('%Y-%m-%d %H:%M:%S.%f')
+        # shapes the format doesn't write go through strptime, which accepts some and rejects others
+        assert col.cast('2020-8-19 17:44:49.7') == datetime(2020, 8, 19, 17, 44, 49, 700000)
+        for value in ['2020-08-19T17:44:49.732176', '2020-08-19 17:44:49', '2020-13-19 17:44:49.732176']:
+            with pytest.raises(ValueError):
+                col.cast(value)
+        assert DateColumnType('%d/%m/%Y').iso_shape is None
+
+    def test_to_string(self):
+        d = datetime(2020, 8, 19, 17, 44, 49, 732176)
+        for date_format in DateColumnType.ISO_FORMATS + ['%d/%m/%Y %H:%M', TestDateColumnType.DATE_FORMAT]:
+            col = DateColumnType(date_format)
+            assert col.to_string(d) == d.strftime(date_format)
+            assert col.cast(col.to_string(d)) == datetime.strptime(d.strftime(date_format), date_format)
+        assert DateColumnType('%Y-%m-%d').to_string(datetime(999, 1, 2)) == '0999-01-02'
+        assert IntegerColumnType().to_string(-12) == '-12'
+        assert FloatColumnType().cast(FloatColumnType().to_string(0.1 + 0.2)) == 0.1 + 0.2
+
+    def test_cast_memo(self):
+        col = DateColumnType('%Y-%m-%d', memo_size=2)
+        assert col.cast('2020-08-19') is col.cast('2020-08-19')
+        col = DateColumnType('%Y-%m-%d', memo_size=0)
+        assert col.cast('2020-08-19') == datetime(2020, 8, 19)
+        assert col.cast('2020-08-19') is not col.cast('2020-08-19')
+
 
 class TestStringColumnType:
     def test_compatible_type(self):
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from ormy.column_sidecar import sidecar_path
+from ormy.csv_database import CsvDatabase
+from tests.models_for_testing import AllValueTypes
+
+np = pytest.importorskip('numpy')
+
+from ormy.columnar_query_engine import ColumnTable  # noqa: E402
+
+DATA = """int_col,float_col,string_col,date_col
+100,1.5,foobar1,2020-08-19 17:44:49.732176
+101,2.5,foobar2,2020-08-20 17:44:49.732176
+102,1.5,foobar3,2020-08-21 17:44:49.732176
+"""
+
+
+def query_all(tmpdir):
+    db = CsvDatabase(str(tmpdir), columnar=True, column_sidecars=True)
+    return db.query(AllValueTypes).exec()
+
+
+def fail_load(*args):
+    raise AssertionError('the csv file was parsed')
+
+
+class TestColumnSidecar:
+    def test_written_and_reused(self, tmpdir, monkeypatch):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write(DATA)
+        expected = [(e.int_col, e.float_col, e.string_col, e.date_col) for e in query_all(tmpdir)]
+        assert os.path.exists(sidecar_path(str(f1)))
+
+        monkeypatch.setattr(ColumnTable, 'load', fail_load)
+        data = query_all(tmpdir)
+        assert [(e.int_col, e.float_col, e.string_col, e.date_col) for e in data] == expected
+        db = CsvDatabase(str(tmpdir), columnar=True, column_sidecars=True)
+        assert [e.int_col for e in db.query(AllValueTypes).field('float_col').eq().value(1.5).exec()] == [100, 102]
+
+    def test_reused_after_touch(self, tmpdir, monkeypatch):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write(DATA)
+        query_all(tmpdir)
+        os.utime(str(f1), ns=(0, 0))
+        monkeypatch.setattr(ColumnTable, 'load', fail_load)
+        assert len(query_all(tmpdir)) == 3
+
+    def test_rebuilt_when_stale(self, tmpdir):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write(DATA)
+        query_all(tmpdir)
+        # same size, different content
+        f1.write(DATA.replace('foobar1', 'foobar9'))
+        os.utime(str(f1), ns=(0, 0))
+        assert [e.string_col for e in query_all(tmpdir)][0] == 'foobar9'
+        f1.write(DATA + "103,4.5,foobar4,2020-08-22 17:44:49.732176\n")
+        assert len(query_all(tmpdir)) == 4
+
+    def test_rebuilt_for_other_schema(self, tmpdir, monkeypatch):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write(DATA)
+        query_all(tmpdir)
+        loads = []
+        load = ColumnTable.load.__func__
+        monkeypatch.setattr(ColumnTable, 'load', classmethod(lambda cls, *args: loads.append(1) or load(cls, *args)))
+        monkeypatch.setattr(AllValueTypes, 'columns', AllValueTypes.columns[:2])
+        assert [e.int_col for e in query_all(tmpdir)] == [100, 101, 102]
+        assert loads == [1]
+
+    def test_strings(self, tmpdir, monkeypatch):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        data = DATA.replace('foobar1', '""').replace('foobar2', 'na\u00efve \u2603').replace('foobar3', '"a,\nb"')
+        f1.write_text(data, 'utf-8')
+        expected = ['', 'na\u00efve \u2603', 'a,\nb']
+        assert [e.string_col for e in query_all(tmpdir)] == expected
+        monkeypatch.setattr(ColumnTable, 'load', fail_load)
+        assert [e.string_col for e in query_all(tmpdir)] == expected
+
+    def test_unsupported_values_not_saved(self, tmpdir):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        # too large for int64, the column holds python ints
+        f1.write(DATA.replace('101,', '%d,' % 2 ** 70))
+        assert [e.int_col for e in query_all(tmpdir)] == [100, 2 ** 70, 102]
+        assert not os.path.exists(sidecar_path(str(f1)))
+
+    def test_object_dtype_not_loaded(self, tmpdir):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write(DATA)
+        query_all(tmpdir)
+        sidecar = tmpdir.join(sidecar_path(AllValueTypes.__csv_file__))
+        content = sidecar.read_binary()
+        assert content.count(b'"<i8"') == 1
+        sidecar.write_binary(content.replace(b'"<i8"', b'"|O"'))
+        assert [e.int_col for e in query_all(tmpdir)] == [100, 101, 102]
@@ -0,0 +1,160 @@
+import pytest
+from datetime import datetime
+
+from ormy.csv_database import CsvDatabase
+from ormy.model import Model
+from ormy.query_engine import QueryEngineException
+from tests.models_for_testing import AllValueTypes, ModelLevel1, ModelLevel2, ModelLevel3
+
+np = pytest.importorskip('numpy')
+
+
+def write_all_value_types(tmpdir):
+    tmpdir.join(AllValueTypes.__csv_file__).write("""int_col,float_col,string_col,date_col
+100,1.5,foobar1,2020-08-19 17:44:49.732176
+101,2.5,foobar2,2020-08-20 17:44:49.732176
+102,1.5,foobar3,2020-08-21 17:44:49.732176
+100,3.5,foobar4,2020-08-22 17:44:49.732176
+""")
+
+
+class TestColumnarQueryEngine:
+    def test_query_no_filter(self, tmpdir):
+        write_all_value_types(tmpdir)
+        data = CsvDatabase(str(tmpdir), columnar=True).query(AllValueTypes).exec()
+        assert len(data) == 4
+        m1 = data[0]
+        assert isinstance(m1.int_col, int) and m1.int_col == 100
+        assert isinstance(m1.float_col, float) and m1.float_col == 1.5
+        assert isinstance(m1.string_col, str) and m1.string_col == 'foobar1'
+        d = datetime.strptime('2020-08-19 17:44:49.732176', AllValueTypes.ALL_VALUE_TYPES_FORMAT_STR)
+        assert isinstance(m1.date_col, datetime) and m1.date_col == d
+
+    def test_vectorized_filters(self, tmpdir):
+        write_all_value_types(tmpdir)
+        db = CsvDatabase(str(tmpdir), columnar=True)
+        d = datetime.strptime('2020-08-21 17:44:49.732176', AllValueTypes.ALL_VALUE_TYPES_FORMAT_STR)
+        queries = [
+            db.query(AllValueTypes).field('int_col').eq().value(100),
+            db.query(AllValueTypes).field('int_col').eq().value(100).AND().field('float_col').eq().value(3.5),
+            db.query(AllValueTypes).field('string_col').eq().value('foobar2').OR().field('date_col').eq().value(d),
+            db.query(AllValueTypes).field('int_col').flambda(lambda v: v > 100).AND().field('float_col').eq()
+                .value(1.5),
+            db.query(AllValueTypes).rlambda(lambda rec: rec.int_col == 100).OR().field('int_col').eq().value(102),
+        ]
+        row_db = CsvDatabase(str(tmpdir))
+        for query in queries:
+            expected = row_db.eval(query.context.query)
+            actual = query.exec()
+            assert len(expected) > 0
+            assert len(actual) == len(expected)
+            for e, a in zip(expected, actual):
+                assert Model.compare(e, a)
+
+    def test_modifiers(self, tmpdir):
+        write_all_value_types(tmpdir)
+        db = CsvDatabase(str(tmpdir), columnar=True)
+        data = db.query(AllValueTypes).field('float_col').eq().value(1.5).OR().field('int_col').eq().value(100) \
+            .order_by('date_col', desc=True).limit(2).exec()
+        assert [e.string_col for e in data] == ['foobar4', 'foobar3']
+
+    def test_foreign_keys(self, tmpdir):
+        tmpdir.join(ModelLevel1.__csv_file__).write("""id,value,level2_id
+1,100,2
+11,100,22
+""")
+        tmpdir.join(ModelLevel2.__csv_file__).write("""id,value,level3_id
+2,200,3
+22,200200,3
+""")
+        tmpdir.join(ModelLevel3.__csv_file__).write("""id,value
+3,300
+""")
+        data = CsvDatabase(str(tmpdir), columnar=True).query(ModelLevel1).field('value').eq().value(100).exec()
+        assert [e.level2.level3.value for e in data] == [300, 300]
+        assert data[0].level2.level3 is data[1].level2.level3
+
+    def test_reload_on_change(self, tmpdir):
+        write_all_value_types(tmpdir)
+        db = CsvDatabase(str(tmpdir), columnar=True)
+        assert len(db.query(AllValueTypes).exec()) == 4
+        tmpdir.join(AllValueTypes.__csv_file__).write("""int_col,float_col,string_col,date_col
+100,1.5,foobar1,2020-08-19 17:44:49.732176
+""")
+        assert len(db.query(AllValueTypes).exec()) == 1
+
+    def test_select(self, tmpdir):
+        write_all_value_types(tmpdir)
+        data = CsvDatabase(str(tmpdir), columnar=True).query(AllValueTypes).field('int_col').eq().value(100) \
+            .select('string_col').exec()
+        assert [e.string_col for e in data] == ['foobar1', 'foobar4']
+        assert not hasattr(data[0], 'int_col')
+
+    def test_range_comparisons(self, tmpdir):
+        write_all_value_types(tmpdir)
+        db = CsvDatabase(str(tmpdir), columnar=True)
+        d = datetime.strptime('2020-08-21 17:44:49.732176', AllValueTypes.ALL_VALUE_TYPES_FORMAT_STR)
+        assert [e.string_col for e in db.query(AllValueTypes).field('int_col').gt().value(100).exec()] \
+            == ['foobar2', 'foobar3']
+        assert [e.string_col for e in db.query(AllValueTypes).field('date_col').between(d, d).OR()
+                .field('float_col').ge().value(3.0).exec()] == ['foobar3', 'foobar4']
+        assert [e.string_col for e in db.query(AllValueTypes).field('string_col').ne().value('foobar1').AND()
+                .field('float_col').lt().value(2.0).exec()] == ['foobar3']
+
+    def test_in(self, tmpdir):
+        write_all_value_types(tmpdir)
+        db = CsvDatabase(str(tmpdir), columnar=True)
+        assert [e.string_col for e in db.query(AllValueTypes).field('int_col').in_([101, '102', 7]).exec()] \
+            == ['foobar2', 'foobar3']
+        assert [e.int_col for e in db.query(AllValueTypes).field('string_col').in_({'foobar1', 'foobar4'}).exec()] \
+            == [100, 100]
+        assert db.query(AllValueTypes).field('float_col').in_([]).exec() == []
+
+    def test_aggregates(self, tmpdir):
+        write_all_value_types(tmpdir)
+        db = CsvDatabase(str(tmpdir), columnar=True)
+        assert db.query(AllValueTypes).count() == 4
+        assert db.query(AllValueTypes).field('int_col').eq().value(100).sum('float_col') == 5.0
+        assert db.query(AllValueTypes).avg('int_col') == 100.75
+        assert db.query(AllValueTypes).min('string_col') == 'foobar1'
+        d = datetime.strptime('2020-08-22 17:44:49.732176', AllValueTypes.ALL_VALUE_TYPES_FORMAT_STR)
+        assert db.query(AllValueTypes).max('date_col') == d
+        assert db.query(AllValueTypes).field('int_col').gt().value(200).min('int_col') is None
+        assert db.query(AllValueTypes).group_by('int_col').agg(n='count') == {100: {'n': 2}, 101: {'n': 1},
+                                                                            102: {'n': 1}}
+
+    def test_nan_min_max(self, tmpdir):
+        tmpdir.join(AllValueTypes.__csv_file__).write("""int_col,float_col,string_col,date_col
+1,nan,a,2020-08-19 17:44:49.732176
+1,2.5,b,2020-08-20 17:44:49.732176
+2,nan,c,2020-08-21 17:44:49.732176
+1,0.5,d,2020-08-22 17:44:49.732176
+""")
+        for kwargs in [{}, {'columnar': True}]:
+            db = CsvDatabase(str(tmpdir), **kwargs)
+            # a NaN first doesn't hide the values after it
+            assert db.query(AllValueTypes).min('float_col') == 0.5
+            assert db.query(AllValueTypes).max('float_col') == 2.5
+            assert db.query(AllValueTypes).field('int_col').eq().value(2).min('float_col') is None
+
+    def test_unsupported_options(self, tmpdir):
+        write_all_value_types(tmpdir)
+        for kwargs in [{'cache_size': 1024}, {'row_offsets': True}, {'workers': 2}]:
+            with pytest.raises(QueryEngineException) as error:
+                CsvDatabase(str(tmpdir), columnar=True, **kwargs)
+            assert "the columnar query engine does not support" in str(error.value)
+
+    def test_insert_extends_columns(self, tmpdir):
+        write_all_value_types(tmpdir)
+        db = CsvDatabase(str(tmpdir), columnar=True, column_sidecars=True)
+        assert len(db.query(AllValueTypes).field('int_col').eq().value(100).exec()) == 2
+        d = datetime(2020, 8, 23, 1, 2, 3, 4)
+        db.insert_many(AllValueTypes, [AllValueTypes.create({'int_col': 100, 'float_col': 0.25, 'string_col': 'new',
+                                                             'date_col': d})])
+        data = db.query(AllValueTypes).field('int_col').eq().value(100).exec()
+        assert [(e.string_col, e.date_col) for e in data][-1] == ('new', d)
+        table = db.query_engine.column_tables[db.query_engine.model_file(AllValueTypes)]
+        assert table.length == 5 and table.arrays['int_col'].dtype == np.int64
+        # the sidecar was rewritten, a new database maps the five rows from it
+        other = CsvDatabase(str(tmpdir), columnar=True, column_sidecars=True)
+        assert other.query(AllValueTypes).count() == 5
@@ -1,11 +1,13 @@
 import pytest
+from datetime import datetime
 
 from ormy.column import *
 from ormy.csv_database import CsvDatabase
 from ormy.datatabase_exception import DatabaseException
 from ormy.model import Model
+from ormy.query_engine import QueryEngineException, Param
 from tests.models_for_testing import Person, AllValueTypes, \
-    ModelLevel2, ModelLevel3, ModelLevel1
+    ModelLevel2, ModelLevel3, ModelLevel1, Message
 
 
 class TestCsvDatabase:
@@ -37,6 +39,13 @@ class TestCsvDatabase:
         d = datetime.strptime('2020-08-19 17:44:49.732176', AllValueTypes.ALL_VALUE_TYPES_FORMAT_STR)
         assert isinstance(m1.date_col, datetime) and m1.date_col == d
 
+    def test_missing_column(self, tmpdir):
+        tmpdir.join(AllValueTypes.__csv_file__).write("int_col,float_col,string_col\n1,1.5,a\n")
+        db = CsvDatabase(str(tmpdir))
+        with pytest.raises(AssertionError) as error:
+            db.query(AllValueTypes).exec()
+        assert "does not match the number of columns (4) in model 'AllValueTypes'" in str(error.value)
+
     def test_query_simple_filter(self, tmpdir):
         f1 = tmpdir.join(AllValueTypes.__csv_file__)
         f1.write("""int_col,float_col,string_col,date_col
@@ -124,6 +133,19 @@ class TestCsvDatabase:
         m = data[0]
         assert m.int_col == 100 and m.string_col == 'foobar4'
 
+    def test_query_casts_only_filtered_fields(self, tmpdir):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write("""int_col,float_col,string_col,date_col
+100,1.00234,foobar1,2020-08-19 17:44:49.732176
+101,1.00234,foobar2,not a date
+""")
+        db = CsvDatabase(str(tmpdir))
+        # the row with the bad date is dropped by the filter before the date column is ever cast
+        data = db.query(AllValueTypes).field('int_col').eq().value(100).exec()
+        assert len(data) == 1 and data[0].string_col == 'foobar1'
+        with pytest.raises(ValueError):
+            db.query(AllValueTypes).field('int_col').eq().value(101).exec()
+
     def test_multiple_fk_one_deep(self, tmpdir):
         db = CsvDatabase(str(tmpdir))
         f1 = tmpdir.join(ModelLevel2.__csv_file__)
@@ -236,3 +258,395 @@ class TestCsvDatabase:
                                                 {'id': 2, 'last_name': 'Smith', 'first_name': 'Elizabeth',
                                                  'parent_id': grand_father.id,
                                                  'parent': grand_father})}))
+
+    def test_fk_columns_to_same_model_scan_once(self, tmpdir):
+        f1 = tmpdir.join(Person.__csv_file__)
+        f1.write("""id,last_name,first_name,parent_id
+1,Smith,Craig,1
+2,Smith,Elizabeth,2
+3,Harris,Joesph,1
+""")
+        f2 = tmpdir.join(Message.__csv_file__)
+        f2.write("""id,sender_id,recipient_id,text
+1,1,2,hello
+2,2,3,hi
+""")
+        db = CsvDatabase(tmpdir)
+        opened = []
+        open_table = db.query_engine.open_table
+
+        def counting_open_table(model):
+            opened.append(model)
+            return open_table(model)
+        db.query_engine.open_table = counting_open_table
+
+        messages = db.query(Message).exec()
+        assert [(m.sender.first_name, m.recipient.first_name) for m in messages] == \
+               [('Craig', 'Elizabeth'), ('Elizabeth', 'Joesph')]
+        assert messages[0].recipient is messages[1].sender
+        # the parent of Joesph is Craig who is already loaded
+        assert messages[1].recipient.parent is messages[0].sender
+        assert opened == [Message, Person]
+
+    def test_missing_fk_value(self, tmpdir):
+        f1 = tmpdir.join(ModelLevel2.__csv_file__)
+        f1.write("""id,value,level3_id
+1,200,3
+2,200,4
+""")
+        f2 = tmpdir.join(ModelLevel3.__csv_file__)
+        f2.write("""id,value
+3,300
+""")
+        db = CsvDatabase(str(tmpdir))
+        with pytest.raises(QueryEngineException) as err:
+            db.query(ModelLevel2).exec()
+        assert 'foreign key value "4" in field "ModelLevel2.level3_id" does not exist in "ModelLevel3.id" entities' \
+               == str(err.value.message)
+
+    def test_exec_iter(self, tmpdir):
+        f1 = tmpdir.join(ModelLevel2.__csv_file__)
+        f1.write("""id,value,level3_id
+1,200,3
+2,200,33
+3,200,3
+4,200,33
+5,200,bad
+""")
+        f2 = tmpdir.join(ModelLevel3.__csv_file__)
+        f2.write("""id,value
+3,300
+33,330
+""")
+        db = CsvDatabase(str(tmpdir), fk_batch_size=2)
+        stream = db.query(ModelLevel2).field('value').eq().value(200).exec_iter()
+        # the first batch is handed out before the bad row at the end of the file is read
+        first, second, third, fourth = next(stream), next(stream), next(stream), next(stream)
+        assert [first.id, second.id, third.id, fourth.id] == [1, 2, 3, 4]
+        assert [first.level3.value, second.level3.value] == [300, 330]
+        # the level3 entities loaded for the first batch are reused for the second one
+        assert third.level3 is first.level3 and fourth.level3 is second.level3
+        with pytest.raises(ValueError):
+            next(stream)
+        with pytest.raises(ValueError):
+            db.query(ModelLevel2).field('value').eq().value(200).exec()
+
+    def test_limit_offset(self, tmpdir):
+        f1 = tmpdir.join(ModelLevel3.__csv_file__)
+        f1.write("id,value\n" + "".join("%d,%d\n" % (i, i % 2) for i in range(10)))
+        db = CsvDatabase(str(tmpdir))
+        assert [e.id for e in db.query(ModelLevel3).limit(3).exec()] == [0, 1, 2]
+        assert [e.id for e in db.query(ModelLevel3).offset(8).exec()] == [8, 9]
+        assert [e.id for e in db.query(ModelLevel3).field('value').eq().value(1).offset(1).limit(2).exec()] == [3, 5]
+        assert [e.id for e in db.query(ModelLevel3).limit(2).offset(4).exec_iter()] == [4, 5]
+        assert db.query(ModelLevel3).limit(0).exec() == []
+        assert db.query(ModelLevel3).offset(20).exec() == []
+
+    def test_limit_stops_scan(self, tmpdir):
+        f1 = tmpdir.join(ModelLevel2.__csv_file__)
+        f1.write("""id,value,level3_id
+1,200,3
+2,200,4
+3,bad,3
+""")
+        f2 = tmpdir.join(ModelLevel3.__csv_file__)
+        f2.write("""id,value
+3,300
+""")
+        db = CsvDatabase(str(tmpdir))
+        # the bad row is never read and the foreign key of the second row, missing in level3, is never resolved
+        data = db.query(ModelLevel2).field('value').eq().value(200).limit(1).exec()
+        assert [e.level3.value for e in data] == [300]
+
+    def test_order_by(self, tmpdir):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write("""int_col,float_col,string_col,date_col
+3,1.5,b,2020-08-19 17:44:49.732176
+1,2.5,a,2020-08-20 17:44:49.732176
+2,1.5,c,2020-08-18 17:44:49.732176
+4,0.5,a,2020-08-21 17:44:49.732176
+""")
+        for db in [CsvDatabase(str(tmpdir)), CsvDatabase(str(tmpdir), sort_memory=1)]:
+            assert [e.int_col for e in db.query(AllValueTypes).order_by('int_col').exec()] == [1, 2, 3, 4]
+            assert [e.int_col for e in db.query(AllValueTypes).order_by('date_col', desc=True).exec()] == [4, 1, 3, 2]
+            assert [e.int_col for e in db.query(AllValueTypes).order_by('float_col').order_by('string_col', desc=True)
+                    .exec()] == [4, 2, 3, 1]
+            assert [e.int_col for e in db.query(AllValueTypes).field('string_col').eq().value('a')
+                    .order_by('int_col', desc=True).exec_iter()] == [4, 1]
+            # top k
+            assert [e.int_col for e in db.query(AllValueTypes).order_by('float_col').limit(2).exec()] == [4, 3]
+            assert [e.int_col for e in db.query(AllValueTypes).order_by('int_col').offset(1).limit(2).exec()] == [2, 3]
+
+    def test_compact_entities(self, tmpdir):
+        tmpdir.join(ModelLevel1.__csv_file__).write("""id,value,level2_id
+1,100,2
+11,100,22
+""")
+        tmpdir.join(ModelLevel2.__csv_file__).write("""id,value,level3_id
+2,200,3
+22,200200,3
+""")
+        tmpdir.join(ModelLevel3.__csv_file__).write("""id,value
+3,300
+""")
+        db = CsvDatabase(str(tmpdir), compact_entities=True)
+        data = db.query(ModelLevel1).rlambda(lambda e: e.level2_id == 22).OR().field('id').eq().value(1).exec()
+        assert [e.id for e in data] == [1, 11]
+        l1 = data[0]
+        assert not hasattr(l1, '__dict__') and not hasattr(l1.level2.level3, '__dict__')
+        assert type(l1).model_class() is ModelLevel1
+        assert Model.compare(l1, ModelLevel1.create({
+            'id': 1,
+            'value': 100,
+            'level2_id': 2,
+            'level2': ModelLevel2.create({'id': 2, 'value': 200, 'level3_id': 3, 'level3': None})
+        }))
+        assert l1.level2.level3 is data[1].level2.level3
+
+    def test_select(self, tmpdir):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write("""int_col,float_col,string_col,date_col
+1,1.5,a,not a date
+2,2.5,b,not a date
+3,1.5,c,not a date
+""")
+        db = CsvDatabase(str(tmpdir))
+        data = db.query(AllValueTypes).field('float_col').eq().value(1.5).order_by('int_col', desc=True) \
+            .select('string_col', 'int_col').exec()
+        assert [(e.int_col, e.string_col) for e in data] == [(3, 'c'), (1, 'a')]
+        assert not hasattr(data[0], 'float_col') and not hasattr(data[0], 'date_col')
+
+    def test_select_foreign_keys(self, tmpdir):
+        tmpdir.join(ModelLevel1.__csv_file__).write("""id,value,level2_id
+1,100,2
+11,100,22
+""")
+        db = CsvDatabase(str(tmpdir))
+        # the parent file doesn't exist, it must not be read
+        data = db.query(ModelLevel1).select('id', 'level2_id').exec()
+        assert [(e.id, e.level2_id) for e in data] == [(1, 2), (11, 22)]
+        assert not hasattr(data[0], 'level2')
+
+        tmpdir.join(ModelLevel2.__csv_file__).write("""id,value,level3_id
+2,200,3
+22,200200,3
+""")
+        tmpdir.join(ModelLevel3.__csv_file__).write("""id,value
+3,300
+""")
+        data = db.query(ModelLevel1).select('level2').exec()
+        assert [e.level2.level3.value for e in data] == [300, 300]
+        assert [e.level2_id for e in data] == [2, 22]
+        assert not hasattr(data[0], 'value')
+
+    def test_range_comparisons(self, tmpdir):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write("""int_col,float_col,string_col,date_col
+3,1.5,b,2020-08-19 17:44:49.732176
+1,2.5,a,2020-08-20 17:44:49.732176
+2,1.5,c,2020-08-18 17:44:49.732176
+4,0.5,a,2020-08-21 17:44:49.732176
+""")
+        db = CsvDatabase(str(tmpdir))
+        d = datetime.strptime('2020-08-19 17:44:49.732176', AllValueTypes.ALL_VALUE_TYPES_FORMAT_STR)
+
+        def ids(query):
+            return [e.int_col for e in query.exec()]
+
+        assert ids(db.query(AllValueTypes).field('int_col').lt().value(3)) == [1, 2]
+        assert ids(db.query(AllValueTypes).field('float_col').le().value(1.5)) == [3, 2, 4]
+        assert ids(db.query(AllValueTypes).field('date_col').gt().value(d)) == [1, 4]
+        assert ids(db.query(AllValueTypes).field('date_col').ge().value(d)) == [3, 1, 4]
+        assert ids(db.query(AllValueTypes).field('string_col').ne().value('a')) == [3, 2]
+        assert ids(db.query(AllValueTypes).field('int_col').between(2, 3).OR().field('string_col').eq().value('a')) \
+            == [3, 1, 2, 4]
+        assert ids(db.query(AllValueTypes).field('float_col').between(1.0, 2.0).AND().field('int_col').ne()
+                   .value(3)) == [2]
+
+    def test_in(self, tmpdir):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write("""int_col,float_col,string_col,date_col
+3,1.5,b,2020-08-19 17:44:49.732176
+1,2.5,a,2020-08-20 17:44:49.732176
+2,1.5,c,2020-08-18 17:44:49.732176
+""")
+        db = CsvDatabase(str(tmpdir))
+        d = datetime.strptime('2020-08-18 17:44:49.732176', AllValueTypes.ALL_VALUE_TYPES_FORMAT_STR)
+        assert [e.int_col for e in db.query(AllValueTypes).field('int_col').in_(range(2, 10)).exec()] == [3, 2]
+        # values are cast to the type of the field
+        assert [e.int_col for e in db.query(AllValueTypes).field('int_col').in_(['1', '3']).exec()] == [3, 1]
+        assert [e.int_col for e in db.query(AllValueTypes).field('date_col').in_(
+            [d, '2020-08-20 17:44:49.732176']).AND().field('float_col').ne().value(1.5).exec()] == [1]
+        with pytest.raises(DatabaseException) as error:
+            db.query(AllValueTypes).field('int_col').in_(['x'])
+        assert "in_() values must be hashable and castable to IntegerColumnType()" in str(error.value)
+
+    def test_aggregates(self, tmpdir):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write("""int_col,float_col,string_col,date_col
+3,1.5,b,2020-08-19 17:44:49.732176
+1,2.5,a,2020-08-20 17:44:49.732176
+2,1.5,c,2020-08-18 17:44:49.732176
+4,0.5,a,2020-08-21 17:44:49.732176
+""")
+        for db in [CsvDatabase(str(tmpdir)), CsvDatabase(str(tmpdir), cache_size=1024 * 1024),
+                   CsvDatabase(str(tmpdir), row_offsets=True)]:
+            assert db.query(AllValueTypes).count() == 4
+            assert db.query(AllValueTypes).field('string_col').eq().value('a').count() == 2
+            assert db.query(AllValueTypes).sum('int_col') == 10
+            assert db.query(AllValueTypes).field('float_col').eq().value(1.5).avg('int_col') == 2.5
+            assert db.query(AllValueTypes).min('date_col') == \
+                datetime.strptime('2020-08-18 17:44:49.732176', AllValueTypes.ALL_VALUE_TYPES_FORMAT_STR)
+            assert db.query(AllValueTypes).max('string_col') == 'c'
+            assert db.query(AllValueTypes).order_by('int_col').limit(2).sum('float_col') == 4.0
+            assert db.query(AllValueTypes).field('int_col').gt().value(10).max('int_col') is None
+            assert db.query(AllValueTypes).group_by('string_col').agg(n='count', total=('sum', 'int_col')) == {
+                'b': {'n': 1, 'total': 3}, 'a': {'n': 2, 'total': 5}, 'c': {'n': 1, 'total': 2}}
+            assert db.query(AllValueTypes).field('int_col').ne().value(2).group_by('float_col', 'string_col') \
+                .agg(low=('min', 'int_col')) == {(1.5, 'b'): {'low': 3}, (2.5, 'a'): {'low': 1}, (0.5, 'a'): {'low': 4}}
+
+    def test_aggregate_leaves_query(self, tmpdir):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write("""int_col,float_col,string_col,date_col
+3,1.5,b,2020-08-19 17:44:49.732176
+1,2.5,a,2020-08-20 17:44:49.732176
+4,0.5,a,2020-08-21 17:44:49.732176
+""")
+        db = CsvDatabase(str(tmpdir))
+        query = db.query(AllValueTypes).field('string_col').eq().value('a')
+        assert query.count() == 2 and query.sum('int_col') == 5
+        assert [e.int_col for e in query.exec()] == [1, 4]
+        grouped = db.query(AllValueTypes).group_by('string_col')
+        assert grouped.agg(n='count') == {'b': {'n': 1}, 'a': {'n': 2}}
+        assert grouped.agg(top=('max', 'int_col')) == {'b': {'top': 3}, 'a': {'top': 4}}
+
+    def test_aggregates_skip_entities(self, tmpdir):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write("""int_col,float_col,string_col,date_col
+3,not a float,b,not a date
+1,not a float,a,not a date
+""")
+        db = CsvDatabase(str(tmpdir))
+        assert db.query(AllValueTypes).count() == 2
+        assert db.query(AllValueTypes).field('string_col').eq().value('a').sum('int_col') == 1
+        with pytest.raises(DatabaseException) as error:
+            db.query(AllValueTypes).group_by('string_col').agg(x=('median', 'int_col'))
+        assert "unknown aggregate 'median'" in str(error.value)
+        for function in ['sum', 'avg']:
+            with pytest.raises(DatabaseException) as error:
+                db.query(AllValueTypes).group_by('int_col').agg(x=(function, 'string_col'))
+            assert "aggregate '%s' needs an integer or float field, 'string_col'" % function in str(error.value)
+        with pytest.raises(DatabaseException) as error:
+            db.query(AllValueTypes).avg('date_col')
+        assert "'date_col' of model 'AllValueTypes' is DateColumnType" in str(error.value)
+
+    def test_prepared_query(self, tmpdir):
+        f1 = tmpdir.join(AllValueTypes.__csv_file__)
+        f1.write("""int_col,float_col,string_col,date_col
+3,1.5,b,2020-08-19 17:44:49.732176
+1,2.5,a,2020-08-20 17:44:49.732176
+2,1.5,c,2020-08-18 17:44:49.732176
+4,0.5,a,2020-08-21 17:44:49.732176
+""")
+        db = CsvDatabase(str(tmpdir))
+        prepared = db.prepare(db.query(AllValueTypes).field('string_col').eq().value(Param('s')).OR()
+                              .field('int_col').between(Param('low'), Param('high')).order_by('int_col'))
+        assert [e.int_col for e in prepared.exec(s='a', low=2, high=2)] == [1, 2, 4]
+        assert [e.int_col for e in prepared.exec(s='c', low=4, high=9)] == [2, 4]
+        assert [e.int_col for e in prepared.exec_iter(s='b', low=0, high=0)] == [3]
+
+        prepared = db.prepare(db.query(AllValueTypes).field('int_col').in_(Param('ids')))
+        assert [e.int_col for e in prepared.exec(ids=['1', 4])] == [1, 4]
+        assert prepared.exec(ids=[]) == []
+        with pytest.raises(DatabaseException):
+            prepared.exec(ids=['x'])
+
+    def test_exec_many(self, tmpdir):
+        tmpdir.join(Person.__csv_file__).write("""id,last_name,first_name,parent_id
+1,Smith,Craig,1
+2,Smith,Elizabeth,2
+3,Harris,Joesph,1
+""")
+        tmpdir.join(Message.__csv_file__).write("""id,sender_id,recipient_id,text
+1,1,2,hello
+2,2,3,hi
+3,3,1,hey
+""")
+        db = CsvDatabase(str(tmpdir))
+        queries = [
+            db.query(Message).field('text').eq().value('hello'),
+            db.query(Message).field('sender_id').le().value(2).order_by('id', desc=True),
+            db.query(Person).field('last_name').eq().value('Smith').select('first_name'),
+            db.query(Person).rlambda(lambda p: p.first_name.startswith('J')),
+            db.query(Message).limit(1),
+        ]
+        def fields(entities):
+            return [sorted((k, v) for k, v in vars(e).items() if not isinstance(v, Model)) for e in entities]
+
+        expected = [fields(q.exec()) for q in queries]
+        opened = []
+        open_table = db.query_engine.open_table
+
+        def counting_open_table(model):
+            opened.append(model)
+            return open_table(model)
+        db.query_engine.open_table = counting_open_table
+
+        results = db.exec_many(queries)
+        assert [fields(r) for r in results] == expected
+        assert [[m.id for m in r] for r in results[:2]] == [[1], [2, 1]]
+        assert [p.first_name for p in results[2]] == ['Craig', 'Elizabeth']
+        # one pass over each file for the filters, the parents loaded for the first query are reused by the second
+        assert opened[:2] == [Message, Person] and opened.count(Message) == 2
+        assert results[0][0].sender is results[1][1].sender
+
+    def test_exec_many_casts_lazily(self, tmpdir):
+        tmpdir.join(AllValueTypes.__csv_file__).write("""int_col,float_col,string_col,date_col
+100,1.0,a,2020-01-01 00:00:00.000000
+7,2.0,a,not a date
+100,3.0,b,2021-01-01 00:00:00.000000
+""")
+        db = CsvDatabase(str(tmpdir))
+        queries = [
+            # the second row fails the int_col test, its date_col is never cast
+            db.query(AllValueTypes).field('int_col').eq().value(100).AND().field('date_col').gt()
+              .value(datetime(2020, 6, 1)),
+            # neither is it for the entities, which only get float_col
+            db.query(AllValueTypes).field('string_col').eq().value('a').select('float_col'),
+        ]
+        expected = [[e.float_col for e in q.exec()] for q in queries]
+        assert expected == [[3.0], [1.0, 2.0]]
+        assert [[e.float_col for e in r] for r in db.exec_many(queries)] == expected
+
+    def test_insert_many(self, tmpdir):
+        class Renamed(Model):
+            __csv_file__ = 'renamed.csv'
+            columns = [
+                Column('id', IntegerColumnType(), key=PrimaryKey()),
+                Column('name', StringColumnType(), file_column_name='Full Name'),
+                Column('when', DateColumnType('%Y-%m-%d')),
+            ]
+
+        db = CsvDatabase(str(tmpdir))
+        first = Renamed.create({'id': 1, 'name': 'Smith, Craig', 'when': datetime(2020, 8, 19)})
+        assert db.insert_many(Renamed, [first, {'id': 2, 'name': 'Jones', 'when': datetime(2021, 1, 2)}]) == 2
+        assert tmpdir.join('renamed.csv').read() == """id,Full Name,when
+1,"Smith, Craig",2020-08-19
+2,Jones,2021-01-02
+"""
+        # existing files keep their layout, columns the model doesn't have are left empty
+        tmpdir.join('renamed.csv').write("""when,extra,Full Name,id
+2020-08-19,x,Smith,1""")
+        assert db.insert_many(Renamed, iter([{'id': 3, 'name': 'Fader', 'when': datetime(2022, 3, 4)}])) == 1
+        assert tmpdir.join('renamed.csv').read() == """when,extra,Full Name,id
+2020-08-19,x,Smith,1
+2022-03-04,,Fader,3
+"""
+        assert [(e.id, e.name) for e in db.query(Renamed).exec()] == [(1, 'Smith'), (3, 'Fader')]
+
+        with pytest.raises(ColumnException) as error:
+            db.insert_many(Renamed, [{'id': 4, 'name': 'Brown', 'when': datetime(2022, 3, 4)},
+                                     {'id': '5', 'name': 'Green', 'when': datetime(2022, 3, 4)}])
+        assert 'Cannot cast value of "5" to type "IntegerColumnType()"' in str(error.value.message)
+        # nothing was appended
+        assert len(db.query(Renamed).exec()) == 2
@@ -1,4 +1,7 @@
+import threading
+
 import pytest
+from datetime import datetime
 
 from ormy.datatabase import *
 from ormy.query_engine import *
@@ -40,7 +43,93 @@ class TestDatabase:
             EqExpr().children(FieldExpr('int_col'), ValueExpr(100)),
             EqExpr().children(FieldExpr('string_col'), ValueExpr(200))))
 
+    def test_convert_query_limit_offset(self):
+        expr_tree = Database().query(AllValueTypes).field('int_col').eq().value(100).offset(5).limit(10).compile()
+        assert expr_tree == LimitExpr(10).children(OffsetExpr(5).children(QueryExpr(AllValueTypes).children(
+            EqExpr().children(FieldExpr('int_col'), ValueExpr(100)))))
+        expr_tree = Database().query(AllValueTypes).limit(10).compile()
+        assert expr_tree == LimitExpr(10).children(QueryExpr(AllValueTypes).children(ValueExpr(True)))
+        query_expr, modifiers = QueryModifiers.unwrap(
+            Database().query(AllValueTypes).limit(10).offset(5).limit(3).compile())
+        assert isinstance(query_expr, QueryExpr)
+        assert modifiers.limit == 3 and modifiers.offset == 5
+
+    def test_bad_limit(self):
+        with pytest.raises(DatabaseException) as error:
+            Database().query(AllValueTypes).limit(-1)
+        assert "limit must be a non-negative integer, not '-1'" in str(error.value)
+
+    def test_bad_select(self):
+        with pytest.raises(DatabaseException) as error:
+            Database().query(AllValueTypes).select()
+        assert "select needs at least one field" in str(error.value)
+        with pytest.raises(DatabaseException) as error:
+            Database().query(AllValueTypes).select('int_col', 'bad_field_name')
+        assert "field 'bad_field_name' does not exist in model 'AllValueTypes'" in str(error.value)
+
     def test_bad_field_name(self):
         with pytest.raises(DatabaseException) as error:
             Database().query(AllValueTypes).field('bad_field_name')
         assert "field 'bad_field_name' does not exist in model 'AllValueTypes'" in str(error.value)
+
+    def test_compile_filter(self):
+        expr_tree = Database().query(AllValueTypes).field('int_col').eq().value(100).AND().field('string_col') \
+            .flambda(lambda s: s.startswith('foo')).compile()
+        predicate = QueryEngine().compile_filter(expr_tree.left)
+
+        def entity(int_col, string_col):
+            return AllValueTypes.create({'int_col': int_col, 'float_col': 1.0, 'string_col': string_col,
+                                         'date_col': datetime.now()})
+        assert predicate(entity(100, 'foobar'))
+        assert not predicate(entity(100, 'bar'))
+        assert not predicate(entity(101, 'foobar'))
+
+    def test_plan_cache(self):
+        db = Database()
+
+        def query(value, other):
+            return db.query(AllValueTypes).field('int_col').eq().value(value).OR().field('string_col').eq() \
+                .value(other).AND().field('float_col').eq().value(1.5).limit(3)
+
+        first = query(1, 'a').compile()
+        second = query(2, 'b').compile()
+        assert db.query_engine.plan_cache.stats()['hits'] == 1
+        expected = Database._convert_query_to_raw_expressions(query(2, 'b').context.query)
+        assert second == QueryEngine.convert_expr_list_to_expr_tree(expected)
+        # limit(query(or(eq(int_col, value), and(eq(string_col, other), ...))))
+        assert first.left.left.left.right.value == 1 and second.left.left.left.right.value == 2
+        assert first.left.left.right.left.right.value == 'a' and second.left.left.right.left.right.value == 'b'
+
+    def test_plan_cache_threads(self):
+        db = Database()
+        # one plan for two shapes, every compile evicts the plan another thread may be moving to the end
+        db.query_engine.plan_cache.max_plans = 1
+        queries = [db.query(AllValueTypes).field('int_col').eq().value(1),
+                   db.query(AllValueTypes).field('int_col').eq().value(1).AND().field('string_col').eq().value('a')]
+
+        def compile_all():
+            for i in range(500):
+                queries[i % 2].compile()
+        threads = [threading.Thread(target=compile_all) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = db.query_engine.plan_cache.stats()
+        assert stats['hits'] + stats['misses'] == 2000 and stats['plans'] == 1
+
+    def test_params(self):
+        db = Database()
+        query = db.query(AllValueTypes).field('int_col').eq().value(Param('n'))
+        with pytest.raises(DatabaseException) as error:
+            query.exec()
+        assert "the query has parameter 'n', run it with prepare(query).exec(...)" in str(error.value)
+        prepared = db.prepare(query)
+        assert prepared.params == {'n'}
+        assert prepared.bind({'n': 5}) == db.query(AllValueTypes).field('int_col').eq().value(5).compile()
+        with pytest.raises(DatabaseException) as error:
+            prepared.bind({})
+        assert "missing values for parameters ['n']" in str(error.value)
+        with pytest.raises(DatabaseException) as error:
+            prepared.bind({'n': 1, 'm': 2})
+        assert "unknown parameters ['m']" in str(error.value)
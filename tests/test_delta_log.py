@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from ormy.column import ColumnException
+from ormy.csv_database import CsvDatabase
+from ormy.delta_log import DeltaLog
+from ormy.query_engine import QueryEngineException
+from tests.models_for_testing import AllValueTypes, Employee, generate_employee_data
+
+
+def employees(db):
+    return [(e.id, e.last_name, e.salary) for e in db.query(Employee).exec()]
+
+
+class TestDeltaLog:
+    @pytest.mark.parametrize('kwargs', [{}, {'cache_size': 1024 * 1024}, {'row_offsets': True}, {'columnar': True}])
+    def test_update_and_delete(self, tmpdir, kwargs):
+        generate_employee_data(tmpdir)
+        file = tmpdir.join(Employee.__csv_file__)
+        original = file.read()
+        db = CsvDatabase(str(tmpdir), **kwargs)
+        # reads before the changes, so cached tables and indexes exist
+        assert len(db.query(Employee).field('last_name').eq().value('Smith').exec()) == 3
+
+        smith = db.query(Employee).field('id').eq().value(3).exec()[0]
+        smith.salary = 333
+        assert db.update_many(Employee, [smith, {'id': 4, 'last_name': 'Vader'}]) == 2
+        assert db.delete_many(Employee, [1, 5]) == 2
+        expected = [(2, 'Jones', 200), (3, 'Smith', 333), (4, 'Vader', 400)]
+        assert employees(db) == expected
+        assert [e.id for e in db.query(Employee).field('last_name').eq().value('Smith').exec()] == [3]
+        assert [e.id for e in db.query(Employee).field('salary').gt().value(300).exec()] == [3, 4]
+        assert db.query(Employee).count() == 3
+        # the changes are only in the log until compacted
+        assert file.read() == original
+
+        assert db.compact(Employee) == 4
+        assert not os.path.exists(str(file) + DeltaLog.SUFFIX)
+        assert file.read() == "id,last_name,salary\n2,Jones,200\n3,Smith,333\n4,Vader,400\n"
+        assert employees(db) == expected
+        assert db.compact(Employee) == 0
+
+    def test_later_entries_win(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir))
+        db.update_many(Employee, [{'id': 2, 'salary': 210}])
+        db.update_many(Employee, [{'id': 2, 'last_name': 'Jonas'}, {'id': 2, 'salary': 220}])
+        db.delete_many(Employee, [4])
+        # an update of a deleted key changes nothing, the key of a missing row neither
+        db.update_many(Employee, [{'id': 4, 'salary': 1}, {'id': 9, 'salary': 1}])
+        assert employees(db)[1:3] == [(2, 'Jonas', 220), (3, 'Smith', 300)]
+        assert [e.id for e in db.query(Employee).exec()] == [1, 2, 3, 5]
+        # a deleted key inserted again
+        db.insert_many(Employee, [{'id': 4, 'last_name': 'Fader', 'salary': 440}])
+        assert employees(db)[-1] == (4, 'Fader', 440)
+
+    def test_delete_entities(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir))
+        smith = db.query(Employee).field('id').eq().value(1).exec()[0]
+        compact = CsvDatabase(str(tmpdir), compact_entities=True).query(Employee).field('id').eq().value(2).exec()[0]
+        assert db.delete_many(Employee, [smith, compact, 3]) == 3
+        assert [e.id for e in db.query(Employee).exec()] == [4, 5]
+
+    def test_incomplete_entry_ignored(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir))
+        db.delete_many(Employee, [1])
+        with open(str(tmpdir.join(Employee.__csv_file__)) + DeltaLog.SUFFIX, 'a') as f:
+            f.write('{"op": "delete", "ke')
+        assert [e.id for e in db.query(Employee).exec()] == [2, 3, 4, 5]
+
+    @pytest.mark.parametrize('background', [False, True])
+    def test_compact_after(self, tmpdir, background):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), compact_after=3, compact_in_background=background)
+        log = str(tmpdir.join(Employee.__csv_file__)) + DeltaLog.SUFFIX
+        db.delete_many(Employee, [1, 2])
+        assert os.path.exists(log)
+        db.update_many(Employee, [{'id': 3, 'salary': 3}])
+        db.query_engine.wait_for_compaction()
+        assert not os.path.exists(log)
+        assert employees(db) == [(3, 'Smith', 3), (4, 'Fader', 400), (5, 'Smith', 500)]
+
+    def test_result_cache_sees_changes(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), result_cache_size=10)
+        assert len(employees(db)) == 5
+        db.delete_many(Employee, [1])
+        assert len(employees(db)) == 4
+        assert len(employees(db)) == 4
+        db.compact(Employee)
+        assert len(employees(db)) == 4
+        stats = db.result_cache.stats()
+        assert stats['hits'] == 1 and stats['invalidations'] == 2
+
+    def test_invalid_changes(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir))
+        with pytest.raises(ColumnException):
+            db.update_many(Employee, [{'id': 1, 'salary': 1}, {'id': 2, 'salary': 'a lot'}])
+        with pytest.raises(QueryEngineException) as error:
+            db.update_many(Employee, [{'salary': 1}])
+        assert "without its primary key 'id'" in str(error.value)
+        with pytest.raises(QueryEngineException) as error:
+            db.update_many(Employee, [{'id': 1, 'age': 1}])
+        assert "field 'age' does not exist in model 'Employee'" in str(error.value)
+        with pytest.raises(QueryEngineException) as error:
+            db.delete_many(AllValueTypes, [1])
+        assert "model 'AllValueTypes' has no primary key" in str(error.value)
+        # nothing was recorded
+        assert not os.path.exists(str(tmpdir.join(Employee.__csv_file__)) + DeltaLog.SUFFIX)
@@ -0,0 +1,124 @@
+from ormy.csv_database import CsvDatabase
+from ormy.index import HashIndex, SortedIndex
+from tests.models_for_testing import Employee, generate_employee_data
+
+
+class TestHashIndex:
+    def test_build_and_lookup(self):
+        rows = [['1', 'a'], ['2', 'b'], ['3', 'a']]
+        index = HashIndex.build('name', lambda row: row[1], rows)
+        assert index.lookup('a') == [0, 2]
+        assert index.lookup('b') == [1]
+        assert index.lookup('c') == []
+        assert len(index) == 2
+
+
+class TestSortedIndex:
+    def test_build_and_range(self):
+        rows = [['3'], ['1'], ['2'], ['1'], ['5']]
+        index = SortedIndex.build('id', lambda row: int(row[0]), rows)
+        assert index.keys == [1, 1, 2, 3, 5]
+        assert index.lookup(1) == [1, 3]
+        assert index.lookup(4) == []
+        assert index.range(2, 3) == [2, 0]
+        assert index.range(1, 3, low_inclusive=False, high_inclusive=False) == [2]
+        assert index.range(high=2) == [1, 3, 2]
+        assert index.range(low=3) == [0, 4]
+        assert index.range(4, 2) == []
+
+
+class TestIndexedQueries:
+    def test_eq_uses_index(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), cache_size=1024 * 1024)
+        data = db.query(Employee).field('id').eq().value(3).exec()
+        assert [e.salary for e in data] == [300]
+        table = db.query_engine.table_cache.get(db.query_engine.model_file(Employee))
+        assert set(table.indexes) == {'id'}
+
+    def test_and_or_combine_indexes(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), cache_size=1024 * 1024)
+        data = db.query(Employee).field('last_name').eq().value('Smith').AND().field('id').eq().value(3).exec()
+        assert [e.id for e in data] == [3]
+        data = db.query(Employee).field('last_name').eq().value('Fader').OR().field('id').eq().value(2).exec()
+        assert [e.id for e in data] == [2, 4]
+        # salary isn't indexed, the index on last_name narrows the rows and the filter does the rest
+        data = db.query(Employee).field('last_name').eq().value('Smith').AND().field('salary').eq().value(500).exec()
+        assert [e.id for e in data] == [5]
+        # salary isn't indexed so the OR needs a full scan
+        data = db.query(Employee).field('last_name').eq().value('Jones').OR().field('salary').eq().value(500).exec()
+        assert [e.id for e in data] == [2, 5]
+
+    def test_range_uses_sorted_index(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), cache_size=1024 * 1024)
+        engine = db.query_engine
+        table = engine.table_cache.get(engine.model_file(Employee))
+        fetched = []
+        fetch_rows = table.fetch_rows
+        table.fetch_rows = lambda positions: fetched.append(positions) or fetch_rows(positions)
+        assert [e.id for e in db.query(Employee).field('id').gt().value(3).exec()] == [4, 5]
+        assert [e.id for e in db.query(Employee).field('id').le().value(2).exec()] == [1, 2]
+        assert [e.id for e in db.query(Employee).field('id').between(2, 4).AND().field('last_name').eq()
+                .value('Smith').exec()] == [3]
+        assert [e.id for e in db.query(Employee).field('id').lt().value(2).OR().field('id').ge().value(5).exec()] \
+            == [1, 5]
+        assert fetched == [[3, 4], [0, 1], [2], [0, 4]]
+        assert isinstance(table.indexes['id'], SortedIndex) and isinstance(table.indexes['last_name'], HashIndex)
+        # only sorted indexes answer ranges
+        assert [e.id for e in db.query(Employee).field('last_name').gt().value('Jones').exec()] == [1, 3, 5]
+        assert len(fetched) == 4
+
+    def test_in_uses_index(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), cache_size=1024 * 1024)
+        table = db.query_engine.table_cache.get(db.query_engine.model_file(Employee))
+        fetched = []
+        fetch_rows = table.fetch_rows
+        table.fetch_rows = lambda positions: fetched.append(positions) or fetch_rows(positions)
+        assert [e.id for e in db.query(Employee).field('last_name').in_(['Jones', 'Fader', 'Brown']).exec()] == [2, 4]
+        assert [e.id for e in db.query(Employee).field('id').in_([5, 1, 9]).exec()] == [1, 5]
+        assert fetched == [[1, 3], [0, 4]]
+
+    def test_index_rebuilt_on_change(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), cache_size=1024 * 1024)
+        assert len(db.query(Employee).field('last_name').eq().value('Smith').exec()) == 3
+        tmpdir.join(Employee.__csv_file__).write("""id,last_name,salary
+1,Smith,100
+2,Jones,200
+""")
+        assert len(db.query(Employee).field('last_name').eq().value('Smith').exec()) == 1
+
+    def test_no_cache_scans(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir))
+        assert [e.id for e in db.query(Employee).field('last_name').eq().value('Smith').exec()] == [1, 3, 5]
+
+    def test_insert_updates_indexes(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), cache_size=1024 * 1024)
+        assert [e.id for e in db.query(Employee).field('last_name').eq().value('Fader').exec()] == [4]
+        assert [e.id for e in db.query(Employee).field('id').gt().value(3).exec()] == [4, 5]
+        table = db.query_engine.table_cache.get(db.query_engine.model_file(Employee))
+        indexes = dict(table.indexes)
+        db.insert_many(Employee, [{'id': 7, 'last_name': 'Fader', 'salary': 700},
+                                  {'id': 0, 'last_name': 'Brown', 'salary': 0}])
+        assert [e.id for e in db.query(Employee).field('last_name').eq().value('Fader').exec()] == [4, 7]
+        assert [e.id for e in db.query(Employee).field('id').gt().value(3).exec()] == [4, 5, 7]
+        assert [e.id for e in db.query(Employee).field('id').lt().value(2).exec()] == [1, 0]
+        # the same table and indexes, extended rather than reloaded
+        assert db.query_engine.table_cache.get(db.query_engine.model_file(Employee)) is table
+        assert table.indexes == indexes and all(table.indexes[f] is indexes[f] for f in indexes)
+        assert db.query_engine.table_cache.stats()['misses'] == 1
+
+    def test_insert_updates_row_offset_indexes(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), row_offsets=True)
+        assert [e.id for e in db.query(Employee).field('last_name').eq().value('Fader').exec()] == [4]
+        offsets = db.query_engine.row_offset_indexes[db.query_engine.model_file(Employee)]
+        index = offsets.indexes['last_name']
+        db.insert_many(Employee, [{'id': 6, 'last_name': 'Fader', 'salary': 600}])
+        assert [e.id for e in db.query(Employee).field('last_name').eq().value('Fader').exec()] == [4, 6]
+        assert db.query_engine.row_offset_indexes[db.query_engine.model_file(Employee)].indexes['last_name'] is index
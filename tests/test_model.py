@@ -1,3 +1,5 @@
+import pickle
+
 import pytest
 
 from ormy.column import *
@@ -175,3 +177,19 @@ class TestModel:
         l2.level2.level3_id = 5
         l2.level2.level3.id = 5
         assert not Model.compare(l1, l2)
+
+    def test_compact_class(self):
+        compact = ModelForTest.compact_class()
+        assert compact is ModelForTest.compact_class() and compact.compact_class() is compact
+        assert compact.model_class() is ModelForTest and ModelForTest.model_class() is ModelForTest
+        assert compact.__name__ == 'ModelForTest' and compact.has_tag('t1')
+        entity = compact()
+        entity.int_col = 1
+        entity.float_col = 2.0
+        assert not hasattr(entity, '__dict__')
+        with pytest.raises(AttributeError):
+            entity.other = 3
+        assert Model.compare(entity, ModelForTest.create({'int_col': 1, 'float_col': 2.0}))
+        assert not Model.compare(entity, ModelForTest.create({'int_col': 1, 'float_col': 3.0}))
+        copy = pickle.loads(pickle.dumps(entity))
+        assert type(copy) is compact and Model.compare(copy, entity)
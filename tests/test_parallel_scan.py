@@ -0,0 +1,85 @@
+import asyncio
+import csv
+
+from ormy.async_database import AsyncDatabase
+from ormy.csv_database import CsvDatabase
+from ormy.parallel_scan import ParallelScan, record_boundaries, partition, read_partition_rows
+from tests.models_for_testing import Employee, Person
+
+
+def write_people(tmpdir, count):
+    f1 = tmpdir.join(Person.__csv_file__)
+    with open(str(f1), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'last_name', 'first_name', 'parent_id'])
+        for i in range(count):
+            # quoted fields with newlines and escaped quotes
+            writer.writerow([i, 'Smith\n"%d"' % (i % 7), 'first,\nname %d' % i, 0])
+    return str(f1)
+
+
+class TestParallelScan:
+    def test_record_boundaries_skip_quoted_newlines(self, tmpdir):
+        f1 = tmpdir.join('f1.csv')
+        f1.write_binary(b'a,b\n1,"x\ny"\n2,"""\n"""\n3,z\n')
+        # header, then records at 4, 12, 22
+        assert record_boundaries(str(f1), [0]) == [4]
+        assert record_boundaries(str(f1), [5, 8, 13, 14, 27]) == [12, 12, 22, 22, 26]
+        assert record_boundaries(str(f1), [4, 4]) == [12, 12]
+
+    def test_partition_rows(self, tmpdir):
+        path = write_people(tmpdir, 200)
+        with open(path, newline='') as f:
+            expected = list(csv.reader(f))[1:]
+        for parts in [1, 2, 3, 7, 50]:
+            ranges = partition(path, parts)
+            assert len(ranges) <= parts
+            rows = [row for start, end in ranges for row in read_partition_rows(path, start, end)]
+            assert rows == expected
+
+    def test_parallel_query(self, tmpdir):
+        write_people(tmpdir, 500)
+        sequential = CsvDatabase(str(tmpdir))
+        parallel = CsvDatabase(str(tmpdir), workers=3, parallel_min_bytes=0)
+        for db in [sequential, parallel]:
+            data = db.query(Person).field('last_name').eq().value('Smith\n"3"').order_by('id', desc=True).exec()
+            assert [p.id for p in data] == [i for i in reversed(range(500)) if i % 7 == 3]
+            assert data[0].parent.id == 0
+            assert data[0].first_name == 'first,\nname %d' % data[0].id
+        # the workers were started once, for the engine
+        pool = parallel.query_engine._parallel_pool
+        assert pool is not None
+        assert len(parallel.query(Person).field('id').lt().value(10).exec()) == 10
+        assert parallel.query_engine._parallel_pool is pool
+        parallel.query_engine.close()
+
+    def test_sequential_fallbacks(self, tmpdir, monkeypatch):
+        write_people(tmpdir, 200)
+        db = CsvDatabase(str(tmpdir), workers=3, parallel_min_bytes=0)
+        scans = []
+        run = ParallelScan.run
+
+        def recording_run(scan):
+            scans.append(scan.filter_expr)
+            return run(scan)
+        monkeypatch.setattr(ParallelScan, 'run', recording_run)
+        # a lambda can't be handed to the workers
+        assert len(db.query(Person).field('id').flambda(lambda i: i < 5).select('id').exec()) == 5
+        assert scans == []
+        adb = AsyncDatabase(db)
+        assert len(asyncio.run(adb.query(Person).field('id').lt().value(5).aexec())) == 5
+        adb.close()
+        assert scans == []
+        assert len(db.query(Person).field('id').lt().value(5).exec()) == 5
+        assert len(scans) == 2
+        db.query_engine.close()
+
+    def test_leading_blank_lines(self, tmpdir):
+        tmpdir.join(Employee.__csv_file__).write('\n\r\nid,last_name,salary\n1,Smith,100\n2,Jones,200\n3,Smith,300\n')
+        path = str(tmpdir.join(Employee.__csv_file__))
+        assert [row for start, end in partition(path, 2) for row in read_partition_rows(path, start, end)] == \
+            [['1', 'Smith', '100'], ['2', 'Jones', '200'], ['3', 'Smith', '300']]
+        for kwargs in [{}, {'workers': 2, 'parallel_min_bytes': 0}]:
+            db = CsvDatabase(str(tmpdir), **kwargs)
+            assert [e.id for e in db.query(Employee).field('salary').lt().value(300).exec()] == [1, 2]
+            db.query_engine.close()
@@ -0,0 +1,134 @@
+from ormy.csv_database import CsvDatabase
+from ormy.delta_log import DeltaLog
+from ormy.query_engine import Param
+from ormy.result_cache import ResultCache, pure
+from tests.models_for_testing import Employee, ModelLevel1, ModelLevel2, ModelLevel3, generate_employee_data
+
+
+def generate_levels(tmpdir):
+    tmpdir.join(ModelLevel1.__csv_file__).write("""id,value,level2_id
+1,100,1
+2,100,22
+""")
+    tmpdir.join(ModelLevel2.__csv_file__).write("""id,value,level3_id
+1,200,3
+22,200,3
+""")
+    tmpdir.join(ModelLevel3.__csv_file__).write("""id,value
+3,300
+""")
+
+
+class TestResultCache:
+    def test_hit_and_miss(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), result_cache_size=10)
+        first = db.query(Employee).field('last_name').eq().value('Smith').exec()
+        first.append(None)
+        second = db.query(Employee).field('last_name').eq().value('Smith').exec()
+        assert [e.id for e in second] == [1, 3, 5]
+        assert second[0] is first[0]
+        assert [e.id for e in db.query(Employee).field('last_name').eq().value('Jones').exec()] == [2]
+        assert db.query(Employee).field('salary').gt().value(150).count() == 4
+        assert db.query(Employee).field('salary').gt().value(150).count() == 4
+        stats = db.result_cache.stats()
+        assert stats['hits'] == 2 and stats['misses'] == 3 and stats['entries'] == 3
+
+    def test_invalidate_on_change(self, tmpdir):
+        generate_levels(tmpdir)
+        db = CsvDatabase(str(tmpdir), result_cache_size=10)
+
+        def level3_values():
+            return [e.level2.level3.value for e in db.query(ModelLevel1).exec()]
+
+        assert level3_values() == [300, 300]
+        assert level3_values() == [300, 300]
+        # the file of a model reached through two foreign keys
+        tmpdir.join(ModelLevel3.__csv_file__).write("""id,value
+3,3000
+""")
+        assert level3_values() == [3000, 3000]
+        stats = db.result_cache.stats()
+        assert stats['hits'] == 1 and stats['misses'] == 2 and stats['invalidations'] == 1
+        assert set(db.query_engine.dependencies(db.query(ModelLevel1).compile())) == {
+            str(tmpdir.join(m.__csv_file__)) + suffix for m in (ModelLevel1, ModelLevel2, ModelLevel3)
+            for suffix in ('', DeltaLog.SUFFIX)}
+        # aggregates and selects without the foreign key object don't resolve it
+        assert db.query_engine.dependencies(db.query(ModelLevel1).select('id').compile()) == \
+            [str(tmpdir.join(ModelLevel1.__csv_file__)), str(tmpdir.join(ModelLevel1.__csv_file__)) + DeltaLog.SUFFIX]
+        assert db.query(ModelLevel1).count() == 2
+        tmpdir.join(ModelLevel2.__csv_file__).write("""id,value,level3_id
+1,2000,3
+22,2000,3
+""")
+        assert db.query(ModelLevel1).count() == 2
+        assert db.result_cache.stats()['hits'] == 2
+
+    def test_lambdas(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), result_cache_size=10)
+
+        @pure
+        def is_smith(name):
+            return name == 'Smith'
+
+        for _ in range(2):
+            assert len(db.query(Employee).field('last_name').flambda(lambda n: n == 'Smith').exec()) == 3
+            assert len(db.query(Employee).field('last_name').flambda(is_smith).exec()) == 3
+        stats = db.result_cache.stats()
+        assert stats['uncacheable'] == 2 and stats['hits'] == 1 and stats['misses'] == 1
+
+    def test_values_are_part_of_the_key(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), result_cache_size=10)
+        assert [e.id for e in db.query(Employee).field('id').eq().value(1).exec()] == [1]
+        assert [e.id for e in db.query(Employee).field('id').eq().value(1.5).exec()] == []
+        assert [e.id for e in db.query(Employee).field('id').in_([1, 2]).limit(1).exec()] == [1]
+        assert [e.id for e in db.query(Employee).field('id').in_([1, 2]).limit(2).exec()] == [1, 2]
+        prepared = db.prepare(db.query(Employee).field('id').eq().value(Param('id')))
+        assert [e.id for e in prepared.exec(id=2)] == [2]
+        assert [e.id for e in prepared.exec(id=3)] == [3]
+        assert [e.id for e in prepared.exec(id=2)] == [2]
+        stats = db.result_cache.stats()
+        assert stats['hits'] == 1 and stats['misses'] == 6
+
+    def test_eviction(self, tmpdir):
+        generate_employee_data(tmpdir)
+        cache = ResultCache(2)
+        db = CsvDatabase(str(tmpdir), result_cache=cache)
+        for i in (1, 2, 1, 3):
+            db.query(Employee).field('id').eq().value(i).exec()
+        assert len(cache) == 2 and cache.stats()['evictions'] == 1
+        db.query(Employee).field('id').eq().value(1).exec()
+        db.query(Employee).field('id').eq().value(2).exec()
+        assert cache.stats()['hits'] == 2
+
+    def test_exec_many(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), result_cache_size=10)
+        queries = [db.query(Employee).field('salary').gt().value(250), db.query(Employee).field('salary').lt().value(250),
+                   db.query(Employee).field('last_name').flambda(lambda n: n == 'Fader')]
+        for _ in range(2):
+            assert [[e.id for e in r] for r in db.exec_many(queries)] == [[3, 4, 5], [1, 2], [4]]
+        stats = db.result_cache.stats()
+        assert stats['hits'] == 2 and stats['misses'] == 2 and stats['uncacheable'] == 2
+
+    def test_shared_between_databases(self, tmpdir):
+        first, second = tmpdir.mkdir('first'), tmpdir.mkdir('second')
+        generate_employee_data(first)
+        generate_employee_data(second)
+        second.join(Employee.__csv_file__).write("id,last_name,salary\n7,Smith,700\n")
+        cache = ResultCache(10)
+        db1 = CsvDatabase(str(first), result_cache=cache)
+        db2 = CsvDatabase(str(second), result_cache=cache)
+        compact = CsvDatabase(str(first), result_cache=cache, compact_entities=True)
+        for _ in range(2):
+            assert [e.id for e in db1.query(Employee).exec()] == [1, 2, 3, 4, 5]
+            assert [e.id for e in db2.query(Employee).exec()] == [7]
+            assert [e.id for e in db2.exec_many([db2.query(Employee)])[0]] == [7]
+            assert type(compact.query(Employee).exec()[0]) is Employee.compact_class()
+        # a database of the same directory shares the results of the first one
+        assert CsvDatabase(str(first), result_cache=cache).query(Employee).count() == 5
+        assert db1.query(Employee).count() == 5
+        stats = cache.stats()
+        assert stats['hits'] == 6 and stats['misses'] == 4
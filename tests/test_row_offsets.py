@@ -0,0 +1,89 @@
+import os
+
+from ormy.csv_database import CsvDatabase
+from ormy.row_offsets import RowOffsetIndex
+from tests.models_for_testing import Employee, generate_employee_data
+
+DATA = 'id,note\n1,"two\nlines"\n\n2,plain\n3,"say ""hi"""\n'
+
+
+class TestRowOffsetIndex:
+    def test_read_rows(self, tmpdir):
+        f1 = tmpdir.join('f1.csv')
+        f1.write(DATA)
+        index = RowOffsetIndex.open(str(f1))
+        assert len(index) == 3
+        assert index.read_rows(0) == [['1', 'two\nlines'], ['2', 'plain'], ['3', 'say "hi"']]
+        assert index.read_rows(1, 2) == [['2', 'plain']]
+        assert index.read_rows(5) == []
+        assert index.fetch_rows([0, 2]) == [['1', 'two\nlines'], ['3', 'say "hi"']]
+        index.close()
+
+    def test_saved_and_reused(self, tmpdir):
+        f1 = tmpdir.join('f1.csv')
+        f1.write(DATA)
+        RowOffsetIndex.open(str(f1)).close()
+        assert os.path.exists(str(f1) + RowOffsetIndex.SUFFIX)
+        saved = RowOffsetIndex._load(str(f1))
+        index = RowOffsetIndex.open(str(f1))
+        assert list(index.offsets) == list(saved.offsets)
+        index.close()
+
+    def test_extended_on_append(self, tmpdir):
+        f1 = tmpdir.join('f1.csv')
+        f1.write(DATA)
+        previous = RowOffsetIndex.open(str(f1))
+        first_rows = previous.read_rows(0)
+        f1.write('4,more\n', mode='a')
+        index = RowOffsetIndex.open(str(f1), previous)
+        assert list(index.offsets)[:3] == list(previous.offsets)
+        assert index.read_rows(3) == [['4', 'more']]
+        # left open for the scans that started with it
+        assert previous.read_rows(0) == first_rows
+        previous.close()
+        index.close()
+
+    def test_rebuilt_on_change(self, tmpdir):
+        f1 = tmpdir.join('f1.csv')
+        f1.write(DATA)
+        index = RowOffsetIndex.open(str(f1))
+        f1.write('id,note\n9,"x\ny"\n10,z\n11,w\n')
+        index = RowOffsetIndex.open(str(f1), index)
+        assert index.read_rows(0) == [['9', 'x\ny'], ['10', 'z'], ['11', 'w']]
+        index.close()
+
+    def test_ranges(self, tmpdir):
+        f1 = tmpdir.join('f1.csv')
+        f1.write(DATA)
+        index = RowOffsetIndex.open(str(f1))
+        ranges = index.ranges(2)
+        assert ranges[0][0] == index.offsets[0] and ranges[-1][1] == os.path.getsize(str(f1))
+        assert [r[1] for r in ranges[:-1]] == [r[0] for r in ranges[1:]]
+        index.close()
+
+
+class TestRowOffsetQueries:
+    def test_paged_query(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), row_offsets=True)
+        data = db.query(Employee).offset(1).limit(2).exec()
+        assert [e.id for e in data] == [2, 3]
+        assert [e.id for e in db.query(Employee).offset(3).exec()] == [4, 5]
+
+    def test_indexed_query(self, tmpdir):
+        generate_employee_data(tmpdir)
+        db = CsvDatabase(str(tmpdir), row_offsets=True)
+        data = db.query(Employee).field('last_name').eq().value('Smith').AND().field('salary').eq().value(300).exec()
+        assert [e.id for e in data] == [3]
+        offsets = db.query_engine.row_offset_indexes[db.query_engine.model_file(Employee)]
+        assert 'last_name' in offsets.indexes
+        tmpdir.join(Employee.__csv_file__).write('6,Smith,600\n', mode='a')
+        data = db.query(Employee).field('last_name').eq().value('Smith').exec()
+        assert [e.id for e in data] == [1, 3, 5, 6]
+
+    def test_leading_blank_lines(self, tmpdir):
+        tmpdir.join(Employee.__csv_file__).write('\r\n\nid,last_name,salary\n1,Smith,100\n2,Jones,200\n3,Smith,300\n')
+        db = CsvDatabase(str(tmpdir), row_offsets=True)
+        assert db.query(Employee).count() == 3
+        assert [e.id for e in db.query(Employee).offset(1).limit(2).exec()] == [2, 3]
+        assert [e.id for e in db.query(Employee).field('last_name').eq().value('Jones').exec()] == [2]
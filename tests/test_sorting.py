@@ -0,0 +1,30 @@
+import random
+
+from ormy.sorting import Descending, top_k, external_sorted
+
+
+class TestSorting:
+    def test_descending(self):
+        assert Descending(2) < Descending(1)
+        assert not Descending(1) < Descending(1)
+        assert sorted([(1, Descending('a')), (1, Descending('b')), (0, Descending('a'))]) == \
+            [(0, Descending('a')), (1, Descending('b')), (1, Descending('a'))]
+
+    def test_top_k(self):
+        items = [(5, 'a'), (1, 'b'), (5, 'c'), (3, 'd'), (1, 'e')]
+        assert top_k(items, 3, lambda i: i[0]) == [(1, 'b'), (1, 'e'), (3, 'd')]
+
+    def test_external_sorted_in_memory(self):
+        items = [[str(i), str(i % 3)] for i in range(20)]
+        result = list(external_sorted(items, lambda i: int(i[1]), 1024 * 1024, lambda i: 1))
+        assert result == sorted(items, key=lambda i: int(i[1]))
+
+    def test_external_sorted_spills_runs(self):
+        rnd = random.Random(1)
+        items = [[str(rnd.randrange(100)), str(i)] for i in range(1000)]
+
+        def key(i):
+            return int(i[0]), Descending(int(i[1]))
+        # every 10 items are spilled to a run on disk
+        result = list(external_sorted(items, key, 9, lambda i: 1))
+        assert result == sorted(items, key=key)
@@ -0,0 +1,69 @@
+from ormy.csv_database import CsvDatabase
+from ormy.table_cache import TableCache
+from tests.models_for_testing import ModelLevel3, ModelLevel2
+
+
+class TestTableCache:
+    def test_hit_and_miss(self, tmpdir):
+        f1 = tmpdir.join('f1.csv')
+        f1.write("""id,value
+1,100
+2,200
+""")
+        cache = TableCache()
+        table = cache.get(str(f1))
+        assert table.header == ['id', 'value']
+        assert table.rows == [['1', '100'], ['2', '200']]
+        assert cache.get(str(f1)) is table
+        stats = cache.stats()
+        assert stats['hits'] == 1 and stats['misses'] == 1 and stats['tables'] == 1
+
+    def test_invalidate_on_change(self, tmpdir):
+        f1 = tmpdir.join('f1.csv')
+        f1.write("""id,value
+1,100
+""")
+        cache = TableCache()
+        cache.get(str(f1))
+        f1.write("""id,value
+1,100
+2,200
+""")
+        assert len(cache.get(str(f1)).rows) == 2
+        stats = cache.stats()
+        assert stats['misses'] == 2 and stats['invalidations'] == 1 and stats['tables'] == 1
+
+    def test_lru_eviction(self, tmpdir):
+        files = []
+        for i in range(3):
+            f = tmpdir.join('f%d.csv' % i)
+            f.write("id,value\n" + "".join("%d,%d\n" % (n, n) for n in range(100)))
+            files.append(str(f))
+        table_size = TableCache().get(files[0]).size
+        cache = TableCache(table_size * 2)
+        cache.get(files[0])
+        cache.get(files[1])
+        cache.get(files[0])
+        cache.get(files[2])
+        # files[1] was the least recently used
+        assert files[0] in cache and files[2] in cache and files[1] not in cache
+        assert cache.stats()['evictions'] == 1
+        assert cache.size <= cache.max_bytes
+
+    def test_database_with_cache(self, tmpdir):
+        f1 = tmpdir.join(ModelLevel2.__csv_file__)
+        f1.write("""id,value,level3_id
+1,200,3
+22,200,3
+""")
+        f2 = tmpdir.join(ModelLevel3.__csv_file__)
+        f2.write("""id,value
+3,300
+""")
+        db = CsvDatabase(str(tmpdir), cache_size=1024 * 1024)
+        for _ in range(3):
+            data = db.query(ModelLevel2).field('value').eq().value(200).exec()
+            assert [e.id for e in data] == [1, 22]
+            assert data[0].level3.value == 300
+        stats = db.query_engine.table_cache.stats()
+        assert stats['misses'] == 2 and stats['hits'] == 4
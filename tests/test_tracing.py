@@ -0,0 +1,139 @@
+import io
+import json
+
+import pytest
+
+from ormy.csv_database import CsvDatabase
+from ormy.query_engine import QueryEngineException
+from ormy.tracing import JsonLinesTracer
+from tests.models_for_testing import AllValueTypes, Employee, ModelLevel1, ModelLevel2, ModelLevel3, \
+    generate_employee_data
+
+
+def by_name(spans):
+    names = {}
+    for span in spans:
+        names.setdefault(span.name, []).append(span)
+    return names
+
+
+class TestTracing:
+    def test_query_spans(self, tmpdir):
+        generate_employee_data(tmpdir)
+        spans = []
+        db = CsvDatabase(str(tmpdir), tracer=spans.append)
+        assert len(db.query(Employee).field('last_name').eq().value('Smith').exec()) == 3
+        assert [s.name for s in spans] == ['compile', 'parse', 'cast', 'filter', 'query']
+        names = by_name(spans)
+        parse, cast, found, query = names['parse'][0], names['cast'][0], names['filter'][0], names['query'][0]
+        assert parse.model is Employee and parse.file == str(tmpdir.join(Employee.__csv_file__))
+        assert parse.rows_read == 5 and parse.bytes_read == tmpdir.join(Employee.__csv_file__).size()
+        assert cast.values_cast == 5 and cast.rows_cast == 3
+        assert found.rows_matched == 3
+        assert query.model is Employee and query.rows_matched == 3 and query.cached is None
+        assert all(s.duration >= 0 for s in spans)
+        assert query.duration >= parse.duration + cast.duration + found.duration
+
+    @pytest.mark.parametrize('kwargs', [{'cache_size': 1024 * 1024}, {'columnar': True}])
+    def test_in_memory_tables(self, tmpdir, kwargs):
+        generate_employee_data(tmpdir)
+        spans = []
+        db = CsvDatabase(str(tmpdir), tracer=spans.append, **kwargs)
+        assert db.query(Employee).field('salary').ge().value(300).count() == 3
+        assert by_name(spans)['parse'][0].bytes_read == 0
+        assert by_name(spans)['filter'][0].rows_matched == 3
+        del spans[:]
+        assert len(db.query(Employee).field('salary').ge().value(300).limit(2).exec()) == 2
+        assert by_name(spans)['cast'][0].rows_cast == 2
+
+    def test_parallel_and_count(self, tmpdir):
+        generate_employee_data(tmpdir)
+        spans = []
+        db = CsvDatabase(str(tmpdir), tracer=spans.append, workers=3, parallel_min_bytes=0)
+        assert len(db.query(Employee).field('salary').ge().value(300).exec()) == 3
+        db.query_engine.close()
+        names = by_name(spans)
+        # the counts come from the worker processes
+        assert names['parse'][0].rows_read == 5
+        assert names['parse'][0].bytes_read == tmpdir.join(Employee.__csv_file__).size() - len('id,last_name,salary\n')
+        assert names['cast'][0].values_cast == 5 and names['filter'][0].rows_matched == 3
+        del spans[:]
+        assert db.query(Employee).count() == 5
+        assert by_name(spans)['parse'][0].rows_read == 5 and by_name(spans)['filter'][0].rows_matched == 5
+
+    def test_failed_columnar_aggregate(self, tmpdir):
+        tmpdir.join(AllValueTypes.__csv_file__).write("int_col,float_col,string_col\n1,1.5,a\n2,2.5,b\n")
+        spans = []
+        db = CsvDatabase(str(tmpdir), tracer=spans.append, columnar=True)
+        with pytest.raises(QueryEngineException) as error:
+            db.query(AllValueTypes).field('int_col').ge().value(2).max('date_col')
+        assert "field 'date_col' of model 'AllValueTypes' is not a column in the csv file" in str(error.value)
+        # the spans of the scan are emitted all the same
+        assert [s.name for s in spans] == ['compile', 'parse', 'cast', 'filter', 'query']
+        assert by_name(spans)['filter'][0].rows_matched == 1
+        assert by_name(spans)['query'][0].error == 'QueryEngineException'
+
+    def test_failed_fk(self, tmpdir):
+        tmpdir.join(ModelLevel1.__csv_file__).write("id,value,level2_id\n1,100,1\n2,100,7\n")
+        tmpdir.join(ModelLevel2.__csv_file__).write("id,value,level3_id\n1,10,3\n")
+        tmpdir.join(ModelLevel3.__csv_file__).write("id,value\n3,300\n")
+        spans = []
+        db = CsvDatabase(str(tmpdir), tracer=spans.append)
+        with pytest.raises(QueryEngineException):
+            db.query(ModelLevel1).exec()
+        names = by_name(spans)
+        # the missing parent is found before the grandparents are resolved
+        assert [(s.model, s.error, s.rows_matched) for s in names['fk']] == [(ModelLevel2, 'QueryEngineException', 1)]
+        assert [(s.error, s.rows_matched) for s in names['query']] == [('QueryEngineException', None)]
+
+    def test_fk_spans(self, tmpdir):
+        tmpdir.join(ModelLevel1.__csv_file__).write("id,value,level2_id\n1,100,1\n2,100,2\n")
+        tmpdir.join(ModelLevel2.__csv_file__).write("id,value,level3_id\n1,10,3\n2,20,3\n9,90,3\n")
+        tmpdir.join(ModelLevel3.__csv_file__).write("id,value\n3,300\n")
+        spans = []
+        db = CsvDatabase(str(tmpdir), tracer=spans.append)
+        db.query(ModelLevel1).exec()
+        fks = by_name(spans)['fk']
+        # the grandparent is resolved within the resolution of the parent
+        assert [(s.model, s.fk_tables_loaded, s.rows_matched) for s in fks] == [(ModelLevel3, 1, 1),
+                                                                                 (ModelLevel2, 1, 2)]
+        assert [s.model for s in by_name(spans)['parse']] == [ModelLevel1, ModelLevel2, ModelLevel3]
+        assert by_name(spans)['parse'][1].rows_read == 3
+
+    def test_result_cache_hit(self, tmpdir):
+        generate_employee_data(tmpdir)
+        spans = []
+        db = CsvDatabase(str(tmpdir), tracer=spans.append, result_cache_size=10)
+        db.query(Employee).exec()
+        del spans[:]
+        db.query(Employee).exec()
+        assert [(s.name, s.cached) for s in spans] == [('query', True)]
+
+    def test_set_tracer(self, tmpdir):
+        generate_employee_data(tmpdir)
+        spans = []
+        db = CsvDatabase(str(tmpdir))
+        db.query(Employee).exec()
+        db.set_tracer(spans.append)
+        # spans of a stream stopped early are emitted when it is closed
+        entities = db.query(Employee).exec_iter()
+        next(entities)
+        entities.close()
+        assert by_name(spans)['cast'][0].rows_cast >= 1
+        db.set_tracer(None)
+        count = len(spans)
+        db.query(Employee).exec()
+        assert len(spans) == count
+
+    def test_json_lines(self, tmpdir):
+        generate_employee_data(tmpdir)
+        out = io.StringIO()
+        tracer = JsonLinesTracer(out)
+        db = CsvDatabase(str(tmpdir), tracer=tracer)
+        db.query(Employee).field('id').eq().value(2).exec()
+        tracer.close()
+        lines = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert [line['name'] for line in lines] == ['compile', 'parse', 'cast', 'filter', 'query']
+        assert lines[1]['model'] == 'Employee' and lines[1]['rows_read'] == 5
+        assert 'rows_matched' not in lines[1]
+        assert lines[3]['rows_matched'] == 1